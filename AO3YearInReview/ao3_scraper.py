@@ -1,306 +1,623 @@
-import requests
+import asyncio
+import os
+import re
+import ssl
+from urllib.parse import urlparse
+
+import certifi
+import httpx
 from bs4 import BeautifulSoup
 import time
-import random
 from datetime import datetime
 
+from history_parser import last_page_number, parse_history_page
+from history_store import page_is_known
+from metrics import (
+    DELAY_SECONDS, LOGIN_SECONDS, PAGE_FETCH_SECONDS, PAGE_ITEMS, PAGE_PARSE_SECONDS, REQUEST_SECONDS,
+    RESPONSES, RETRIES, SLOT_WAIT_SECONDS
+)
+from pacing import (
+    THROTTLE_STATUSES, call_pacer, get_upstream_scheduler, parse_retry_after, sleep_unless_cancelled
+)
+from reading_stats import visited_in_year
+
+
+# Where AO3 is reached; load tests point this at a local stand-in
+# (benchmarks/fake_ao3.py)
+AO3_BASE_URL = os.environ.get('AO3_BASE_URL', 'https://archiveofourown.org').rstrip('/')
+
+# Every request to AO3 waits for a slot from this host's shared scheduler
+AO3_HOST = urlparse(AO3_BASE_URL).netloc
+
+# Server errors retried straight away (see RetryPolicy.status_wait) before a
+# response is handed back
+RETRY_STATUSES = (500, 502, 504)
+
+# Only pages served to a logged-in user carry the user menu
+LOGGED_IN_RE = re.compile(r'id=["\']greeting["\']')
+
+# One TLS context for every scrape's client; building one per client costs
+# tens of milliseconds and its own copy of the CA bundle
+SSL_CONTEXT = ssl.create_default_context(cafile=certifi.where())
+
+# More realistic browser headers to avoid detection
+BROWSER_HEADERS = {
+    'User-Agent': 'Mozilla/5.0 (Windows NT 10.0; Win64; x64) AppleWebKit/537.36 (KHTML, like Gecko) Chrome/131.0.0.0 Safari/537.36',
+    'Accept': 'text/html,application/xhtml+xml,application/xml;q=0.9,image/avif,image/webp,image/apng,*/*;q=0.8,application/signed-exchange;v=b3;q=0.7',
+    'Accept-Language': 'en-US,en;q=0.9',
+    'Accept-Encoding': 'gzip, deflate, br',
+    'Connection': 'keep-alive',
+    'Upgrade-Insecure-Requests': '1',
+    'Sec-Fetch-Dest': 'document',
+    'Sec-Fetch-Mode': 'navigate',
+    'Sec-Fetch-Site': 'none',
+    'Sec-Fetch-User': '?1',
+    'Sec-Ch-Ua': '"Chromium";v="131", "Not_A Brand";v="24"',
+    'Sec-Ch-Ua-Mobile': '?0',
+    'Sec-Ch-Ua-Platform': '"Windows"',
+    'Cache-Control': 'max-age=0',
+    'DNT': '1'
+}
+
+
+class PageFetchError(Exception):
+    """A history page could not be fetched after all per-page attempts"""
+
+
+class ScrapeCancelled(Exception):
+    """The scrape was cancelled through its cancel event"""
+
+
+class RetryPolicy:
+    """
+    How often and after how long a scrape retries, with every wait in seconds
+
+    The defaults are the scraper's long-standing schedule. Subclasses or
+    other settings can be passed to aiter_ao3_history, e.g. by the pacing
+    simulator (benchmarks/simulate_pacing.py) to compare schedules.
+
+    Args:
+        status_retries: Resends of a RETRY_STATUSES response
+        status_backoff: First wait before such a resend, doubled each time
+        page_attempts: Fetches of one history page before the attempt fails
+        page_backoff: Wait after a failed page fetch, times the failures so far
+        ssl_backoff: Cooldown unit after a 525 or TLS error on a page
+        scrape_backoff: Wait before a whole new attempt, times the attempts so far
+    """
+
+    def __init__(self, status_retries=3, status_backoff=1, page_attempts=5, page_backoff=10,
+                 ssl_backoff=30, scrape_backoff=10):
+        self.status_retries = status_retries
+        self.status_backoff = status_backoff
+        self.page_attempts = page_attempts
+        self.page_backoff = page_backoff
+        self.ssl_backoff = ssl_backoff
+        self.scrape_backoff = scrape_backoff
+
+    def status_wait(self, attempt):
+        """Wait before resending after `attempt` (from 0) server errors: 1, 2, 4s"""
+        return self.status_backoff * 2 ** attempt
+
+    def page_wait(self, failures, ssl_error=False):
+        """Wait before fetching a page again: 10, 20, 30, 40s, or 60, 90, 120, 150s after SSL errors"""
+        if ssl_error:
+            return self.ssl_backoff * (failures + 1)
+        return self.page_backoff * failures
+
+    def scrape_wait(self, attempt):
+        """Wait before starting over (from the checkpoint) after attempt `attempt` failed"""
+        return self.scrape_backoff * attempt
+
+
+DEFAULT_RETRY_POLICY = RetryPolicy()
+
+
+async def delay(seconds, cancel_event=None):
+    """Sleep for the specified number of seconds, waking early if cancelled"""
+    loop = asyncio.get_running_loop()
+    started = loop.time()
+    completed = await sleep_unless_cancelled(seconds, cancel_event)
+    DELAY_SECONDS.observe(loop.time() - started)
+    if not completed:
+        raise ScrapeCancelled('Scrape cancelled')
+
+
+def new_session(cookies=None, transport=None):
+    """
+    HTTP client for one scrape, carrying that user's login cookies
+
+    Connection failures are retried by the transport; HTTP statuses are left
+    to paced_request and the page retry loop. A given `transport` (such as
+    an httpx.MockTransport) replaces the network.
+    """
+    return httpx.AsyncClient(
+        headers=BROWSER_HEADERS,
+        cookies=cookies,
+        transport=transport or httpx.AsyncHTTPTransport(retries=3, verify=SSL_CONTEXT),
+        follow_redirects=True,
+        timeout=60,
+    )
+
+
+def export_cookies(session):
+    """The session's cookies as JSON-serialisable dicts, for the login store"""
+    return [
+        {'name': cookie.name, 'value': cookie.value, 'domain': cookie.domain,
+         'path': cookie.path, 'expires': cookie.expires}
+        for cookie in session.cookies.jar
+    ]
+
+
+def import_cookies(session, cookies):
+    """Load cookies saved by export_cookies into a session, skipping expired ones"""
+    now = time.time()
+    for cookie in cookies:
+        if cookie['expires'] is None or cookie['expires'] > now:
+            session.cookies.set(cookie['name'], cookie['value'], domain=cookie['domain'], path=cookie['path'])
+
+
+def is_logged_in_page(response):
+    """True when AO3 served the page to a logged-in user rather than bouncing to the login form"""
+    return response.url.path != '/users/login' and LOGGED_IN_RE.search(response.text) is not None
 
-def delay(seconds):
-    """Sleep for the specified number of seconds"""
-    time.sleep(seconds)
 
+async def store_login(session_store, username, password, session):
+    """Keep a fresh, verified login's cookies so the next scrape can skip the login form"""
+    if not session_store:
+        return
+    try:
+        await asyncio.to_thread(session_store.save, username, password, export_cookies(session))
+    except Exception as e:
+        print(f'Could not store AO3 login: {e}')
 
-def scrape_ao3_history(username, password, year=None, retries=3, on_progress=None):
+
+def is_ssl_error(error):
+    """True when an httpx error was caused by a failed TLS handshake"""
+    while error is not None:
+        if isinstance(error, ssl.SSLError):
+            return True
+        error = error.__cause__ or error.__context__
+    return False
+
+
+async def paced_request(session, method, url, flow, cancel_event=None, policy=DEFAULT_RETRY_POLICY, **kwargs):
+    """
+    Send a request in the scrape's next upstream slot, and report the outcome back
+
+    `flow` is the scrape's UpstreamFlow. A 429 or 503 widens the host pacer's
+    interval and pauses the host for the response's Retry-After; any other
+    response below 400 narrows it again. RETRY_STATUSES are retried as
+    `policy` says, each attempt in a slot of its own.
+    """
+    pacer = flow.pacer
+    loop = asyncio.get_running_loop()
+    for attempt in range(policy.status_retries + 1):
+        started = loop.time()
+        if not await flow.acquire_async(cancel_event):
+            raise ScrapeCancelled('Scrape cancelled')
+        sent = loop.time()
+        SLOT_WAIT_SECONDS.observe(sent - started)
+
+        response = await session.request(method, url, **kwargs)
+        REQUEST_SECONDS.observe(loop.time() - sent)
+        RESPONSES.labels(str(response.status_code)).inc()
+        if response.status_code in THROTTLE_STATUSES:
+            retry_after = parse_retry_after(response.headers.get('retry-after'))
+            interval = await call_pacer(pacer, pacer.on_throttle, retry_after)
+            print(f'AO3 returned {response.status_code}, pacing interval now {interval:.1f} seconds')
+        elif response.status_code < 400:
+            await call_pacer(pacer, pacer.on_success)
+
+        if response.status_code not in RETRY_STATUSES or attempt == policy.status_retries:
+            return response
+        RETRIES.labels(str(response.status_code)).inc()
+        await delay(policy.status_wait(attempt), cancel_event)
+
+
+async def log_in(session, username, password, flow, cancel_event=None, policy=DEFAULT_RETRY_POLICY):
+    """
+    Log `session` in to AO3 through the login form
+
+    Raises:
+        Exception: with a user-facing message when AO3 refuses the login
+            or blocks the request
+    """
+    started = asyncio.get_running_loop().time()
+
+    # Get login page to extract authenticity token
+    print('Fetching login page...')
+    print(f'Making request to: {AO3_BASE_URL}/users/login')
+
+    try:
+        login_page_response = await paced_request(
+            session, 'GET', f'{AO3_BASE_URL}/users/login', flow, cancel_event, policy,
+            timeout=60
+        )
+        print('Login page response status:', login_page_response.status_code)
+
+        if login_page_response.status_code == 429:
+            retry_after = login_page_response.headers.get('retry-after')
+            print('Rate limit detected (429)!')
+            print('Retry-After header:', retry_after)
+            raise Exception(f"AO3 returned 429 (Rate Limited). {f'Retry after {retry_after} seconds.' if retry_after else 'Please wait and try again later.'}")
+
+        if login_page_response.status_code == 403:
+            print('403 Forbidden detected - possible bot detection')
+            raise Exception('AO3 returned 403 Forbidden. This may indicate bot detection or IP blocking. Try again later with a different connection.')
+
+        if login_page_response.status_code == 503:
+            print('503 Service Unavailable - AO3 may be down')
+            raise Exception('AO3 is temporarily unavailable (503). Please try again later.')
+
+        if login_page_response.status_code == 525:
+            print('525 SSL Handshake Failed')
+            raise Exception('SSL connection failed (525). This may be due to network issues or AO3\'s security settings. Try again in a few minutes or check your internet connection.')
+
+        if login_page_response.status_code >= 400:
+            print(f'Unexpected status code: {login_page_response.status_code}')
+            raise Exception(f'AO3 returned error status {login_page_response.status_code}')
+
+        login_page_response.raise_for_status()
+
+    except httpx.HTTPError as fetch_error:
+        print('Failed to fetch login page:', str(fetch_error))
+        raise
+
+    # Verify response is properly decoded (not compressed)
+    response_text = login_page_response.text
+    if response_text and ord(response_text[0]) > 127:
+        # Response appears to still be compressed
+        print('WARNING: Response appears to be compressed. Content-Encoding:', login_page_response.headers.get('Content-Encoding'))
+        raise Exception('Failed to decompress AO3 response. Try installing the brotli package.')
+
+    # Parse login page to get authenticity token
+    login_soup = BeautifulSoup(response_text, 'html.parser')
+
+    # Debug: Check what page we actually got
+    page_title = login_soup.find('title')
+    if page_title:
+        print('Login page title:', page_title.get_text(strip=True))
+
+    # Debug: Look for the login form
+    login_form = login_soup.find('form', {'id': 'new_user'})
+    if not login_form:
+        login_form = login_soup.find('form', {'action': '/users/login'})
+
+    if login_form:
+        print('Login form found')
+    else:
+        print('WARNING: Login form not found!')
+        # Try to find any forms
+        all_forms = login_soup.find_all('form')
+        print(f'Found {len(all_forms)} form(s) on page')
+        for i, form in enumerate(all_forms):
+            print(f'Form {i}: id={form.get("id")}, action={form.get("action")}')
+
+    # Look for authenticity token - try multiple methods
+    token_input = None
+    token = None
+
+    # Method 1: Look by name attribute
+    token_input = login_soup.find('input', {'name': 'authenticity_token'})
+    if token_input and token_input.get('value'):
+        token = token_input['value']
+        print('Found token via name attribute')
+
+    # Method 2: Look by id attribute
+    if not token:
+        token_input = login_soup.find('input', {'id': 'authenticity_token'})
+        if token_input and token_input.get('value'):
+            token = token_input['value']
+            print('Found token via id attribute')
+
+    # Method 3: Look for any input with "token" in the name
+    if not token:
+        all_inputs = login_soup.find_all('input')
+        for inp in all_inputs:
+            input_name = inp.get('name', '').lower()
+            if 'token' in input_name or 'csrf' in input_name:
+                if inp.get('value'):
+                    token = inp['value']
+                    print(f'Found token via input name: {inp.get("name")}')
+                    break
+
+    if not token:
+        # Check if we got a CAPTCHA or error page
+        captcha = login_soup.find('div', class_='g-recaptcha')
+        if captcha:
+            raise Exception('AO3 is requiring CAPTCHA verification. This usually happens when too many requests are made. Please try again later or access AO3 directly in your browser first.')
+
+        # Check for cloudflare or other blocking
+        if 'cloudflare' in login_page_response.text.lower() or 'checking your browser' in login_page_response.text.lower():
+            raise Exception('AO3 is using anti-bot protection. Please try again in a few minutes.')
+
+        # Check if AO3 is in maintenance mode
+        if 'maintenance' in login_page_response.text.lower():
+            raise Exception('AO3 appears to be in maintenance mode. Please try again later.')
+
+        # Generic error with detailed debugging
+        print('=' * 50)
+        print('ERROR: Could not find authenticity token')
+        print('Response URL:', login_page_response.url)
+        print('Response status:', login_page_response.status_code)
+        print('Response headers:', dict(login_page_response.headers))
+        print('Response length:', len(login_page_response.text))
+        print('First 1000 chars of response:')
+        print(login_page_response.text[:1000])
+        print('=' * 50)
+
+        # Save full response for debugging
+        try:
+            import os
+            debug_dir = '/tmp/cc-agent'
+            os.makedirs(debug_dir, exist_ok=True)
+            debug_path = os.path.join(debug_dir, 'ao3_login_page_debug.html')
+            with open(debug_path, 'w', encoding='utf-8') as f:
+                f.write(response_text)
+            print(f'Full response saved to {debug_path}')
+        except Exception as e:
+            print(f'Could not save debug file: {e}')
+
+        raise Exception('Could not find authenticity token on login page. AO3 may be blocking automated access or their page structure has changed. Check logs for details.')
+
+    print('Authenticity token found:', token[:20] + '...' if len(token) > 20 else token)
+
+    # Prepare login data
+    login_data = {
+        'user[login]': username,
+        'user[password]': password,
+        'authenticity_token': token
+    }
+
+    # Login
+    print('Attempting login...')
+    login_response = await paced_request(
+        session, 'POST', f'{AO3_BASE_URL}/users/login', flow, cancel_event, policy,
+        data=login_data,
+        headers={
+            'Content-Type': 'application/x-www-form-urlencoded',
+            'Referer': f'{AO3_BASE_URL}/users/login',
+            'Origin': AO3_BASE_URL
+        },
+        timeout=60
+    )
+
+    print('Login response received')
+    print('Response status:', login_response.status_code)
+
+    # Check if login was successful
+    login_check_soup = BeautifulSoup(login_response.text, 'html.parser')
+    error_element = login_check_soup.find(class_='error')
+
+    if error_element:
+        error_text = error_element.get_text(strip=True)
+        if 'password' in error_text.lower() or "couldn't find" in error_text.lower():
+            raise Exception('Invalid username or password')
+
+    # Verify we're logged in by checking for user-specific elements
+    user_nav = login_check_soup.find(id='greeting')
+    is_logged_in = user_nav is not None
+
+    print('Login verification - user nav found:', is_logged_in)
+    if user_nav:
+        print('User greeting text:', user_nav.get_text(strip=True))
+
+    if not is_logged_in:
+        print('Login may have failed - no user navigation found')
+        page_title = login_check_soup.find('title')
+        if page_title:
+            print('Page title:', page_title.get_text(strip=True))
+
+        # Try to find any error messages
+        all_errors = login_check_soup.find_all(class_=['error', 'alert', 'notice'])
+        if all_errors:
+            error_messages = [el.get_text(strip=True) for el in all_errors]
+            print('Found error messages:', error_messages)
+            raise Exception(f"Login failed: {', '.join(error_messages)}")
+
+        print('No error messages found but login verification failed')
+
+    LOGIN_SECONDS.observe(asyncio.get_running_loop().time() - started)
+    print('Login successful')
+
+
+def scrape_ao3_history(username, password, year=None, retries=3, on_progress=None, store=None,
+                       cancel_event=None, session_store=None):
     """
     Scrape AO3 reading history for a given user
 
+    Collects aiter_ao3_history into a list; see there for the arguments.
+
+    Returns:
+        List of history items
+    """
+    return list(iter_ao3_history(
+        username, password, year,
+        retries=retries, on_progress=on_progress, store=store, cancel_event=cancel_event,
+        session_store=session_store
+    ))
+
+
+def iter_ao3_history(username, password, year=None, retries=3, on_progress=None, store=None,
+                     cancel_event=None, session_store=None):
+    """
+    Stream AO3 reading history for a given user, newest first, from sync code
+
+    Runs aiter_ao3_history on an event loop of its own in the calling
+    thread; see there for the arguments.
+    """
+    loop = asyncio.new_event_loop()
+    history = aiter_ao3_history(
+        username, password, year,
+        retries=retries, on_progress=on_progress, store=store, cancel_event=cancel_event,
+        session_store=session_store
+    )
+    try:
+        while True:
+            try:
+                item = loop.run_until_complete(history.__anext__())
+            except StopAsyncIteration:
+                return
+            yield item
+    finally:
+        loop.run_until_complete(history.aclose())
+        loop.close()
+
+
+async def aiter_ao3_history(username, password, year=None, retries=3, on_progress=None, store=None,
+                            cancel_event=None, session_store=None, retry_policy=None, scheduler=None,
+                            transport=None):
+    """
+    Stream AO3 reading history for a given user, newest first
+
+    Items are yielded as soon as their page is parsed, and only the current
+    page is held in memory. With a store, fetched pages go through the
+    checkpoint table and are merged into the stored history in the database.
+
+    Every wait is an asyncio sleep and every request goes through an async
+    HTTP client, so one event loop can run many scrapes at once; store
+    calls run in worker threads so SQLite locks never block the loop.
+
     Args:
         username: AO3 username
         password: AO3 password
         year: Optional year to filter results (int or None)
         retries: Number of retry attempts
         on_progress: Optional callback function for progress updates
-
-    Returns:
-        List of history items
+        store: Optional HistoryStore; when it holds the user's complete history,
+            paging stops at the first page that is already stored. Each fetched
+            page is also checkpointed there, so a failed scrape can be resumed
+            by a later request
+        cancel_event: Optional threading.Event; setting it stops the scrape
+            with ScrapeCancelled at the next wait or page
+        session_store: Optional SessionStore; a login stored there for this
+            username and password is reused instead of the login form (the
+            first history page shows whether AO3 still accepts it), and
+            fresh logins are stored
+        retry_policy: Optional RetryPolicy; defaults to DEFAULT_RETRY_POLICY
+        scheduler: Optional UpstreamScheduler to pace requests with instead of
+            the process-wide one for AO3_HOST
+        transport: Optional httpx transport that replaces the network
+
+    Yields:
+        Work item dicts (only those visited in `year` when it is set). Each
+        page's items are yielded before its progress update is sent
     """
+    stored_visits, stored_complete = {}, False
+    if store:
+        try:
+            stored_visits, stored_complete = await asyncio.to_thread(store.load_visits, username)
+            print(f'History cache: {len(stored_visits)} stored items (complete: {stored_complete})')
+        except Exception as e:
+            print(f'Could not load history cache: {e}')
+    # Only a complete stored history lets us stop paging early
+    known_visits = stored_visits if stored_complete else {}
+
+    def matches_year(item):
+        return not year or visited_in_year(item, year)
+
+    # Pagination cursor, kept across attempts so a retry resumes from the
+    # last good page instead of starting over
+    total_items = 0
+    current_page = 1
+    # Checkpointed pages are streamed only once AO3 has shown this user's
+    # history, so a wrong password never sees what an earlier scrape fetched
+    resume_pages = 0
+    if store:
+        try:
+            checkpoint_start = await asyncio.to_thread(store.checkpoint_start, username, year)
+        except Exception as e:
+            print(f'Could not load scrape checkpoint: {e}')
+            checkpoint_start = None
+        if checkpoint_start:
+            current_page = checkpoint_start
+            resume_pages = checkpoint_start - 1
+            print(f'Resuming from checkpoint at page {current_page}')
+
+    # Without a complete cache, a past year can skip the pages that an earlier
+    # scrape saw holding only newer works. The first page fetched is checked
+    # before anything is skipped for good.
+    skipped_to = None
+    if store and year and not stored_complete and current_page == 1:
+        try:
+            start_page = await asyncio.to_thread(store.find_start_page, username, year)
+        except Exception as e:
+            print(f'Could not read history page coverage: {e}')
+            start_page = None
+        if start_page and start_page > 1:
+            print(f'Pages before {start_page} only held works newer than {year}, starting at page {start_page}')
+            current_page = skipped_to = start_page
+    verify_skip = skipped_to is not None
+
+    # This scrape's fair share of the requests every scrape sends to AO3
+    flow = (scheduler or get_upstream_scheduler(AO3_HOST)).open_flow()
+    policy = retry_policy or DEFAULT_RETRY_POLICY
+
     for attempt in range(1, retries + 1):
+        session = None
         try:
             print(f"Starting AO3 scraper (attempt {attempt}/{retries})...")
 
-            # Create session for cookie management
-            session = requests.Session()
-
-            # Configure adapter with retry strategy for SSL errors
-            from requests.adapters import HTTPAdapter
-            from urllib3.util.retry import Retry
-
-            # Create retry strategy
-            retry_strategy = Retry(
-                total=3,
-                backoff_factor=1,
-                status_forcelist=[429, 500, 502, 503, 504],
-            )
-            adapter = HTTPAdapter(max_retries=retry_strategy)
-            session.mount("https://", adapter)
-            session.mount("http://", adapter)
-
-            # More realistic browser headers to avoid detection
-            session.headers.update({
-                'User-Agent': 'Mozilla/5.0 (Windows NT 10.0; Win64; x64) AppleWebKit/537.36 (KHTML, like Gecko) Chrome/131.0.0.0 Safari/537.36',
-                'Accept': 'text/html,application/xhtml+xml,application/xml;q=0.9,image/avif,image/webp,image/apng,*/*;q=0.8,application/signed-exchange;v=b3;q=0.7',
-                'Accept-Language': 'en-US,en;q=0.9',
-                'Accept-Encoding': 'gzip, deflate, br',
-                'Connection': 'keep-alive',
-                'Upgrade-Insecure-Requests': '1',
-                'Sec-Fetch-Dest': 'document',
-                'Sec-Fetch-Mode': 'navigate',
-                'Sec-Fetch-Site': 'none',
-                'Sec-Fetch-User': '?1',
-                'Sec-Ch-Ua': '"Chromium";v="131", "Not_A Brand";v="24"',
-                'Sec-Ch-Ua-Mobile': '?0',
-                'Sec-Ch-Ua-Platform': '"Windows"',
-                'Cache-Control': 'max-age=0',
-                'DNT': '1'
-            })
-
-            # Small initial delay to appear more natural
-            initial_delay = random.uniform(1, 2)
-            print(f'Waiting {initial_delay:.1f} seconds before starting...')
-            delay(initial_delay)
-
-            # Get login page to extract authenticity token
-            print('Fetching login page...')
-            print('Making request to: https://archiveofourown.org/users/login')
-
-            try:
-                login_page_response = session.get(
-                    'https://archiveofourown.org/users/login',
-                    timeout=60
-                )
-                print('Login page response status:', login_page_response.status_code)
-
-                if login_page_response.status_code == 429:
-                    retry_after = login_page_response.headers.get('retry-after')
-                    print('Rate limit detected (429)!')
-                    print('Retry-After header:', retry_after)
-                    raise Exception(f"AO3 returned 429 (Rate Limited). {f'Retry after {retry_after} seconds.' if retry_after else 'Please wait and try again later.'}")
-
-                if login_page_response.status_code == 403:
-                    print('403 Forbidden detected - possible bot detection')
-                    raise Exception('AO3 returned 403 Forbidden. This may indicate bot detection or IP blocking. Try again later with a different connection.')
-
-                if login_page_response.status_code == 503:
-                    print('503 Service Unavailable - AO3 may be down')
-                    raise Exception('AO3 is temporarily unavailable (503). Please try again later.')
-
-                if login_page_response.status_code == 525:
-                    print('525 SSL Handshake Failed')
-                    raise Exception('SSL connection failed (525). This may be due to network issues or AO3\'s security settings. Try again in a few minutes or check your internet connection.')
-
-                if login_page_response.status_code >= 400:
-                    print(f'Unexpected status code: {login_page_response.status_code}')
-                    raise Exception(f'AO3 returned error status {login_page_response.status_code}')
-
-                login_page_response.raise_for_status()
-
-            except requests.exceptions.RequestException as fetch_error:
-                print('Failed to fetch login page:', str(fetch_error))
-                raise
-
-            # Verify response is properly decoded (not compressed)
-            response_text = login_page_response.text
-            if response_text and ord(response_text[0]) > 127:
-                # Response appears to still be compressed
-                print('WARNING: Response appears to be compressed. Content-Encoding:', login_page_response.headers.get('Content-Encoding'))
-                raise Exception('Failed to decompress AO3 response. Try installing the brotli package.')
-
-            # Parse login page to get authenticity token
-            login_soup = BeautifulSoup(response_text, 'html.parser')
-
-            # Debug: Check what page we actually got
-            page_title = login_soup.find('title')
-            if page_title:
-                print('Login page title:', page_title.get_text(strip=True))
-
-            # Debug: Look for the login form
-            login_form = login_soup.find('form', {'id': 'new_user'})
-            if not login_form:
-                login_form = login_soup.find('form', {'action': '/users/login'})
-
-            if login_form:
-                print('Login form found')
-            else:
-                print('WARNING: Login form not found!')
-                # Try to find any forms
-                all_forms = login_soup.find_all('form')
-                print(f'Found {len(all_forms)} form(s) on page')
-                for i, form in enumerate(all_forms):
-                    print(f'Form {i}: id={form.get("id")}, action={form.get("action")}')
-
-            # Look for authenticity token - try multiple methods
-            token_input = None
-            token = None
-
-            # Method 1: Look by name attribute
-            token_input = login_soup.find('input', {'name': 'authenticity_token'})
-            if token_input and token_input.get('value'):
-                token = token_input['value']
-                print('Found token via name attribute')
-
-            # Method 2: Look by id attribute
-            if not token:
-                token_input = login_soup.find('input', {'id': 'authenticity_token'})
-                if token_input and token_input.get('value'):
-                    token = token_input['value']
-                    print('Found token via id attribute')
-
-            # Method 3: Look for any input with "token" in the name
-            if not token:
-                all_inputs = login_soup.find_all('input')
-                for inp in all_inputs:
-                    input_name = inp.get('name', '').lower()
-                    if 'token' in input_name or 'csrf' in input_name:
-                        if inp.get('value'):
-                            token = inp['value']
-                            print(f'Found token via input name: {inp.get("name")}')
-                            break
-
-            if not token:
-                # Check if we got a CAPTCHA or error page
-                captcha = login_soup.find('div', class_='g-recaptcha')
-                if captcha:
-                    raise Exception('AO3 is requiring CAPTCHA verification. This usually happens when too many requests are made. Please try again later or access AO3 directly in your browser first.')
-
-                # Check for cloudflare or other blocking
-                if 'cloudflare' in login_page_response.text.lower() or 'checking your browser' in login_page_response.text.lower():
-                    raise Exception('AO3 is using anti-bot protection. Please try again in a few minutes.')
-
-                # Check if AO3 is in maintenance mode
-                if 'maintenance' in login_page_response.text.lower():
-                    raise Exception('AO3 appears to be in maintenance mode. Please try again later.')
-
-                # Generic error with detailed debugging
-                print('=' * 50)
-                print('ERROR: Could not find authenticity token')
-                print('Response URL:', login_page_response.url)
-                print('Response status:', login_page_response.status_code)
-                print('Response headers:', dict(login_page_response.headers))
-                print('Response length:', len(login_page_response.text))
-                print('First 1000 chars of response:')
-                print(login_page_response.text[:1000])
-                print('=' * 50)
-
-                # Save full response for debugging
+            # Client for cookie management; a stored login skips the login form
+            session = new_session(transport=transport)
+            resumed_login = False
+            login_verified = False
+            if session_store:
                 try:
-                    import os
-                    debug_dir = '/tmp/cc-agent'
-                    os.makedirs(debug_dir, exist_ok=True)
-                    debug_path = os.path.join(debug_dir, 'ao3_login_page_debug.html')
-                    with open(debug_path, 'w', encoding='utf-8') as f:
-                        f.write(response_text)
-                    print(f'Full response saved to {debug_path}')
+                    stored_cookies = await asyncio.to_thread(session_store.load, username, password)
                 except Exception as e:
-                    print(f'Could not save debug file: {e}')
-
-                raise Exception('Could not find authenticity token on login page. AO3 may be blocking automated access or their page structure has changed. Check logs for details.')
-
-            print('Authenticity token found:', token[:20] + '...' if len(token) > 20 else token)
-
-            # Add random delay before logging in (2-4 seconds)
-            login_delay = random.uniform(2, 4)
-            print(f'Waiting {login_delay:.1f} seconds before logging in...')
-            delay(login_delay)
-
-            # Prepare login data
-            login_data = {
-                'user[login]': username,
-                'user[password]': password,
-                'authenticity_token': token
-            }
-
-            # Login
-            print('Attempting login...')
-            login_response = session.post(
-                'https://archiveofourown.org/users/login',
-                data=login_data,
-                headers={
-                    'Content-Type': 'application/x-www-form-urlencoded',
-                    'Referer': 'https://archiveofourown.org/users/login',
-                    'Origin': 'https://archiveofourown.org'
-                },
-                timeout=60
-            )
-
-            print('Login response received')
-            print('Response status:', login_response.status_code)
-
-            # Check if login was successful
-            login_check_soup = BeautifulSoup(login_response.text, 'html.parser')
-            error_element = login_check_soup.find(class_='error')
-
-            if error_element:
-                error_text = error_element.get_text(strip=True)
-                if 'password' in error_text.lower() or "couldn't find" in error_text.lower():
-                    raise Exception('Invalid username or password')
-
-            # Verify we're logged in by checking for user-specific elements
-            user_nav = login_check_soup.find(id='greeting')
-            is_logged_in = user_nav is not None
-
-            print('Login verification - user nav found:', is_logged_in)
-            if user_nav:
-                print('User greeting text:', user_nav.get_text(strip=True))
-
-            if not is_logged_in:
-                print('Login may have failed - no user navigation found')
-                page_title = login_check_soup.find('title')
-                if page_title:
-                    print('Page title:', page_title.get_text(strip=True))
-
-                # Try to find any error messages
-                all_errors = login_check_soup.find_all(class_=['error', 'alert', 'notice'])
-                if all_errors:
-                    error_messages = [el.get_text(strip=True) for el in all_errors]
-                    print('Found error messages:', error_messages)
-                    raise Exception(f"Login failed: {', '.join(error_messages)}")
-
-                print('No error messages found but login verification failed')
-
-            print('Login successful')
-
-            # Add random delay after login before fetching history (2-4 seconds)
-            post_login_delay = random.uniform(2, 4)
-            print(f'Waiting {post_login_delay:.1f} seconds after login...')
-            delay(post_login_delay)
+                    print(f'Could not load stored AO3 login: {e}')
+                    stored_cookies = None
+                if stored_cookies:
+                    import_cookies(session, stored_cookies)
+                    resumed_login = True
+                    print('Reusing stored AO3 login')
+            if not resumed_login:
+                await log_in(session, username, password, flow, cancel_event, policy)
 
             # Fetch all pages of history with pagination
-            history_items = []
-            current_page = 1
-
             if on_progress:
-                on_progress({
-                    'currentPage': 0,
-                    'totalItems': 0,
-                    'status': 'Starting to fetch history pages...'
-                })
+                if skipped_to and verify_skip:
+                    on_progress({
+                        'currentPage': 0,
+                        'totalItems': 0,
+                        'status': f'Skipping ahead to page {current_page}...'
+                    })
+                elif current_page > 1:
+                    on_progress({
+                        'currentPage': current_page - 1,
+                        'totalItems': total_items,
+                        'status': f'Resuming from page {current_page}...'
+                    })
+                else:
+                    on_progress({
+                        'currentPage': 0,
+                        'totalItems': 0,
+                        'status': 'Starting to fetch history pages...'
+                    })
 
             has_more_pages = True
+            reached_cache = False
+            stopped_for_year = False
 
             while has_more_pages:
-                history_url = f'https://archiveofourown.org/users/{username}/readings?page={current_page}'
+                if cancel_event and cancel_event.is_set():
+                    raise ScrapeCancelled('Scrape cancelled')
+
+                history_url = f'{AO3_BASE_URL}/users/{username}/readings?page={current_page}'
                 print(f'Fetching reading history page {current_page}...')
 
                 # Retry logic for individual page fetches
                 page_fetch_attempts = 0
-                max_page_attempts = 5  # Increased from 3
-                history_response = None
+                max_page_attempts = policy.page_attempts
+                fetch_started = asyncio.get_running_loop().time()
 
                 while page_fetch_attempts < max_page_attempts:
+                    history_response = None
                     try:
-                        history_response = session.get(
-                            history_url,
-                            headers={'Referer': 'https://archiveofourown.org/'},
+                        history_response = await paced_request(
+                            session, 'GET', history_url, flow, cancel_event, policy,
+                            headers={'Referer': f'{AO3_BASE_URL}/'},
                             timeout=60
                         )
 
@@ -310,9 +627,8 @@ def scrape_ao3_history(username, password, year=None, retries=3, on_progress=Non
                             raise Exception('SSL connection failed (525)')
 
                         if history_response.status_code == 429:
-                            retry_after = history_response.headers.get('retry-after', '60')
                             print(f'Rate limit detected (429) on page {current_page}')
-                            raise Exception(f'Rate limited. Retry after {retry_after} seconds')
+                            raise Exception('Rate limited (429)')
 
                         if history_response.status_code == 503:
                             print(f'503 Service Unavailable on page {current_page}')
@@ -326,266 +642,139 @@ def scrape_ao3_history(username, password, year=None, retries=3, on_progress=Non
                         print(f'History page {current_page} fetched successfully')
                         break  # Success, exit retry loop
 
-                    except (requests.exceptions.SSLError, requests.exceptions.ConnectionError,
-                            requests.exceptions.Timeout, Exception) as fetch_error:
+                    except ScrapeCancelled:
+                        # Not a failed fetch, so neither retried nor counted
+                        raise
+                    except Exception as fetch_error:
                         page_fetch_attempts += 1
                         error_message = str(fetch_error)
                         print(f'Error fetching page {current_page} (attempt {page_fetch_attempts}/{max_page_attempts}): {error_message}')
 
                         if page_fetch_attempts >= max_page_attempts:
                             print(f'Failed to fetch page {current_page} after {max_page_attempts} attempts')
-                            raise Exception(f'Could not fetch page {current_page} after {max_page_attempts} attempts: {error_message}')
+                            raise PageFetchError(f'Could not fetch page {current_page} after {max_page_attempts} attempts: {error_message}')
+                        RETRIES.labels(str(history_response.status_code) if history_response is not None else 'error').inc()
 
+                        # The pacer already holds requests back after a 429/503
+                        if history_response is not None and history_response.status_code in THROTTLE_STATUSES:
+                            retry_wait = 0
                         # Longer waits for SSL errors (525)
-                        if '525' in error_message or isinstance(fetch_error, requests.exceptions.SSLError):
-                            retry_wait = 30 + (page_fetch_attempts * 30)  # 60s, 90s, 120s, 150s
+                        elif '525' in error_message or is_ssl_error(fetch_error):
+                            retry_wait = policy.page_wait(page_fetch_attempts, ssl_error=True)
                             print(f'SSL error detected - using extended cooldown period')
 
-                            # Recreate session adapter to reset SSL connection state
+                            # Recreate the client (keeping the login cookies) to reset SSL connection state
                             if page_fetch_attempts >= 2:
-                                print('Recreating session adapter to reset connection...')
-                                retry_strategy = Retry(
-                                    total=3,
-                                    backoff_factor=1,
-                                    status_forcelist=[429, 500, 502, 503, 504],
-                                )
-                                adapter = HTTPAdapter(max_retries=retry_strategy)
-                                session.mount("https://", adapter)
-                                session.mount("http://", adapter)
+                                print('Recreating HTTP client to reset connection...')
+                                await session.aclose()
+                                session = new_session(session.cookies, transport)
                         else:
-                            retry_wait = page_fetch_attempts * 10  # 10s, 20s, 30s, 40s
+                            retry_wait = policy.page_wait(page_fetch_attempts)
 
-                        print(f'Waiting {retry_wait} seconds before retrying page {current_page}...')
-                        delay(retry_wait)
+                        if retry_wait:
+                            print(f'Waiting {retry_wait} seconds before retrying page {current_page}...')
+                            await delay(retry_wait, cancel_event)
 
                 if not history_response:
                     raise Exception(f'Failed to get response for page {current_page}')
-
-                soup = BeautifulSoup(history_response.text, 'html.parser')
-
-                # Debug: Log what we're seeing
-                page_title = soup.find('title')
-                if page_title:
-                    print('Page title:', page_title.get_text(strip=True))
-
-                # Try multiple selector patterns
-                possible_selectors = [
-                    'li.reading.work.blurb.group',
-                    'ol.reading li.blurb',
-                    'li.blurb.work',
-                    'li.work.blurb'
-                ]
-
-                work_items = []
-                working_selector = None
-
-                for selector in possible_selectors:
-                    if '.' in selector:
-                        classes = selector.replace('li.', '').split('.')
-                        if selector.startswith('ol.reading'):
-                            ol = soup.find('ol', class_='reading')
-                            if ol:
-                                items = ol.find_all('li', class_='blurb')
-                                work_items = items
-                        else:
-                            items = soup.find_all('li', class_=classes)
-                            work_items = items
-                    else:
-                        work_items = soup.find_all(selector)
-
-                    print(f'Trying selector "{selector}": found {len(work_items)} items')
-                    if len(work_items) > 0:
-                        working_selector = selector
-                        break
-
-                if not work_items:
-                    print('No items found with any selector.')
-
-                items_on_page = 0
-                last_item_on_page = None
-
-                # Debug: Save first item HTML on first page
-                if current_page == 1 and len(work_items) > 0:
+                PAGE_FETCH_SECONDS.observe(asyncio.get_running_loop().time() - fetch_started)
+
+                # The first page doubles as the check that AO3 accepted the
+                # login; a stored login it no longer accepts is replaced
+                if not login_verified:
+                    if not is_logged_in_page(history_response):
+                        if not resumed_login:
+                            raise Exception('Login failed: AO3 did not show the reading history. Check your username and password.')
+                        resumed_login = False
+                        print('Stored AO3 login is no longer accepted, logging in again')
+                        try:
+                            await asyncio.to_thread(session_store.delete, username)
+                        except Exception as e:
+                            print(f'Could not drop stored AO3 login: {e}')
+                        session.cookies.clear()
+                        await log_in(session, username, password, flow, cancel_event, policy)
+                        continue
+                    login_verified = True
+                    # Only a login AO3 has just accepted is worth keeping
+                    if not resumed_login:
+                        await store_login(session_store, username, password, session)
+
+                for page in range(1, resume_pages + 1):
+                    resumed_items = await asyncio.to_thread(store.load_checkpoint_page, username, year, page)
+                    total_items += len(resumed_items)
+                    for item in filter(matches_year, resumed_items):
+                        yield item
+                resume_pages = 0
+
+                parse_started = time.perf_counter()
+                page_items, page_has_next = parse_history_page(history_response.text)
+                last_page = last_page_number(history_response.text)
+                PAGE_PARSE_SECONDS.observe(time.perf_counter() - parse_started)
+                PAGE_ITEMS.observe(len(page_items))
+                flow.remaining_pages = max(last_page - current_page, 0) if last_page else None
+
+                if verify_skip:
+                    verify_skip = False
+                    newer_than = f'{int(year) + 1:04d}-01-01'
+                    visits = [item['lastVisited'] for item in page_items if item['lastVisited']]
+                    if not visits or min(visits) < newer_than:
+                        # Works were removed from the history since; walk it from the start
+                        print(f'Page {current_page} now reaches into {year} or earlier, starting again from page 1')
+                        skipped_to = None
+                        current_page = 1
+                        continue
+
+                if not page_items:
+                    print('No items found on page.')
+
+                # Debug: Save the first history page so the item markup can be inspected
+                if current_page == 1 and page_items:
                     try:
                         import os
                         debug_dir = '/tmp/cc-agent'
                         os.makedirs(debug_dir, exist_ok=True)
                         debug_path = os.path.join(debug_dir, 'ao3_first_item_debug.html')
                         with open(debug_path, 'w', encoding='utf-8') as f:
-                            f.write(str(work_items[0].prettify()))
-                        print(f'First item HTML saved to {debug_path}')
+                            f.write(history_response.text)
+                        print(f'First page HTML saved to {debug_path}')
                     except Exception as e:
                         print(f'Could not save first item debug: {e}')
 
-                for item in work_items:
-                    # Find the title link
-                    title_element = item.find('h4', class_='heading')
-                    if title_element:
-                        title_link = title_element.find('a', href=lambda x: x and '/works/' in x)
-
-                        if title_link:
-                            title = title_link.get_text(strip=True)
-                            link = title_link.get('href')
-
-                            # Find author
-                            author_element = item.find('a', rel='author')
-                            author = author_element.get_text(strip=True) if author_element else 'Unknown'
-
-                            # Extract word count
-                            word_count = 0
-                            stats_element = item.find('dd', class_='words')
-                            if stats_element:
-                                words_text = stats_element.get_text(strip=True).replace(',', '')
-                                try:
-                                    word_count = int(words_text)
-                                except ValueError:
-                                    word_count = 0
-
-                            # Extract tags (separated by type)
-                            tags = []  # Only freeform tags
-                            relationships = []  # Ship tags
-                            characters = []  # Character tags
-
-                            relationship_elements = item.find_all('li', class_='relationships')
-                            for rel_li in relationship_elements:
-                                rel_tag = rel_li.find('a', class_='tag')
-                                if rel_tag:
-                                    relationship = rel_tag.get_text(strip=True)
-                                    relationships.append(relationship)
-
-                            character_elements = item.find_all('li', class_='characters')
-                            for char_li in character_elements:
-                                char_tag = char_li.find('a', class_='tag')
-                                if char_tag:
-                                    characters.append(char_tag.get_text(strip=True))
-
-                            freeform_elements = item.find_all('li', class_='freeforms')
-                            for free_li in freeform_elements:
-                                free_tag = free_li.find('a', class_='tag')
-                                if free_tag:
-                                    tag_text = free_tag.get_text(strip=True)
-                                    tags.append(tag_text)
-
-                            if current_page == 1 and items_on_page == 0 and len(tags) > 0:
-                                print(f'First item freeform tags: {tags}')
-
-                            # Extract warnings
-                            warnings = []
-                            warning_elements = item.find_all('li', class_='warnings')
-                            for warn_li in warning_elements:
-                                warn_tag = warn_li.find('a', class_='tag')
-                                if warn_tag:
-                                    warnings.append(warn_tag.get_text(strip=True))
-
-                            # Extract categories
-                            categories = []
-                            category_elements = item.find_all('li', class_='categories')
-                            for cat_li in category_elements:
-                                cat_tag = cat_li.find('a', class_='tag')
-                                if cat_tag:
-                                    categories.append(cat_tag.get_text(strip=True))
-
-                            # Extract rating
-                            rating_element = item.find('span', class_='rating')
-                            if rating_element:
-                                rating_text = rating_element.find('span', class_='text')
-                                rating = rating_text.get_text(strip=True) if rating_text else 'Not Rated'
-                            else:
-                                rating = 'Not Rated'
-
-                            # Extract fandoms
-                            fandoms = []
-                            fandom_heading = item.find('h5', class_='fandoms')
-                            if fandom_heading:
-                                fandom_links = fandom_heading.find_all('a', class_='tag')
-                                fandoms = [f.get_text(strip=True) for f in fandom_links]
-
-                            # Extract last visited date
-                            last_visited = None
-                            date_text = None
-                            import re
-
-                            # Try multiple approaches to find the date
-
-                            # Approach 1: Look for h4.viewed with "Last visited:"
-                            viewed_heading = item.find('h4', class_='viewed')
-                            if viewed_heading:
-                                full_heading_text = viewed_heading.get_text()
-                                if 'Last visited:' in full_heading_text:
-                                    date_match = re.search(r'(\d{1,2}\s+\w+\s+\d{4})', full_heading_text)
-                                    if date_match:
-                                        date_text = date_match.group(1)
-
-                            # Approach 2: Look for span with datetime attribute
-                            if not date_text:
-                                datetime_span = item.find('span', {'datetime': True})
-                                if datetime_span:
-                                    date_text = datetime_span.get_text(strip=True)
-
-                            # Approach 3: Look in any element with "Last visited" text
-                            if not date_text:
-                                all_text = item.get_text()
-                                if 'Last visited:' in all_text:
-                                    # Find text after "Last visited:"
-                                    match = re.search(r'Last visited:\s*(\d{1,2}\s+\w+\s+\d{4})', all_text)
-                                    if match:
-                                        date_text = match.group(1)
-
-                            # Approach 4: Look for dd element with date class
-                            if not date_text:
-                                date_dd = item.find('dd', class_='date')
-                                if date_dd:
-                                    date_text = date_dd.get_text(strip=True)
-
-                            if date_text:
-                                print(f'Found date text for "{title}": "{date_text}"')
-                                try:
-                                    # Try different date formats
-                                    formats = ['%d %b %Y', '%d %B %Y', '%Y-%m-%d', '%b %d, %Y', '%B %d, %Y']
-                                    for fmt in formats:
-                                        try:
-                                            last_visited = datetime.strptime(date_text, fmt)
-                                            print(f'✓ Parsed date for "{title}": {last_visited.isoformat()} (Year: {last_visited.year})')
-                                            break
-                                        except ValueError:
-                                            continue
-
-                                    if not last_visited:
-                                        print(f'✗ Could not parse date from text: "{date_text}" for "{title}"')
-                                except Exception as e:
-                                    print(f'✗ Error parsing date: {e}')
-                            else:
-                                print(f'✗ No "Last visited" date found for "{title}"')
-
-                            if title and link:
-                                work_item = {
-                                    'title': title,
-                                    'author': author,
-                                    'url': f'https://archiveofourown.org{link}',
-                                    'wordCount': word_count,
-                                    'tags': tags,
-                                    'characters': characters,
-                                    'relationships': relationships,
-                                    'warnings': warnings,
-                                    'categories': categories,
-                                    'rating': rating,
-                                    'fandoms': fandoms,
-                                    'lastVisited': last_visited.isoformat() if last_visited else None
-                                }
-                                history_items.append(work_item)
-
-                                if last_visited:
-                                    last_item_on_page = work_item
-
-                                items_on_page += 1
-
-                print(f'Found {items_on_page} items on page {current_page} (total: {len(history_items)})')
+                    if page_items[0]['tags']:
+                        print(f'First item freeform tags: {page_items[0]["tags"]}')
+
+                items_on_page = len(page_items)
+                last_item_on_page = None
+                for work_item in page_items:
+                    if work_item['lastVisited']:
+                        last_item_on_page = work_item
+                    else:
+                        print(f'✗ No usable "Last visited" date for "{work_item["title"]}"')
+                total_items += items_on_page
+
+                if store:
+                    try:
+                        await asyncio.to_thread(store.save_checkpoint, username, year, current_page, page_items)
+                    except Exception as e:
+                        print(f'Could not save scrape checkpoint: {e}')
+
+                print(f'Found {items_on_page} items on page {current_page} (total: {total_items})')
+
+                # Hand the page to the consumer before reporting progress on it
+                for item in filter(matches_year, page_items):
+                    yield item
+
+                # Everything from here on is already in the history cache
+                if known_visits and page_is_known(page_items, known_visits):
+                    print(f'Page {current_page} is already cached, skipping the remaining pages')
+                    reached_cache = True
+                    has_more_pages = False
 
                 if on_progress:
                     on_progress({
                         'currentPage': current_page,
-                        'totalItems': len(history_items),
-                        'status': f'Fetched page {current_page} - Found {len(history_items)} total items'
+                        'totalItems': total_items,
+                        'status': f'Fetched page {current_page} - Found {total_items} total items'
                     })
 
                 # If filtering by year, check if we should stop
@@ -601,6 +790,7 @@ def scrape_ao3_history(username, password, year=None, retries=3, on_progress=Non
                         print(f'All items from year {target_year} have been collected.')
                         print(f'========================================\n')
                         has_more_pages = False
+                        stopped_for_year = True
                     else:
                         print(f'Last item year ({last_item_year}) is >= target year ({target_year}), continuing...')
                 elif year:
@@ -608,82 +798,80 @@ def scrape_ao3_history(username, password, year=None, retries=3, on_progress=Non
 
                 # Check if there's a next page
                 if has_more_pages:
-                    next_page_link = soup.find('ol', class_='pagination')
-                    if next_page_link:
-                        next_li = next_page_link.find('li', class_='next')
-                        has_more_pages = next_li is not None and items_on_page > 0
-                    else:
-                        has_more_pages = False
+                    has_more_pages = page_has_next and items_on_page > 0
 
+                    # The pacer spaces the page requests out
                     if has_more_pages:
-                        # Progressive delay that increases with page count
-                        # Pages 1-10: 3-6 seconds
-                        # Pages 11-20: 5-8 seconds
-                        # Pages 21-30: 8-12 seconds
-                        # Pages 31+: 12-18 seconds
-                        if current_page <= 10:
-                            random_delay = random.uniform(3, 6)
-                        elif current_page <= 20:
-                            random_delay = random.uniform(5, 8)
-                        elif current_page <= 30:
-                            random_delay = random.uniform(8, 12)
-                        else:
-                            random_delay = random.uniform(12, 18)
-
-                        print(f'Waiting {random_delay:.1f} seconds before next page...')
-                        delay(random_delay)
-
-                        # Extended cooldown every 10 pages to avoid detection
-                        if current_page % 10 == 0:
-                            cooldown_time = 90  # 1.5 minutes
-                            print(f'Completed {current_page} pages, extended cooldown of {cooldown_time} seconds to avoid rate limiting...')
-                            delay(cooldown_time)
-                        # Additional brief pause every 5 pages
-                        elif current_page % 5 == 0:
-                            print(f'Completed {current_page} pages, waiting 30 seconds...')
-                            delay(30)
-
                         current_page += 1
 
-            print(f'\nPagination stopped. Found {len(history_items)} total items across {current_page} pages')
+            print(f'\nPagination stopped. Found {total_items} total items across {current_page} pages')
+
+            if store and skipped_to and login_verified:
+                # The fetched pages go below the stored works that stand for the
+                # skipped ones; the stored history is still not complete
+                try:
+                    merged = await asyncio.to_thread(
+                        store.commit_checkpoint, username, year, current_page, False, first_page=skipped_to
+                    )
+                    if merged is None:
+                        print('Scrape checkpoint has missing pages, history cache not updated')
+                        await asyncio.to_thread(store.clear_checkpoint, username, year)
+                    else:
+                        print(f'History cache updated with pages {skipped_to}-{current_page}')
+                except Exception as e:
+                    print(f'Could not update history cache: {e}')
+            elif store and login_verified:
+                # Stored items only ever go to a scrape AO3 has let in (see HistoryStore)
+                stored_start = None
+                try:
+                    stored_start = await asyncio.to_thread(
+                        store.commit_checkpoint,
+                        username, year, current_page, complete=reached_cache or not stopped_for_year
+                    )
+                    if stored_start is None:
+                        print('Scrape checkpoint has missing pages, history cache not updated')
+                        await asyncio.to_thread(store.clear_checkpoint, username, year)
+                    else:
+                        print(f'History cache updated with {total_items} fetched items')
+                except Exception as e:
+                    print(f'Could not update history cache: {e}')
 
-            # Filter by year if specified
-            filtered_items = history_items
-            if year:
-                filtered_items = [
-                    item for item in history_items
-                    if item.get('lastVisited') and
-                    datetime.fromisoformat(item['lastVisited']).year == int(year)
-                ]
-                print(f'Filtered to {len(filtered_items)} items for year {year}')
+                # Older history that was not fetched again comes from the cache,
+                # a batch at a time off the event loop
+                while stored_start is not None:
+                    stored_items, stored_start = await asyncio.to_thread(
+                        store.read_items, username, stored_start, year
+                    )
+                    for item in stored_items:
+                        yield item
 
-            return filtered_items
+            return
 
         except Exception as error:
             print(f'Attempt {attempt}/{retries} failed: {str(error)}')
 
-            # Check if this is a retryable error
-            is_retryable = isinstance(error, (
-                requests.exceptions.ConnectionError,
-                requests.exceptions.Timeout,
-                requests.exceptions.SSLError
-            ))
+            # Check if this is a retryable error (page failures resume from the checkpoint)
+            is_retryable = isinstance(error, (PageFetchError, httpx.TransportError))
 
             # If it's the last attempt or not retryable, raise appropriate error
             if attempt == retries or not is_retryable:
                 if 'Invalid username or password' in str(error):
                     raise error
-                if isinstance(error, requests.exceptions.SSLError):
+                if is_ssl_error(error):
                     raise Exception('SSL connection error. This may be due to network issues, firewall settings, or AO3\'s security configuration. Try again in a few minutes or check your internet connection.')
-                if isinstance(error, requests.exceptions.Timeout):
+                if isinstance(error, httpx.TimeoutException):
                     raise Exception('Request timed out. AO3 may be slow or unavailable. Try again in a few minutes.')
-                if isinstance(error, requests.exceptions.ConnectionError):
+                if isinstance(error, httpx.TransportError):
                     raise Exception('Connection error. AO3 may be down or blocking requests.')
                 raise error
 
-            # Wait before retrying (exponential backoff)
-            wait_time = attempt * 10
-            print(f'Retrying in {wait_time} seconds...')
-            delay(wait_time)
+            # Wait before retrying
+            wait_time = policy.scrape_wait(attempt)
+            print(f'Retrying in {wait_time} seconds from page {current_page}...')
+            await delay(wait_time, cancel_event)
+
+        finally:
+            if session is not None:
+                await session.aclose()
 
     raise Exception('All retry attempts failed')
@@ -1,6 +1,3 @@
-from queue import Queue
-from threading import Thread
-
 from flask import (
     Flask,
     request,
@@ -11,11 +8,27 @@ from flask import (
 from flask_cors import CORS
 from werkzeug.middleware.proxy_fix import ProxyFix
 
+import asyncio
+import hashlib
+import hmac
 import json
+import re
+import secrets
 import sys
 import os
-from ao3_scraper import scrape_ao3_history
-from image_generator import generate_all_stat_images
+import time
+from ao3_scraper import aiter_ao3_history
+from history_export import EXPORT_FORMATS, ExportUnavailable, export_history
+from history_store import get_default_store
+from image_generator import get_card_png, render_stat_images, warm_render_pool
+from metrics import (
+    JOBS, PACING_INTERVAL_SECONDS, SSE_PAYLOAD_BYTES, STATISTICS_SECONDS, UPSTREAM_QUEUE_DEPTH, render_metrics
+)
+from pacing import pacer_stats
+from reading_stats import StatsAggregator
+from scrape_jobs import COMPLETE, REPLAY_EVENTS, JobQueueFull, create_job_manager
+from session_store import get_default_session_store
+from work_item import json_default
 
 
 # --------------------
@@ -36,6 +49,23 @@ app.wsgi_app = ProxyFix(app.wsgi_app, x_prefix=1)
 
 CORS(app)
 
+# Parsed reading history cache (None when AO3_CACHE_DB=off)
+history_store = get_default_store()
+
+# Encrypted AO3 logins reused between scrapes (None when disabled)
+login_sessions = get_default_session_store()
+
+# Start the card render processes before any other threads exist
+warm_render_pool()
+
+# Bounded worker pool that runs every scrape. Without the history cache
+# there is nowhere to read a finished scrape's items back from, so jobs keep
+# every event instead
+job_manager = create_job_manager(replay_events=REPLAY_EVENTS if history_store else None)
+
+# Per-process secret for the single-flight job keys
+JOB_KEY_SECRET = secrets.token_bytes(32)
+
 print("Python version:", sys.version)
 print("Flask and scraper loaded successfully")
 
@@ -59,10 +89,31 @@ def index():
 def health():
     return jsonify({
         "status": "ok",
-        "timestamp": __import__("datetime").datetime.now().isoformat()
+        "timestamp": __import__("datetime").datetime.now().isoformat(),
+        "jobs": job_manager.stats(),
+        "pacing": pacer_stats()
     })
 
 
+@app.route("/api/metrics", methods=["GET"])
+@app.route("/AO3YearInReview/api/metrics", methods=["GET"])
+def metrics():
+    """Prometheus metrics for every stage of the scrape pipeline"""
+    # Job and pacing gauges are sampled now rather than tracked as they change
+    for state, count in job_manager.stats().items():
+        if state != "asyncSlots":
+            JOBS.labels(state).set(count)
+    for host, stats in pacer_stats().items():
+        PACING_INTERVAL_SECONDS.labels(host).set(stats["interval"])
+        UPSTREAM_QUEUE_DEPTH.labels(host).set(stats["queueDepth"])
+
+    exposition = render_metrics()
+    if exposition is None:
+        return jsonify({"error": "Metrics need the prometheus_client package"}), 501
+    body, content_type = exposition
+    return Response(body, content_type=content_type)
+
+
 @app.route("/api/debug", methods=["GET"])
 def debug():
     file_type = request.args.get("file", "login")
@@ -90,138 +141,188 @@ def debug():
 
 
 
-# --------------------
-# Stats calculation
-# --------------------
+IMAGE_DIGEST_RE = re.compile(r'^[0-9a-f]{64}$')
 
-def calculate_statistics(history_items):
-    stats = {
-        "totalFics": len(history_items),
-        "totalWords": 0,
-        "topTags": [],
-        "topShips": [],
-        "topFandoms": [],
-        "longestFic": {
-            "title": "",
-            "wordCount": 0,
-            "author": "",
-            "url": ""
-        }
+
+@app.route('/api/images/<digest>.png', methods=['GET'])
+@app.route('/AO3YearInReview/api/images/<digest>.png', methods=['GET'])
+def stat_image(digest):
+    """
+    Serve a rendered stat card by its content digest
+
+    The digest covers everything drawn on the card, so a given URL never
+    changes and can be cached by the browser indefinitely.
+    """
+    if not IMAGE_DIGEST_RE.match(digest):
+        return jsonify({'error': 'Invalid image id'}), 404
+
+    etag = f'"{digest}"'
+    headers = {
+        'ETag': etag,
+        'Cache-Control': 'private, max-age=31536000, immutable',
     }
+    if etag in request.headers.get('If-None-Match', ''):
+        return Response(status=304, headers=headers)
+
+    png = get_card_png(digest)
+    if png is None:
+        return jsonify({'error': 'Image expired, please refresh your stats'}), 404
 
-    tag_counts = {}
-    ship_counts = {}
-    fandom_counts = {}
-
-    for item in history_items:
-        word_count = item.get("wordCount", 0)
-        stats["totalWords"] += word_count
-
-        if word_count > stats["longestFic"]["wordCount"]:
-            stats["longestFic"] = {
-                "title": item.get("title", ""),
-                "wordCount": word_count,
-                "author": item.get("author", ""),
-                "url": item.get("url", "")
-            }
-
-        for tag in item.get("tags", []):
-            tag_counts[tag] = tag_counts.get(tag, 0) + 1
-
-        for ship in item.get("relationships", []):
-            ship_counts[ship] = ship_counts.get(ship, 0) + 1
-
-        for fandom in item.get("fandoms", []):
-            fandom_counts[fandom] = fandom_counts.get(fandom, 0) + 1
-
-    stats["topTags"] = [
-        {"tag": tag, "count": count}
-        for tag, count in sorted(
-            tag_counts.items(),
-            key=lambda x: x[1],
-            reverse=True
-        )[:10]
-    ]
-
-    stats["topShips"] = [
-        {"ship": ship, "count": count}
-        for ship, count in sorted(
-            ship_counts.items(),
-            key=lambda x: x[1],
-            reverse=True
-        )[:10]
-    ]
-
-    stats["topFandoms"] = [
-        {"fandom": fandom, "count": count}
-        for fandom, count in sorted(
-            fandom_counts.items(),
-            key=lambda x: x[1],
-            reverse=True
-        )[:10]
-    ]
-
-    return stats
+    return Response(png, mimetype='image/png', headers=headers)
 
 
 # --------------------
-# Scraping routes
+# Scrape jobs
 # --------------------
 
-@app.route('/api/scrape-stream', methods=['GET'])
-@app.route('/AO3YearInReview/api/scrape-stream', methods=['GET'])
-def scrape_stream():
+# Largest batch of work items sent in one 'items' event
+ITEMS_PER_EVENT = 100
 
-    username = request.args.get('username')
-    password = request.args.get('password')
-    year = request.args.get('year')
 
-    if not username or not password:
-        return Response(
-            'event: error\ndata: {"error":"Username and password required"}\n\n',
-            mimetype='text/event-stream'
+async def run_scrape_job(job, username, password, year):
+    """
+    Scrape, compute statistics and render images for one job
+
+    Runs on the job manager's event loop alongside every other scrape; card
+    rendering is handed to a worker thread.
+
+    Work items are consumed as a stream: each page's items go into the
+    statistics aggregator as one batch and out to listeners as an 'items'
+    event, so the job never builds its own list of the history. Every progress event
+    carries the partial top lists, and the final statistics are ready when
+    paging ends. The 'complete' payload only holds statistics and the item
+    count.
+    """
+    aggregator = StatsAggregator(tag_pairs=True)
+    page_items = []
+
+    def publish_items():
+        if page_items:
+            start = time.perf_counter()
+            aggregator.add_many(page_items)
+            STATISTICS_SECONDS.labels('page').observe(time.perf_counter() - start)
+            job.publish('items', {'items': list(page_items)})  # WorkItems, encoded when streamed
+            page_items.clear()
+
+    def on_progress(data):
+        publish_items()
+        job.publish('progress', dict(data, statistics=aggregator.partial()))
+
+    async for item in aiter_ao3_history(
+        username,
+        password,
+        year if year else None,
+        on_progress=on_progress,
+        retries=3,
+        store=history_store,
+        cancel_event=job.cancel_event,
+        session_store=login_sessions
+    ):
+        page_items.append(item)
+        if len(page_items) >= ITEMS_PER_EVENT:
+            publish_items()  # e.g. the stored history after a cache hit
+    publish_items()
+
+    start = time.perf_counter()
+    stats = aggregator.statistics()
+    STATISTICS_SECONDS.labels('final').observe(time.perf_counter() - start)
+
+    try:
+        image_data, timings = await asyncio.to_thread(render_stat_images, stats)
+        stats['imageData'] = image_data
+        print('Card render times: ' + ', '.join(f'{card}={seconds * 1000:.0f}ms' for card, seconds in timings.items()))
+    except Exception as img_err:
+        print("Image generation error:", img_err)
+        stats['imageData'] = {}
+
+    return {'totalItems': aggregator.total_fics, 'statistics': stats}
+
+
+def job_history_items(job):
+    """
+    A finished scrape's items, read back from the history cache
+
+    Jobs do not keep the items they stream. The scrape merged every page it
+    fetched into the stored history, which now holds the same items for the
+    job's user and year. Without the cache, the job's own 'items' events
+    (all kept, see job_manager) are read instead.
+    """
+    if history_store is None:
+        return (
+            item
+            for event, payload in job.events_since(0)
+            if event == 'items'
+            for item in payload['items']
         )
+    username, year = job.history
+    return history_store.iter_items(username, year=year)
 
-    def generate():
-        q = Queue()
 
-        def run_scraper():
-            try:
-                def on_progress(data):
-                    q.put(('progress', data))
+def completed_job(job_id):
+    """
+    Look up a finished scrape whose items can be read back
 
-                items = scrape_ao3_history(
-                    username,
-                    password,
-                    year if year else None,
-                    on_progress=on_progress,
-                    retries=3
-                )
+    Returns:
+        (job, None), or (None, error response) when there is no such job
+    """
+    job = job_manager.get(job_id)
+    if not job:
+        return None, (jsonify({'error': 'Job not found'}), 404)
+    if job.status != COMPLETE:
+        return None, (jsonify({'error': 'Job has not finished'}), 409)
+    return job, None
 
-                stats = calculate_statistics(items)
 
-                try:
-                    image_data = generate_all_stat_images(stats)
-                    stats['imageData'] = image_data
-                except Exception as img_err:
-                    print("Image generation error:", img_err)
-                    stats['imageData'] = {}
+def scrape_job_key(username, password, year):
+    """
+    Single-flight key for a scrape: the same user and year share one job
 
-                q.put(('complete', {'items': items, 'statistics': stats}))
+    The password is part of the keyed hash so only someone presenting the
+    same credentials can attach to a running job and see its results.
+    """
+    message = f'{username.strip().lower()}\0{year or "all"}\0{password}'.encode('utf-8')
+    return hmac.new(JOB_KEY_SECRET, message, hashlib.sha256).hexdigest()
 
-            except Exception as e:
-                q.put(('error', {'error': str(e)}))
 
-        Thread(target=run_scraper, daemon=True).start()
+def submit_scrape_job(username, password, year):
+    job = job_manager.submit(
+        run_scrape_job, username, password, year,
+        key=scrape_job_key(username, password, year),
+        description=f'year={year or "all"}'
+    )
+    job.history = (username, year or None)
+    return job
 
-        # Immediately tell the client we're alive
-        yield 'event: status\ndata: {"message":"started"}\n\n'
 
+def stream_job_events(job, start=0):
+    """
+    SSE response replaying a job's events from `start`, then following it
+
+    Events older than the job's replay window are skipped. If that loses
+    'items' events, the listener gets one 'resync' event instead and reads
+    the full history from /api/jobs/<id>/items once the job is complete.
+    """
+    def generate():
+        index = start
+        resync_sent = False
         while True:
-            event, payload = q.get()
-            yield f'event: {event}\ndata: {json.dumps(payload)}\n\n'
-            if event in ('complete', 'error'):
-                break
+            events = job.events_since(index, timeout=15)
+            if not events:
+                # Keeps proxies from timing out and surfaces disconnects
+                yield ': keepalive\n\n'
+                continue
+            for event, payload in events:
+                index += 1
+                if payload is None:
+                    if event == 'items' and not resync_sent:
+                        resync_sent = True
+                        yield f'id: {index}\nevent: resync\ndata: {{}}\n\n'
+                    continue
+                message = f'id: {index}\nevent: {event}\ndata: {json.dumps(payload, default=json_default)}\n\n'
+                SSE_PAYLOAD_BYTES.labels(event).observe(len(message.encode('utf-8')))
+                yield message
+                if event in ('complete', 'error'):
+                    return
 
     return Response(
         generate(),
@@ -234,6 +335,140 @@ def scrape_stream():
     )
 
 
+@app.route('/api/jobs', methods=['POST'])
+@app.route('/AO3YearInReview/api/jobs', methods=['POST'])
+def create_job():
+    data = request.json or {}
+    username = data.get('username')
+    password = data.get('password')
+    year = data.get('year')
+
+    if not username or not password:
+        return jsonify({'error': 'Username and password required'}), 400
+
+    try:
+        job = submit_scrape_job(username, password, year)
+    except JobQueueFull as e:
+        return jsonify({'error': str(e)}), 503
+
+    return jsonify(job.to_dict()), 202
+
+
+@app.route('/api/jobs/<job_id>', methods=['GET'])
+@app.route('/AO3YearInReview/api/jobs/<job_id>', methods=['GET'])
+def job_status(job_id):
+    job = job_manager.get(job_id)
+    if not job:
+        return jsonify({'error': 'Job not found'}), 404
+    job.touch()
+    return jsonify(job.to_dict())
+
+
+@app.route('/api/jobs/<job_id>', methods=['DELETE'])
+@app.route('/AO3YearInReview/api/jobs/<job_id>', methods=['DELETE'])
+def cancel_job(job_id):
+    job = job_manager.cancel(job_id)
+    if not job:
+        return jsonify({'error': 'Job not found'}), 404
+    return jsonify(job.to_dict())
+
+
+@app.route('/api/jobs/<job_id>/events', methods=['GET'])
+@app.route('/AO3YearInReview/api/jobs/<job_id>/events', methods=['GET'])
+def job_events(job_id):
+    job = job_manager.get(job_id)
+    if not job:
+        return Response(
+            'event: error\ndata: {"error":"Job not found"}\n\n',
+            mimetype='text/event-stream'
+        )
+
+    # EventSource sends Last-Event-ID when it reconnects
+    try:
+        start = int(request.headers.get('Last-Event-ID', 0))
+    except ValueError:
+        start = 0
+    return stream_job_events(job, start)
+
+
+@app.route('/api/jobs/<job_id>/items', methods=['GET'])
+@app.route('/AO3YearInReview/api/jobs/<job_id>/items', methods=['GET'])
+def job_history(job_id):
+    """Every item of a finished job as a JSON array, streamed from the history cache"""
+    job, error = completed_job(job_id)
+    if error:
+        return error
+
+    def generate():
+        separator = '['
+        for item in job_history_items(job):
+            yield separator + json.dumps(item, default=json_default)
+            separator = ','
+        yield ']' if separator == ',' else '[]'
+
+    return Response(generate(), mimetype='application/json', headers={'Cache-Control': 'private, no-store'})
+
+
+@app.route('/api/export', methods=['GET'])
+@app.route('/AO3YearInReview/api/export', methods=['GET'])
+def export_job_history():
+    """
+    Download a finished job's reading history as a file
+
+    The items are streamed from the history cache into the exporter, so the
+    export does not depend on what the job still holds in memory.
+    Query parameters: `job` (the job id) and `format` (parquet, arrow or
+    json; default parquet). Parquet and Arrow files have dictionary-encoded
+    tag columns.
+    """
+    fmt = request.args.get('format', 'parquet')
+    if fmt not in EXPORT_FORMATS:
+        return jsonify({'error': f'Unknown format, use one of: {", ".join(EXPORT_FORMATS)}'}), 400
+
+    job, error = completed_job(request.args.get('job', ''))
+    if error:
+        return error
+
+    try:
+        data = export_history(job_history_items(job), fmt)
+    except ExportUnavailable as e:
+        return jsonify({'error': str(e)}), 501
+
+    mimetype, extension, _ = EXPORT_FORMATS[fmt]
+    return Response(data, mimetype=mimetype, headers={
+        'Content-Disposition': f'attachment; filename="ao3-history.{extension}"',
+        'Cache-Control': 'private, no-store',
+    })
+
+
+# --------------------
+# Scraping routes
+# --------------------
+
+@app.route('/api/scrape-stream', methods=['GET'])
+@app.route('/AO3YearInReview/api/scrape-stream', methods=['GET'])
+def scrape_stream():
+
+    username = request.args.get('username')
+    password = request.args.get('password')
+    year = request.args.get('year')
+
+    if not username or not password:
+        return Response(
+            'event: error\ndata: {"error":"Username and password required"}\n\n',
+            mimetype='text/event-stream'
+        )
+
+    try:
+        job = submit_scrape_job(username, password, year)
+    except JobQueueFull as e:
+        return Response(
+            f'event: error\ndata: {json.dumps({"error": str(e)})}\n\n',
+            mimetype='text/event-stream'
+        )
+
+    return stream_job_events(job)
+
 
 @app.route("/api/scrape", methods=["POST"])
 def scrape():
@@ -246,30 +481,21 @@ def scrape():
         return jsonify({"error": "Username and password required"}), 400
 
     try:
-        history_items = scrape_ao3_history(
-            username,
-            password,
-            year if year else None
-        )
-
-        statistics = calculate_statistics(history_items)
+        job = submit_scrape_job(username, password, year)
+    except JobQueueFull as e:
+        return jsonify({"error": str(e)}), 503
 
-        try:
-            image_data = generate_all_stat_images(statistics)
-            statistics["imageData"] = image_data
-        except Exception:
-            statistics["imageData"] = {}
-
-        return jsonify({
-            "items": history_items,
-            "statistics": statistics
-        })
-
-    except Exception as e:
+    job.wait()
+    if job.status != COMPLETE:
         return jsonify({
-            "error": str(e) or "Failed to scrape history"
+            "error": job.error or "Failed to scrape history"
         }), 500
 
+    return jsonify({
+        "items": [item.to_dict() for item in job_history_items(job)],
+        "statistics": job.result["statistics"]
+    })
+
 
 # --------------------
 # Local dev only
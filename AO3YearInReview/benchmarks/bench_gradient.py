@@ -0,0 +1,66 @@
+"""
+Micro-benchmark for card gradient backgrounds
+
+Compares the old per-pixel mask construction with the column-broadcast
+template and with copying the cached template, as create_gradient does.
+
+Usage:
+    python benchmarks/bench_gradient.py [--rounds N]
+"""
+import argparse
+import time
+
+from PIL import Image, ImageChops
+
+import common  # noqa: F401 - puts the app modules on sys.path
+from image_generator import _gradient_template, create_gradient
+
+WIDTH, HEIGHT = 1080, 1920
+COLOR1, COLOR2 = (115, 0, 10), (74, 0, 6)
+
+
+def per_pixel_gradient(width, height, color1, color2):
+    """The original implementation: one Python int per pixel"""
+    base = Image.new('RGB', (width, height), color1)
+    top = Image.new('RGB', (width, height), color2)
+    mask = Image.new('L', (width, height))
+    mask_data = []
+    for y in range(height):
+        mask_data.extend([int(255 * (y / height))] * width)
+    mask.putdata(mask_data)
+    base.paste(top, (0, 0), mask)
+    return base
+
+
+def uncached_template(width, height, color1, color2):
+    return _gradient_template.__wrapped__(width, height, color1, color2)
+
+
+def time_it(fn, rounds):
+    start = time.perf_counter()
+    for _ in range(rounds):
+        fn(WIDTH, HEIGHT, COLOR1, COLOR2)
+    return (time.perf_counter() - start) / rounds
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.strip().splitlines()[0])
+    parser.add_argument('--rounds', type=int, default=10)
+    args = parser.parse_args()
+
+    reference = per_pixel_gradient(WIDTH, HEIGHT, COLOR1, COLOR2)
+    if ImageChops.difference(reference, create_gradient(WIDTH, HEIGHT, COLOR1, COLOR2)).getbbox():
+        raise SystemExit('create_gradient output differs from the per-pixel reference')
+
+    results = [
+        ('per-pixel putdata', time_it(per_pixel_gradient, args.rounds)),
+        ('column broadcast', time_it(uncached_template, args.rounds)),
+        ('cached template copy', time_it(create_gradient, args.rounds)),
+    ]
+    baseline = results[0][1]
+    for name, seconds in results:
+        print(f'{name:<22} {seconds * 1000:8.2f} ms  {baseline / seconds:7.1f}x')
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,117 @@
+"""
+End-to-end load test of /api/scrape-stream with concurrent SSE clients
+
+Opens --clients server-sent event streams at once, each scraping its own
+user (reader0, reader1, ...), and reports p50/p95/p99 of the time to the
+first event and the time to the 'complete' event. Run it against an app
+pointed at the local stand-in, never at the real AO3:
+
+    python benchmarks/fake_ao3.py --pages 5 &
+    AO3_BASE_URL=http://127.0.0.1:8800 AO3_MIN_REQUEST_INTERVAL=0.05 AO3_CACHE_DB=off python app.py &
+    python benchmarks/bench_load.py --clients 50
+
+Usage:
+    python benchmarks/bench_load.py [--app URL] [--clients N] [--year YYYY]
+        [--timeout S] [--fake-ao3 URL]
+"""
+import argparse
+import asyncio
+import json
+import time
+
+import httpx
+
+
+def percentile(values, fraction):
+    """Nearest-rank percentile of a non-empty list"""
+    ordered = sorted(values)
+    return ordered[min(len(ordered) - 1, max(0, round(fraction * len(ordered)) - 1))]
+
+
+async def run_client(client, app_url, username, year, timeout):
+    """
+    Follow one scrape's event stream to the end
+
+    Returns:
+        Dict with 'first' and 'complete' (seconds since the request, None if
+        not reached), 'events', and 'error' (message or None)
+    """
+    params = {'username': username, 'password': 'password'}
+    if year:
+        params['year'] = year
+    result = {'first': None, 'complete': None, 'events': 0, 'error': None}
+    start = time.perf_counter()
+    event = None
+    try:
+        async with client.stream('GET', f'{app_url}/api/scrape-stream', params=params, timeout=timeout) as response:
+            async for line in response.aiter_lines():
+                if line.startswith('event:'):
+                    event = line[6:].strip()
+                    result['events'] += 1
+                    if result['first'] is None:
+                        result['first'] = time.perf_counter() - start
+                elif line.startswith('data:') and event == 'complete':
+                    result['complete'] = time.perf_counter() - start
+                    break
+                elif line.startswith('data:') and event == 'error':
+                    result['error'] = json.loads(line[5:]).get('error', 'error')
+                    break
+    except httpx.HTTPError as e:
+        result['error'] = f'{type(e).__name__}: {e}'
+    if result['complete'] is None and result['error'] is None:
+        result['error'] = 'stream ended before completing'
+    return result
+
+
+def report(name, values):
+    if not values:
+        print(f'  {name:18} no samples')
+        return
+    print(f'  {name:18} p50 {percentile(values, 0.5):7.2f}s  p95 {percentile(values, 0.95):7.2f}s  '
+          f'p99 {percentile(values, 0.99):7.2f}s  max {max(values):7.2f}s')
+
+
+async def run(args):
+    limits = httpx.Limits(max_connections=args.clients, max_keepalive_connections=0)
+    async with httpx.AsyncClient(limits=limits) as client:
+        start = time.perf_counter()
+        results = await asyncio.gather(*(
+            run_client(client, args.app, f'reader{i}', args.year, args.timeout)
+            for i in range(args.clients)
+        ))
+        elapsed = time.perf_counter() - start
+
+        upstream = None
+        if args.fake_ao3:
+            try:
+                upstream = (await client.get(f'{args.fake_ao3}/__stats')).json()
+            except httpx.HTTPError as e:
+                print(f'Could not read fake AO3 stats: {e}')
+    return results, elapsed, upstream
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.strip().splitlines()[0])
+    parser.add_argument('--app', default='http://127.0.0.1:3000')
+    parser.add_argument('--clients', type=int, default=20)
+    parser.add_argument('--year', default=None)
+    parser.add_argument('--timeout', type=float, default=600)
+    parser.add_argument('--fake-ao3', default='http://127.0.0.1:8800',
+                        help='stand-in to read upstream request counts from ("" to skip)')
+    args = parser.parse_args()
+
+    results, elapsed, upstream = asyncio.run(run(args))
+    completed = [r for r in results if r['complete'] is not None]
+    errors = [r['error'] for r in results if r['error']]
+
+    print(f'{len(results)} clients in {elapsed:.1f}s: {len(completed)} completed, {len(errors)} failed')
+    report('first event', [r['first'] for r in results if r['first'] is not None])
+    report('complete', [r['complete'] for r in completed])
+    for message in sorted(set(errors)):
+        print(f'  error x{errors.count(message)}: {message}')
+    if upstream:
+        print(f'  upstream requests by status: {upstream}')
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,60 @@
+"""
+Compare the history page parser backends on the saved fixture pages
+
+Usage:
+    python benchmarks/bench_parsers.py [--rounds N]
+"""
+import argparse
+import sys
+import time
+
+from common import FIXTURE_DIR, load_fixtures
+from history_parser import PARSER_BACKENDS, lxml
+
+
+def run_backend(parse_page, pages, rounds):
+    """Return (seconds per round, items per round) for one backend"""
+    items = 0
+    start = time.perf_counter()
+    for _ in range(rounds):
+        items = 0
+        for _, html in pages:
+            work_items, _ = parse_page(html)
+            items += len(work_items)
+    elapsed = time.perf_counter() - start
+    return elapsed / rounds, items
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.strip().splitlines()[0])
+    parser.add_argument('--rounds', type=int, default=20)
+    args = parser.parse_args()
+
+    pages = load_fixtures()
+    if not pages:
+        sys.exit(f'No fixture pages found in {FIXTURE_DIR}')
+
+    # Both backends must produce identical items before timing means anything
+    if lxml is not None:
+        for name, html in pages:
+            if PARSER_BACKENDS['lxml'](html) != PARSER_BACKENDS['bs4'](html):
+                sys.exit(f'Backends disagree on {name}')
+
+    print(f'{len(pages)} fixture pages, {args.rounds} rounds')
+    timings = {}
+    for backend, parse_page in PARSER_BACKENDS.items():
+        if backend == 'lxml' and lxml is None:
+            print(f'{backend:>6}: skipped (not installed)')
+            continue
+        per_round, items = run_backend(parse_page, pages, args.rounds)
+        timings[backend] = per_round
+        print(f'{backend:>6}: {per_round * 1000:8.2f} ms/round  '
+              f'{per_round / len(pages) * 1000:7.2f} ms/page  '
+              f'{items / per_round:9.0f} items/s')
+
+    if 'lxml' in timings:
+        print(f'lxml speedup: {timings["bs4"] / timings["lxml"]:.1f}x')
+
+
+if __name__ == '__main__':
+    main()
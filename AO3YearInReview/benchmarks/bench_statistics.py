@@ -0,0 +1,133 @@
+"""
+Benchmark for the reading statistics engine
+
+Times the original calculate_statistics (dict increments and a full sort
+per top list, three dimensions) against StatsAggregator, which computes
+every dimension in one batched pass, and checks that the dimensions they
+share agree. Two workloads:
+
+- final: the statistics of a whole history, computed once
+- per page: statistics after every page, as each progress event of a scrape
+  job carries them; the original has to count everything again each time
+
+Usage:
+    python benchmarks/bench_statistics.py [--copies N] [--progress-copies N]
+        [--rounds N] [--no-tag-pairs]
+"""
+import argparse
+import time
+
+from common import load_fixtures
+
+from history_parser import parse_history_page
+from reading_stats import StatsAggregator
+
+
+def legacy_statistics(history_items):
+    """The original per-item dict counting with full sorts"""
+    stats = {
+        'totalFics': len(history_items),
+        'totalWords': 0,
+        'longestFic': {'title': '', 'wordCount': 0, 'author': '', 'url': ''},
+    }
+    tag_counts = {}
+    ship_counts = {}
+    fandom_counts = {}
+
+    for item in history_items:
+        word_count = item.get('wordCount', 0)
+        stats['totalWords'] += word_count
+        if word_count > stats['longestFic']['wordCount']:
+            stats['longestFic'] = {
+                'title': item.get('title', ''),
+                'wordCount': word_count,
+                'author': item.get('author', ''),
+                'url': item.get('url', '')
+            }
+        for tag in item.get('tags', []):
+            tag_counts[tag] = tag_counts.get(tag, 0) + 1
+        for ship in item.get('relationships', []):
+            ship_counts[ship] = ship_counts.get(ship, 0) + 1
+        for fandom in item.get('fandoms', []):
+            fandom_counts[fandom] = fandom_counts.get(fandom, 0) + 1
+
+    for name, key, counts in (('topTags', 'tag', tag_counts), ('topShips', 'ship', ship_counts),
+                              ('topFandoms', 'fandom', fandom_counts)):
+        stats[name] = [
+            {key: value, 'count': count}
+            for value, count in sorted(counts.items(), key=lambda x: x[1], reverse=True)[:10]
+        ]
+    return stats
+
+
+def aggregated_statistics(pages, tag_pairs=False):
+    """StatsAggregator fed one page at a time, as a scrape job does"""
+    aggregator = StatsAggregator(tag_pairs=tag_pairs)
+    for page_items in pages:
+        aggregator.add_many(page_items)
+    return aggregator.statistics()
+
+
+def legacy_final(pages):
+    """The original statistics of the whole history"""
+    return legacy_statistics([item for page_items in pages for item in page_items])
+
+
+def legacy_per_page(pages):
+    """The original statistics recomputed over everything fetched so far, after every page"""
+    items = []
+    for page_items in pages:
+        items.extend(page_items)
+        stats = legacy_statistics(items)
+    return stats
+
+
+def aggregated_per_page(pages, tag_pairs=False):
+    """A job's aggregator: each page added, then the progress event's partial statistics"""
+    aggregator = StatsAggregator(tag_pairs=tag_pairs)
+    for page_items in pages:
+        aggregator.add_many(page_items)
+        aggregator.partial()
+    return aggregator.statistics()
+
+
+def time_it(fn, arg, rounds):
+    start = time.perf_counter()
+    for _ in range(rounds):
+        result = fn(arg)
+    return (time.perf_counter() - start) / rounds, result
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.strip().splitlines()[0])
+    parser.add_argument('--copies', type=int, default=100, help='fixture copies for the final workload')
+    parser.add_argument('--progress-copies', type=int, default=20,
+                        help='fixture copies for the per page workload (the original is quadratic in it)')
+    parser.add_argument('--rounds', type=int, default=5)
+    parser.add_argument('--no-tag-pairs', dest='tag_pairs', action='store_false',
+                        help='skip tag pairs (topTagPairs), which the app counts')
+    args = parser.parse_args()
+
+    parsed = [parse_history_page(html)[0] for _, html in load_fixtures('readings_page_*.html')]
+
+    workloads = (
+        ('final', args.copies, legacy_final, aggregated_statistics),
+        ('per page', args.progress_copies, legacy_per_page, aggregated_per_page),
+    )
+    for name, copies, legacy_fn, engine_fn in workloads:
+        pages = parsed * copies
+
+        legacy_seconds, legacy = time_it(legacy_fn, pages, args.rounds)
+        engine_seconds, engine = time_it(lambda pages: engine_fn(pages, args.tag_pairs), pages, args.rounds)
+
+        for key, value in legacy.items():
+            if engine[key] != value:
+                raise SystemExit(f'{key} differs between the legacy and the aggregated statistics')
+
+        print(f'{name}: {sum(map(len, pages))} items in {len(pages)} pages, {args.rounds} rounds')
+        print(f'  legacy (3 top lists):           {legacy_seconds * 1000:8.1f} ms')
+        print(f'  aggregator ({len(engine)} statistics):     {engine_seconds * 1000:8.1f} ms')
+
+
+if __name__ == '__main__':
+    main()
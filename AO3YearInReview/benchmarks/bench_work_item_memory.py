@@ -0,0 +1,75 @@
+"""
+Memory held by parsed reading history: WorkItems vs plain dicts
+
+Parses the fixture pages repeatedly (as a long history would be) and
+compares the traced memory of the resulting WorkItems with the same items
+as JSON-shaped dicts of freshly parsed (not interned) strings, which is how
+items used to be kept.
+
+Usage:
+    python benchmarks/bench_work_item_memory.py [--copies N]
+"""
+import argparse
+import gc
+import tracemalloc
+
+from common import load_fixtures
+
+from history_parser import parse_history_page
+
+
+def _fresh(text):
+    """A new copy of `text`, as a separate parse would have produced"""
+    return text.encode('utf-8').decode('utf-8') if isinstance(text, str) else text
+
+
+def legacy_dict(item):
+    """The item as the old parsers returned it: a dict with its own strings and lists"""
+    data = item.to_dict()
+    return {
+        field: [_fresh(v) for v in value] if isinstance(value, list) else _fresh(value)
+        for field, value in data.items()
+    }
+
+
+def parse_history(pages, copies, as_dicts):
+    """Parse every page `copies` times, keeping all items alive"""
+    items = []
+    for _ in range(copies):
+        for _, html in pages:
+            page_items, _ = parse_history_page(html)
+            if as_dicts:
+                items.extend(legacy_dict(item) for item in page_items)
+            else:
+                items.extend(page_items)
+    return items
+
+
+def traced_size(pages, copies, as_dicts):
+    """Return (item count, bytes still allocated while the items are held)"""
+    gc.collect()
+    tracemalloc.start()
+    items = parse_history(pages, copies, as_dicts)
+    gc.collect()
+    size, _ = tracemalloc.get_traced_memory()
+    tracemalloc.stop()
+    return len(items), size
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.strip().splitlines()[0])
+    parser.add_argument('--copies', type=int, default=50)
+    args = parser.parse_args()
+
+    pages = load_fixtures('readings_page_*.html')
+    count, dict_bytes = traced_size(pages, args.copies, as_dicts=True)
+    _, item_bytes = traced_size(pages, args.copies, as_dicts=False)
+
+    print(f'{count} items from {len(pages)} pages x {args.copies}')
+    print(f'  dicts:      {dict_bytes / 1024:9.0f} KiB  {dict_bytes / count:7.0f} B/item')
+    print(f'  WorkItems:  {item_bytes / 1024:9.0f} KiB  {item_bytes / count:7.0f} B/item')
+    print(f'WorkItems use {dict_bytes / item_bytes:.1f}x less memory')
+
+
+if __name__ == '__main__':
+    main()
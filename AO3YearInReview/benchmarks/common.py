@@ -0,0 +1,19 @@
+"""Shared helpers for the benchmark scripts"""
+import glob
+import os
+import sys
+
+BENCH_DIR = os.path.dirname(os.path.abspath(__file__))
+FIXTURE_DIR = os.path.join(BENCH_DIR, 'fixtures')
+
+# Make the app modules importable when a script is run directly
+sys.path.insert(0, os.path.dirname(BENCH_DIR))
+
+
+def load_fixtures(pattern='readings_*.html'):
+    """Return [(file name, html)] for the saved reading history pages"""
+    pages = []
+    for path in sorted(glob.glob(os.path.join(FIXTURE_DIR, pattern))):
+        with open(path, 'r', encoding='utf-8') as f:
+            pages.append((os.path.basename(path), f.read()))
+    return pages
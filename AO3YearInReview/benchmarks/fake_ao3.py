@@ -0,0 +1,293 @@
+"""
+Local stand-in for archiveofourown.org, for end-to-end load tests
+
+Serves the login form with an authenticity token, logs in any username
+with any password except "wrong", and serves /users/<name>/readings?page=N
+built from the fixture blurbs: --pages pages of --per-page works (default
+20, as on AO3) per user, each work with its own id and a "Last visited"
+date a day or so older than the one before. Reading pages redirect to the
+login form without a session cookie, as AO3 does.
+
+Faults are drawn per request: 429 and 503 (with Retry-After), 525, and
+slow responses, on top of a fixed latency. GET /__stats returns request
+counts by status as JSON.
+
+Usage:
+    python benchmarks/fake_ao3.py [--port 8800] [--pages N] [--per-page N] [--latency-ms N]
+        [--rate-429 P] [--rate-503 P] [--rate-525 P] [--retry-after S]
+        [--slow-rate P] [--slow-ms N] [--seed N]
+
+Then run the app against it:
+    AO3_BASE_URL=http://127.0.0.1:8800 AO3_MIN_REQUEST_INTERVAL=0.05 AO3_CACHE_DB=off python app.py
+"""
+import argparse
+import json
+import random
+import re
+import secrets
+import threading
+import time
+from collections import Counter
+from datetime import date, timedelta
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from urllib.parse import parse_qs, urlparse
+
+import lxml.html
+
+from common import load_fixtures
+
+PER_PAGE = 20
+
+# Date of the newest work in every history; older works step back from here
+NEWEST_VISIT = date(2024, 12, 31)
+
+WORK_ID_RE = re.compile(r'(/works/|work_)\d+')
+LAST_VISITED_RE = re.compile(r'(<span>Last visited:</span>)\s*\d{1,2} \w+ \d{4}')
+READINGS_RE = re.compile(r'^/users/([^/]+)/readings$')
+USER_RE = re.compile(r'^/users/([^/]+)$')
+
+PAGE_TEMPLATE = '''<!DOCTYPE html>
+<html lang="en">
+<head><meta charset="utf-8" /><title>{title} | Archive of Our Own</title></head>
+<body>
+<div id="header">{greeting}</div>
+<div id="main">
+{flash}
+{content}
+</div>
+</body>
+</html>
+'''
+
+LOGIN_FORM = '''<h2 class="heading">Log In</h2>
+<form id="new_user" action="/users/login" method="post">
+  <input type="hidden" name="authenticity_token" value="{token}" />
+  <input type="text" name="user[login]" />
+  <input type="password" name="user[password]" />
+  <input type="submit" name="commit" value="Log In" />
+</form>
+'''
+
+
+def load_blurbs():
+    """Every work blurb in the fixture pages, as HTML"""
+    blurbs = []
+    for _, html in load_fixtures('readings_page_*.html'):
+        root = lxml.html.document_fromstring(html)
+        for element in root.iter('li'):
+            if 'blurb' in (element.get('class') or '').split():
+                blurbs.append(lxml.html.tostring(element, encoding='unicode'))
+    return blurbs
+
+
+def history_work(blurbs, index):
+    """The blurb of the `index`-th work (newest first) of every history"""
+    blurb = blurbs[index % len(blurbs)]
+    work_id = 50000000 + index
+    visited = NEWEST_VISIT - timedelta(days=index * 2 // 3)
+    blurb = WORK_ID_RE.sub(lambda m: f'{m.group(1)}{work_id}', blurb)
+    return LAST_VISITED_RE.sub(lambda m: f'{m.group(1)} {visited.day:02d} {visited:%b %Y}', blurb)
+
+
+def pagination(page, pages):
+    """AO3's pagination list: neighbouring pages, the last page and a next link"""
+    links = []
+    for number in sorted({1, page - 1, page, page + 1, pages}):
+        if 1 <= number <= pages:
+            if number == page:
+                links.append(f'<li><span class="current">{number}</span></li>')
+            else:
+                links.append(f'<li><a href="/users/__USER__/readings?page={number}">{number}</a></li>')
+    if page < pages:
+        links.append(f'<li class="next" title="next"><a rel="next" href="/users/__USER__/readings?page={page + 1}">Next &rarr;</a></li>')
+    return f'<ol class="pagination actions" role="navigation">{"".join(links)}</ol>'
+
+
+def build_history_pages(pages, per_page=PER_PAGE):
+    """HTML of every history page, with __USER__ in place of the username"""
+    blurbs = load_blurbs()
+    rendered = []
+    for page in range(1, pages + 1):
+        works = ''.join(history_work(blurbs, (page - 1) * per_page + i) for i in range(per_page))
+        nav = pagination(page, pages)
+        rendered.append(
+            f'<h2 class="heading">History</h2>{nav}'
+            f'<ol class="reading work index group">{works}</ol>{nav}'
+        )
+    return rendered
+
+
+def greeting(username):
+    return (
+        '<div id="greeting"><ul class="user navigation actions">'
+        f'<li><a href="/users/{username}">Hi, {username}!</a></li>'
+        '<li><a href="/users/logout">Log Out</a></li></ul></div>'
+    )
+
+
+def render_page(title, content, username=None, flash=''):
+    return PAGE_TEMPLATE.format(
+        title=title, content=content, flash=flash,
+        greeting=greeting(username) if username else '<div id="login"></div>'
+    )
+
+
+def session_cookie(cookie_header):
+    """Value of the _otwarchive_session cookie in a Cookie header, or None"""
+    for part in (cookie_header or '').split(';'):
+        name, _, value = part.strip().partition('=')
+        if name == '_otwarchive_session':
+            return value
+    return None
+
+
+class FakeAO3:
+    """
+    Shared state of the stand-in: rendered pages, sessions, faults and counts
+
+    respond() answers one request without any I/O, so the HTTP server here
+    and the pacing simulator (simulate_pacing.py) serve the same site.
+    """
+
+    def __init__(self, args):
+        self.args = args
+        self.pages = build_history_pages(args.pages, args.per_page)
+        self.token = secrets.token_urlsafe(24)
+        self.sessions = {}
+        self.counts = Counter()
+        self.random = random.Random(args.seed)
+        self.lock = threading.Lock()
+
+    def draw_fault(self):
+        """(status of an injected failure or None, whether to answer slowly) for one request"""
+        with self.lock:
+            roll = self.random.random()
+            slow = self.random.random() < self.args.slow_rate
+        for status, rate in ((429, self.args.rate_429), (503, self.args.rate_503), (525, self.args.rate_525)):
+            if roll < rate:
+                return status, slow
+            roll -= rate
+        return None, slow
+
+    def respond(self, method, path, query='', form=None, cookie_header=None):
+        """
+        Answer one request to the site
+
+        Returns:
+            (status, html, extra headers, seconds the answer takes to arrive)
+        """
+        args = self.args
+        status, slow = self.draw_fault()
+        latency = (args.latency_ms + (args.slow_ms if slow else 0)) / 1000.0
+        if status in (429, 503):
+            result = status, render_page('Error', '<h2>Retry later</h2>'), {'Retry-After': str(args.retry_after)}
+        elif status == 525:
+            result = 525, render_page('Error', '<h2>SSL handshake failed</h2>'), {}
+        elif method == 'POST':
+            result = self.respond_post(path, form or {})
+        else:
+            result = self.respond_get(path, query, self.sessions.get(session_cookie(cookie_header)))
+        with self.lock:
+            self.counts[result[0]] += 1
+        return result + (latency,)
+
+    def respond_get(self, path, query, username):
+        if path == '/users/login':
+            return 200, render_page('Log In', LOGIN_FORM.format(token=self.token), username), {}
+
+        match = READINGS_RE.match(path)
+        if match:
+            if username != match.group(1):
+                return 302, '', {'Location': '/users/login'}
+            page = int(parse_qs(query).get('page', ['1'])[0])
+            content = self.pages[page - 1] if 1 <= page <= len(self.pages) else '<ol class="reading work index group"></ol>'
+            return 200, render_page('History', content.replace('__USER__', username), username), {}
+
+        match = USER_RE.match(path)
+        if match and username:
+            return 200, render_page('Dashboard', f'<h2>{username}</h2>', username), {}
+        return 404, render_page('Not Found', '<h2>Error 404</h2>', username), {}
+
+    def respond_post(self, path, form):
+        if path != '/users/login':
+            return 404, render_page('Not Found', '<h2>Error 404</h2>'), {}
+
+        username = form.get('user[login]', [''])[0]
+        password = form.get('user[password]', [''])[0]
+        token = form.get('authenticity_token', [''])[0]
+        if token != self.token or not username or password == 'wrong':
+            flash = '<div class="flash error">The password or user name you entered doesn\'t match our records.</div>'
+            return 200, render_page('Log In', LOGIN_FORM.format(token=self.token), flash=flash), {}
+
+        session = secrets.token_urlsafe(24)
+        with self.lock:
+            self.sessions[session] = username
+        return 302, '', {'Location': f'/users/{username}', 'Set-Cookie': f'_otwarchive_session={session}; path=/; HttpOnly'}
+
+
+class Handler(BaseHTTPRequestHandler):
+    protocol_version = 'HTTP/1.1'
+    server_version = 'FakeAO3'
+
+    def log_message(self, format, *args):
+        pass
+
+    def send(self, status, body, content_type, headers=None):
+        body = body.encode('utf-8')
+        self.send_response(status)
+        self.send_header('Content-Type', content_type)
+        self.send_header('Content-Length', str(len(body)))
+        for name, value in (headers or {}).items():
+            self.send_header(name, value)
+        self.end_headers()
+        self.wfile.write(body)
+
+    def answer(self, method, form=None):
+        url = urlparse(self.path)
+        status, html, headers, latency = self.server.ao3.respond(
+            method, url.path, url.query, form, self.headers.get('Cookie')
+        )
+        time.sleep(latency)
+        self.send(status, html, 'text/html; charset=utf-8', headers)
+
+    def do_GET(self):
+        if urlparse(self.path).path == '/__stats':
+            counts = self.server.ao3.counts
+            self.send(200, json.dumps({str(status): count for status, count in counts.items()}), 'application/json')
+            return
+        self.answer('GET')
+
+    def do_POST(self):
+        length = int(self.headers.get('Content-Length', 0))
+        self.answer('POST', parse_qs(self.rfile.read(length).decode('utf-8')))
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.strip().splitlines()[0])
+    parser.add_argument('--host', default='127.0.0.1')
+    parser.add_argument('--port', type=int, default=8800)
+    parser.add_argument('--pages', type=int, default=10)
+    parser.add_argument('--per-page', type=int, default=PER_PAGE)
+    parser.add_argument('--latency-ms', type=float, default=0)
+    parser.add_argument('--rate-429', type=float, default=0)
+    parser.add_argument('--rate-503', type=float, default=0)
+    parser.add_argument('--rate-525', type=float, default=0)
+    parser.add_argument('--retry-after', type=float, default=1)
+    parser.add_argument('--slow-rate', type=float, default=0)
+    parser.add_argument('--slow-ms', type=float, default=2000)
+    parser.add_argument('--seed', type=int, default=None)
+    args = parser.parse_args()
+
+    server = ThreadingHTTPServer((args.host, args.port), Handler)
+    server.daemon_threads = True
+    server.ao3 = FakeAO3(args)
+    print(f'Fake AO3 serving {args.pages} history pages per user on http://{args.host}:{args.port}')
+    try:
+        server.serve_forever()
+    except KeyboardInterrupt:
+        pass
+    print('Requests by status:', dict(server.ao3.counts))
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,145 @@
+"""
+Replay scrapes against the fake AO3 on a virtual clock to compare pacing and retry policies
+
+Each policy scrapes the same --pages page history (with the same injected
+429/503/525 and slow responses, drawn from --seed) through the real
+aiter_ao3_history, HostPacer and UpstreamScheduler, but on a
+VirtualClockLoop and an in-memory transport: every pacing wait, retry
+cooldown and response latency is simulated, so an hours-long scrape
+replays in about the time it takes to parse its pages (kept small with
+--per-page). Reports simulated wall time and upstream requests per policy,
+and how many scrapes failed or finished without their whole history.
+
+Usage:
+    python benchmarks/simulate_pacing.py [--pages 200] [--per-page N] [--scrapes N]
+        [--rate-429 P] [--rate-503 P] [--rate-525 P] [--retry-after S]
+        [--latency-ms N] [--slow-rate P] [--slow-ms N] [--seed N]
+        [--policy NAME ...]
+"""
+import argparse
+import asyncio
+import contextlib
+import io
+import random
+import time
+from urllib.parse import parse_qs
+
+import httpx
+
+import common  # noqa: F401 - puts the app modules on sys.path
+from ao3_scraper import RetryPolicy, aiter_ao3_history
+from fake_ao3 import FakeAO3
+from pacing import HostPacer, UpstreamScheduler
+from virtual_clock import run_virtual
+
+# Policy name -> (HostPacer settings, RetryPolicy); 'default' is what the app runs
+POLICIES = {
+    'default': ({}, RetryPolicy()),
+    'no-adapt': ({'backoff_factor': 1.0, 'recovery_factor': 1.0}, RetryPolicy()),
+    'min-1s': ({'min_interval': 1.0}, RetryPolicy()),
+    'min-5s': ({'min_interval': 5.0}, RetryPolicy()),
+    'burst-3': ({'burst': 3}, RetryPolicy()),
+    'short-cooldowns': ({}, RetryPolicy(page_backoff=2, ssl_backoff=5, scrape_backoff=2)),
+    'patient-pages': ({}, RetryPolicy(page_attempts=8)),
+}
+
+
+def mock_transport(ao3):
+    """httpx transport that answers from `ao3` after its simulated latency"""
+    async def handle(request):
+        form = parse_qs(request.content.decode('utf-8')) if request.method == 'POST' else None
+        status, html, headers, latency = ao3.respond(
+            request.method, request.url.path, request.url.query.decode('ascii'), form,
+            request.headers.get('cookie')
+        )
+        await asyncio.sleep(latency)
+        return httpx.Response(status, headers=dict(headers, **{'Content-Type': 'text/html; charset=utf-8'}),
+                              content=html.encode('utf-8'))
+    return httpx.MockTransport(handle)
+
+
+async def scrape(username, scheduler, policy, transport):
+    """(items, error or None, simulated seconds) of one scrape"""
+    loop = asyncio.get_running_loop()
+    start = loop.time()
+    items = 0
+    try:
+        async for _ in aiter_ao3_history(username, 'password', retry_policy=policy,
+                                         scheduler=scheduler, transport=transport):
+            items += 1
+        error = None
+    except Exception as e:
+        error = str(e)
+    return items, error, loop.time() - start
+
+
+async def simulate(args, pacer_settings, policy, ao3):
+    pacer = HostPacer(**dict({'min_interval': 3.0}, **pacer_settings), clock=asyncio.get_running_loop().time)
+    scheduler = UpstreamScheduler(pacer)
+    transport = mock_transport(ao3)
+    results = await asyncio.gather(*(
+        scrape(f'reader{i}', scheduler, policy, transport) for i in range(args.scrapes)
+    ))
+    return results, pacer.stats()
+
+
+def run_policy(args, name):
+    pacer_settings, policy = POLICIES[name]
+    ao3 = FakeAO3(args)
+    random.seed(args.seed)  # pacer jitter
+    started = time.perf_counter()
+    # The scraper logs every step; keep the comparison readable
+    with contextlib.redirect_stdout(io.StringIO()):
+        (results, pacer), simulated = run_virtual(simulate(args, pacer_settings, policy, ao3))
+    real = time.perf_counter() - started
+    return {
+        'policy': name,
+        'simulated': simulated,
+        'slowest': max(seconds for _, _, seconds in results),
+        'requests': sum(ao3.counts.values()),
+        'statuses': dict(sorted(ao3.counts.items())),
+        'throttled': pacer['throttled'],
+        'failed': sum(1 for _, error, _ in results if error),
+        'incomplete': sum(1 for items, error, _ in results if not error and items < args.pages * args.per_page),
+        'items': sum(items for items, _, _ in results),
+        'real': real,
+    }
+
+
+def format_duration(seconds):
+    minutes, seconds = divmod(int(round(seconds)), 60)
+    hours, minutes = divmod(minutes, 60)
+    return f'{hours}h{minutes:02d}m{seconds:02d}s' if hours else f'{minutes}m{seconds:02d}s'
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.strip().splitlines()[0])
+    parser.add_argument('--pages', type=int, default=200)
+    parser.add_argument('--per-page', type=int, default=2,
+                        help='works per page; parsing is the only real work, and timings do not depend on it')
+    parser.add_argument('--scrapes', type=int, default=1, help='concurrent scrapes sharing the host budget')
+    parser.add_argument('--latency-ms', type=float, default=300)
+    parser.add_argument('--rate-429', type=float, default=0.02)
+    parser.add_argument('--rate-503', type=float, default=0.01)
+    parser.add_argument('--rate-525', type=float, default=0.01)
+    parser.add_argument('--retry-after', type=float, default=30)
+    parser.add_argument('--slow-rate', type=float, default=0.05)
+    parser.add_argument('--slow-ms', type=float, default=5000)
+    parser.add_argument('--seed', type=int, default=1)
+    parser.add_argument('--policy', action='append', choices=sorted(POLICIES),
+                        help='policy to simulate (repeatable; default all)')
+    args = parser.parse_args()
+
+    print(f'{args.scrapes} scrape(s) of {args.pages} pages, faults: 429 {args.rate_429:.1%}, '
+          f'503 {args.rate_503:.1%}, 525 {args.rate_525:.1%}, slow {args.slow_rate:.1%}, seed {args.seed}')
+    print(f'{"policy":16} {"simulated":>10} {"slowest":>10} {"requests":>9} {"throttled":>9} '
+          f'{"failed":>6} {"short":>5} {"items":>7} {"real":>7}  statuses')
+    for name in args.policy or POLICIES:
+        r = run_policy(args, name)
+        print(f'{r["policy"]:16} {format_duration(r["simulated"]):>10} {format_duration(r["slowest"]):>10} '
+              f'{r["requests"]:9d} {r["throttled"]:9d} {r["failed"]:6d} {r["incomplete"]:5d} {r["items"]:7d} {r["real"]:6.2f}s  '
+              f'{r["statuses"]}')
+
+
+if __name__ == '__main__':
+    main()
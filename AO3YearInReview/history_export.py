@@ -0,0 +1,145 @@
+import io
+import json
+from datetime import datetime
+
+from work_item import TAG_LIST_FIELDS, json_default
+
+try:
+    import pyarrow as pa
+    import pyarrow.ipc
+    import pyarrow.parquet
+except ImportError:
+    print('pyarrow not installed, history export is limited to JSON')
+    pa = None
+
+
+# format -> (mimetype, file extension, needs pyarrow)
+EXPORT_FORMATS = {
+    'parquet': ('application/vnd.apache.parquet', 'parquet', True),
+    'arrow': ('application/vnd.apache.arrow.file', 'arrow', True),
+    'json': ('application/json', 'json', False),
+}
+
+# Single-value columns whose values repeat across works
+DICTIONARY_FIELDS = ('author', 'rating')
+
+# Works converted to Arrow at a time while an export is written
+EXPORT_BATCH_ITEMS = 5000
+
+
+class ExportUnavailable(Exception):
+    """The requested export format needs pyarrow, which is not installed"""
+
+
+def history_schema():
+    """
+    Arrow schema of an exported history
+
+    Tag lists and the repeating single values are dictionary encoded, so
+    each distinct tag is stored once per file.
+    """
+    tag_type = pa.dictionary(pa.int32(), pa.string())
+    fields = [
+        pa.field('title', pa.string()),
+        pa.field('author', tag_type),
+        pa.field('url', pa.string()),
+        pa.field('wordCount', pa.int64()),
+        pa.field('rating', tag_type),
+        pa.field('lastVisited', pa.timestamp('ms')),
+    ]
+    fields.extend(pa.field(field, pa.list_(tag_type)) for field in TAG_LIST_FIELDS)
+    return pa.schema(fields)
+
+
+def _dictionary_list_array(lists):
+    """list<dictionary<int32, string>> array from a list of string sequences"""
+    offsets = [0]
+    values = []
+    for value_list in lists:
+        values.extend(value_list)
+        offsets.append(len(values))
+    encoded = pa.array(values, type=pa.string()).dictionary_encode()
+    return pa.ListArray.from_arrays(pa.array(offsets, type=pa.int32()), encoded)
+
+
+def history_table(items):
+    """Build an Arrow table (schema: history_schema) from WorkItems"""
+    columns = {field: [] for field in ('title', 'author', 'url', 'wordCount', 'rating', 'lastVisited')}
+    tag_columns = {field: [] for field in TAG_LIST_FIELDS}
+    for item in items:
+        for field in columns:
+            columns[field].append(item[field])
+        for field in TAG_LIST_FIELDS:
+            tag_columns[field].append(item[field])
+
+    columns['lastVisited'] = [
+        datetime.fromisoformat(value) if value else None for value in columns['lastVisited']
+    ]
+
+    schema = history_schema()
+    arrays = []
+    for field in schema:
+        if field.name in TAG_LIST_FIELDS:
+            arrays.append(_dictionary_list_array(tag_columns[field.name]))
+        elif field.name in DICTIONARY_FIELDS:
+            arrays.append(pa.array(columns[field.name], type=pa.string()).dictionary_encode())
+        else:
+            arrays.append(pa.array(columns[field.name], type=field.type))
+    return pa.Table.from_arrays(arrays, schema=schema)
+
+
+def _batches(items, size):
+    """Lists of up to `size` items from an iterable"""
+    batch = []
+    for item in items:
+        batch.append(item)
+        if len(batch) >= size:
+            yield batch
+            batch = []
+    if batch:
+        yield batch
+
+
+def export_history(items, fmt):
+    """
+    Serialise a reading history for download
+
+    Items are consumed as a stream, EXPORT_BATCH_ITEMS at a time: each batch
+    becomes a Parquet row group straight away. An Arrow IPC file may only
+    hold one dictionary per column, so its batches are kept as Arrow tables
+    and their dictionaries unified when the file is written.
+
+    Args:
+        items: Iterable of WorkItems (or dicts in the same shape), newest first
+        fmt: One of EXPORT_FORMATS
+
+    Returns:
+        Bytes of the exported file
+    """
+    if fmt not in EXPORT_FORMATS:
+        raise ValueError(f'Unknown export format: {fmt}')
+    if EXPORT_FORMATS[fmt][2] and pa is None:
+        raise ExportUnavailable(f'{fmt} export needs pyarrow, which is not installed')
+
+    sink = io.BytesIO()
+    if fmt == 'json':
+        separator = b'['
+        for item in items:
+            sink.write(separator + json.dumps(item, default=json_default).encode('utf-8'))
+            separator = b','
+        sink.write(b']' if separator == b',' else b'[]')
+        return sink.getvalue()
+
+    schema = history_schema()
+    batches = (history_table(batch) for batch in _batches(items, EXPORT_BATCH_ITEMS))
+    if fmt == 'parquet':
+        with pyarrow.parquet.ParquetWriter(sink, schema, compression='zstd') as writer:
+            for table in batches:
+                writer.write_table(table)
+    else:
+        tables = list(batches)
+        options = pyarrow.ipc.IpcWriteOptions(unify_dictionaries=True)
+        with pyarrow.ipc.new_file(sink, schema, options=options) as writer:
+            if tables:
+                writer.write_table(pa.concat_tables(tables))
+    return sink.getvalue()
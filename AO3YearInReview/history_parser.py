@@ -0,0 +1,388 @@
+import os
+import re
+from datetime import datetime
+
+from bs4 import BeautifulSoup
+
+from work_item import WorkItem
+
+try:
+    import lxml.html
+except ImportError:
+    print('lxml not installed, history pages will be parsed with BeautifulSoup')
+    lxml = None
+
+
+BASE_URL = 'https://archiveofourown.org'
+
+DATE_FORMATS = ['%d %b %Y', '%d %B %Y', '%Y-%m-%d', '%b %d, %Y', '%B %d, %Y']
+
+VIEWED_DATE_RE = re.compile(r'(\d{1,2}\s+\w+\s+\d{4})')
+LAST_VISITED_RE = re.compile(r'Last visited:\s*(\d{1,2}\s+\w+\s+\d{4})')
+PAGE_LINK_RE = re.compile(r'/readings\?page=(\d+)')
+
+# Tag lists inside ul.tags, keyed by the class of their <li>
+TAG_FIELDS = {
+    'relationships': 'relationships',
+    'characters': 'characters',
+    'freeforms': 'tags',
+    'warnings': 'warnings',
+    'categories': 'categories',
+}
+
+# Classes that mark a history blurb (any one of them is enough)
+BLURB_CLASSES = ('reading', 'work', 'blurb', 'group')
+
+
+def parse_visit_date(date_text):
+    """Parse a "Last visited" date string, returning a datetime or None"""
+    for fmt in DATE_FORMATS:
+        try:
+            return datetime.strptime(date_text, fmt)
+        except ValueError:
+            continue
+    return None
+
+
+def build_work_item(title, link, author, word_count, tags, characters, relationships,
+                    warnings, categories, rating, fandoms, date_text):
+    """Assemble the WorkItem shared by every parser backend"""
+    last_visited = parse_visit_date(date_text) if date_text else None
+
+    return WorkItem(
+        title=title,
+        author=author,
+        url=f'{BASE_URL}{link}',
+        wordCount=word_count,
+        tags=tags,
+        characters=characters,
+        relationships=relationships,
+        warnings=warnings,
+        categories=categories,
+        rating=rating,
+        fandoms=fandoms,
+        lastVisited=last_visited.isoformat() if last_visited else None
+    )
+
+
+def parse_word_count(words_text):
+    """Convert the text of dd.words to an int (0 when unreadable)"""
+    try:
+        return int(words_text.replace(',', ''))
+    except ValueError:
+        return 0
+
+
+# --------------------
+# BeautifulSoup backend
+# --------------------
+
+def _find_blurbs_bs4(soup):
+    """Return the blurb <li> elements using the legacy selector fallbacks"""
+    work_items = soup.find_all('li', class_=list(BLURB_CLASSES))
+    if not work_items:
+        ol = soup.find('ol', class_='reading')
+        if ol:
+            work_items = ol.find_all('li', class_='blurb')
+    return work_items
+
+
+def _parse_blurb_bs4(item):
+    """Extract a work item from a single blurb, or None if it isn't a work"""
+    title_element = item.find('h4', class_='heading')
+    if not title_element:
+        return None
+    title_link = title_element.find('a', href=lambda x: x and '/works/' in x)
+    if not title_link:
+        return None
+
+    title = title_link.get_text(strip=True)
+    link = title_link.get('href')
+    if not title or not link:
+        return None
+
+    author_element = item.find('a', rel='author')
+    author = author_element.get_text(strip=True) if author_element else 'Unknown'
+
+    word_count = 0
+    stats_element = item.find('dd', class_='words')
+    if stats_element:
+        word_count = parse_word_count(stats_element.get_text(strip=True))
+
+    tag_lists = {field: [] for field in TAG_FIELDS.values()}
+    for li_class, field in TAG_FIELDS.items():
+        for tag_li in item.find_all('li', class_=li_class):
+            tag = tag_li.find('a', class_='tag')
+            if tag:
+                tag_lists[field].append(tag.get_text(strip=True))
+
+    rating = 'Not Rated'
+    rating_element = item.find('span', class_='rating')
+    if rating_element:
+        rating_text = rating_element.find('span', class_='text')
+        if rating_text:
+            rating = rating_text.get_text(strip=True)
+
+    fandoms = []
+    fandom_heading = item.find('h5', class_='fandoms')
+    if fandom_heading:
+        fandoms = [f.get_text(strip=True) for f in fandom_heading.find_all('a', class_='tag')]
+
+    date_text = None
+    viewed_heading = item.find('h4', class_='viewed')
+    if viewed_heading:
+        full_heading_text = viewed_heading.get_text()
+        if 'Last visited:' in full_heading_text:
+            date_match = VIEWED_DATE_RE.search(full_heading_text)
+            if date_match:
+                date_text = date_match.group(1)
+
+    if not date_text:
+        datetime_span = item.find('span', {'datetime': True})
+        if datetime_span:
+            date_text = datetime_span.get_text(strip=True)
+
+    if not date_text:
+        match = LAST_VISITED_RE.search(item.get_text())
+        if match:
+            date_text = match.group(1)
+
+    if not date_text:
+        date_dd = item.find('dd', class_='date')
+        if date_dd:
+            date_text = date_dd.get_text(strip=True)
+
+    return build_work_item(
+        title, link, author, word_count,
+        tag_lists['tags'], tag_lists['characters'], tag_lists['relationships'],
+        tag_lists['warnings'], tag_lists['categories'],
+        rating, fandoms, date_text
+    )
+
+
+def parse_page_bs4(html):
+    """
+    Parse a reading history page with BeautifulSoup's html.parser
+
+    Returns:
+        Tuple of (list of WorkItems, whether a next page exists)
+    """
+    soup = BeautifulSoup(html, 'html.parser')
+
+    work_items = []
+    for blurb in _find_blurbs_bs4(soup):
+        work_item = _parse_blurb_bs4(blurb)
+        if work_item:
+            work_items.append(work_item)
+
+    has_next = False
+    pagination = soup.find('ol', class_='pagination')
+    if pagination:
+        has_next = pagination.find('li', class_='next') is not None
+
+    return work_items, has_next
+
+
+# --------------------
+# lxml backend
+# --------------------
+
+def _classes(element):
+    return element.get('class', '').split()
+
+
+def _text(element):
+    """Equivalent of BeautifulSoup's get_text(strip=True)"""
+    return ''.join(s.strip() for s in element.itertext())
+
+
+def _parse_blurb_lxml(item):
+    """
+    Extract a work item from a single blurb in one walk over its elements
+
+    Each element is dispatched on its tag and class as it is visited, so the
+    blurb is traversed once instead of once per field.
+    """
+    title_link = None
+    author = None
+    words_text = None
+    rating_element = None
+    fandom_heading = None
+    viewed_text = None
+    datetime_text = None
+    date_dd_text = None
+    seen_heading = False
+    fandoms = []
+    tag_lists = {field: [] for field in TAG_FIELDS.values()}
+    filled_tag_lis = set()
+
+    for element in item.iterdescendants():
+        tag = element.tag
+        if not isinstance(tag, str):
+            continue  # comments and processing instructions
+
+        if tag == 'a':
+            classes = _classes(element)
+            if 'tag' in classes:
+                # Walk up to the <li>/<h5> that owns this tag link
+                parent = element.getparent()
+                while parent is not None and parent is not item and parent.tag not in ('li', 'h5'):
+                    parent = parent.getparent()
+                if parent is None or parent is item:
+                    continue
+                if parent.tag == 'h5':
+                    if parent is fandom_heading:
+                        fandoms.append(_text(element))
+                    continue
+                if parent in filled_tag_lis:
+                    continue
+                for li_class in _classes(parent):
+                    field = TAG_FIELDS.get(li_class)
+                    if field:
+                        tag_lists[field].append(_text(element))
+                        filled_tag_lis.add(parent)
+                        break
+            if author is None and 'author' in element.get('rel', '').split():
+                author = _text(element)
+        elif tag == 'h4':
+            classes = _classes(element)
+            if 'heading' in classes and not seen_heading:
+                seen_heading = True
+                for link in element.iter('a'):
+                    href = link.get('href')
+                    if href and '/works/' in href:
+                        title_link = link
+                        break
+            if 'viewed' in classes and viewed_text is None:
+                viewed_text = ''.join(element.itertext())
+        elif tag == 'h5':
+            if fandom_heading is None and 'fandoms' in _classes(element):
+                fandom_heading = element
+        elif tag == 'span':
+            if rating_element is None and 'rating' in _classes(element):
+                rating_element = element
+            if datetime_text is None and element.get('datetime') is not None:
+                datetime_text = _text(element)
+        elif tag == 'dd':
+            classes = _classes(element)
+            if words_text is None and 'words' in classes:
+                words_text = _text(element)
+            if date_dd_text is None and 'date' in classes:
+                date_dd_text = _text(element)
+
+    if title_link is None:
+        return None
+    title = _text(title_link)
+    link = title_link.get('href')
+    if not title or not link:
+        return None
+
+    rating = 'Not Rated'
+    if rating_element is not None:
+        for span in rating_element.iterdescendants('span'):
+            if 'text' in _classes(span):
+                rating = _text(span)
+                break
+
+    date_text = None
+    if viewed_text and 'Last visited:' in viewed_text:
+        date_match = VIEWED_DATE_RE.search(viewed_text)
+        if date_match:
+            date_text = date_match.group(1)
+    if not date_text:
+        date_text = datetime_text
+    if not date_text:
+        # Rare fallback: only pay for the whole-blurb text when needed
+        match = LAST_VISITED_RE.search(''.join(item.itertext()))
+        if match:
+            date_text = match.group(1)
+    if not date_text:
+        date_text = date_dd_text
+
+    return build_work_item(
+        title, link, author or 'Unknown',
+        parse_word_count(words_text) if words_text else 0,
+        tag_lists['tags'], tag_lists['characters'], tag_lists['relationships'],
+        tag_lists['warnings'], tag_lists['categories'],
+        rating, fandoms, date_text
+    )
+
+
+def parse_page_lxml(html):
+    """
+    Parse a reading history page with lxml, one traversal per blurb
+
+    Returns:
+        Tuple of (list of WorkItems, whether a next page exists)
+    """
+    root = lxml.html.document_fromstring(html)
+
+    work_items = []
+    has_next = False
+    for element in root.iter('li'):
+        classes = _classes(element)
+        if any(c in BLURB_CLASSES for c in classes):
+            work_item = _parse_blurb_lxml(element)
+            if work_item:
+                work_items.append(work_item)
+        elif 'next' in classes and not has_next:
+            parent = element.getparent()
+            has_next = parent is not None and parent.tag == 'ol' and 'pagination' in _classes(parent)
+
+    return work_items, has_next
+
+
+# --------------------
+# Backend selection
+# --------------------
+
+PARSER_BACKENDS = {
+    'lxml': parse_page_lxml,
+    'bs4': parse_page_bs4,
+}
+
+
+def get_page_parser(backend=None):
+    """
+    Return the page parser for the requested backend
+
+    The backend defaults to the AO3_PARSER environment variable, then to lxml
+    when it is installed, falling back to BeautifulSoup otherwise.
+    """
+    backend = backend or os.environ.get('AO3_PARSER', 'auto')
+    if backend == 'auto':
+        backend = 'lxml' if lxml is not None else 'bs4'
+    if backend == 'lxml' and lxml is None:
+        backend = 'bs4'
+    if backend not in PARSER_BACKENDS:
+        raise ValueError(f'Unknown parser backend: {backend}')
+    return PARSER_BACKENDS[backend]
+
+
+def parse_history_page(html, backend=None):
+    """
+    Parse one AO3 reading history page
+
+    This is a pure function of the page HTML: it does no network access,
+    logging or file I/O, so it can be profiled and tested offline.
+
+    Args:
+        html: Page HTML as returned by /users/<username>/readings
+        backend: Optional parser backend name ('lxml' or 'bs4')
+
+    Returns:
+        Tuple of (list of WorkItems in page order, whether a next page exists)
+    """
+    return get_page_parser(backend)(html)
+
+
+def last_page_number(html):
+    """
+    Highest history page number the page links to, or None without pagination
+
+    AO3's pagination always links the last page, so this is the length of
+    the history (or the current page, when that is the last one and links
+    only back). A plain regex scan, much cheaper than the page parse.
+    """
+    pages = [int(page) for page in PAGE_LINK_RE.findall(html)]
+    return max(pages) if pages else None
@@ -0,0 +1,386 @@
+import hashlib
+import json
+import os
+import sqlite3
+import time
+from contextlib import contextmanager
+
+from work_item import WorkItem, json_default
+
+
+DEFAULT_DB_PATH = os.path.join(os.path.dirname(os.path.abspath(__file__)), 'data', 'history.sqlite3')
+
+# Checkpoints older than this are ignored: the history has likely shifted since
+CHECKPOINT_TTL = 30 * 60
+
+# Stored positions are moved this far up while fetched pages are merged in on
+# top of them, so the two ranges cannot collide
+CHECKPOINT_POSITION_SHIFT = 1 << 40
+
+# Stored items read per query by read_items and iter_items
+READ_BATCH_ITEMS = 500
+
+# Rows are keyed by a hash of the username alone, which anyone can produce:
+# nothing in here proves who asked for it. Items (stored history and
+# checkpointed pages alike) may only be read for a scrape whose AO3 login
+# has been accepted; aiter_ao3_history checks that before any read.
+SCHEMA = '''
+CREATE TABLE IF NOT EXISTS history_users (
+    user_hash TEXT PRIMARY KEY,
+    complete INTEGER NOT NULL DEFAULT 0,
+    updated_at REAL NOT NULL
+);
+CREATE TABLE IF NOT EXISTS history_items (
+    user_hash TEXT NOT NULL,
+    url TEXT NOT NULL,
+    position INTEGER NOT NULL,
+    last_visited TEXT,
+    data TEXT NOT NULL,
+    PRIMARY KEY (user_hash, url)
+);
+CREATE INDEX IF NOT EXISTS history_items_position ON history_items (user_hash, position);
+CREATE INDEX IF NOT EXISTS history_items_month ON history_items (user_hash, substr(last_visited, 1, 7), position);
+CREATE TABLE IF NOT EXISTS history_pages (
+    user_hash TEXT NOT NULL,
+    page INTEGER NOT NULL,
+    newest TEXT NOT NULL,
+    oldest TEXT NOT NULL,
+    updated_at REAL NOT NULL,
+    PRIMARY KEY (user_hash, page)
+);
+CREATE TABLE IF NOT EXISTS scrape_checkpoints (
+    user_hash TEXT NOT NULL,
+    year TEXT NOT NULL,
+    page INTEGER NOT NULL,
+    items TEXT NOT NULL,
+    updated_at REAL NOT NULL,
+    PRIMARY KEY (user_hash, year, page)
+);
+'''
+
+
+def user_key(username):
+    """Stable hash used instead of the raw username as the storage key"""
+    return hashlib.sha256(username.strip().lower().encode('utf-8')).hexdigest()
+
+
+def page_is_known(page_items, known_visits):
+    """True when every work on the page is already stored with the same lastVisited"""
+    if not page_items:
+        return False
+    for item in page_items:
+        if item['url'] not in known_visits or known_visits[item['url']] != item['lastVisited']:
+            return False
+    return True
+
+
+class HistoryStore:
+    """
+    SQLite cache of parsed reading history, keyed by a hash of the username
+
+    `complete` records whether the stored history reaches the last page, which
+    is what lets a refresh stop as soon as it meets already stored pages.
+
+    The store does no authentication of its own. iter_items,
+    load_checkpoint_page and commit_checkpoint hand out or merge a user's
+    items, so only call them once AO3 has accepted that user's login.
+    load_visits, checkpoint_start and find_start_page only steer which pages
+    a scrape fetches and never reach the client, so they may run before it.
+    """
+
+    def __init__(self, path=DEFAULT_DB_PATH):
+        self.path = path
+        directory = os.path.dirname(path)
+        if directory:
+            os.makedirs(directory, exist_ok=True)
+        with self._connect() as conn:
+            conn.executescript(SCHEMA)
+
+    @contextmanager
+    def _connect(self):
+        """Open a connection for one transaction (committed on success)"""
+        conn = sqlite3.connect(self.path, timeout=30)
+        try:
+            conn.execute('PRAGMA journal_mode=WAL')
+            with conn:
+                yield conn
+        finally:
+            conn.close()
+
+    def load_visits(self, username):
+        """
+        Load only the URL -> lastVisited map of a user's stored history
+
+        Returns:
+            Tuple of ({url: lastVisited}, whether the history is complete)
+        """
+        key = user_key(username)
+        with self._connect() as conn:
+            row = conn.execute(
+                'SELECT complete FROM history_users WHERE user_hash = ?', (key,)
+            ).fetchone()
+            if row is None:
+                return {}, False
+            visits = dict(conn.execute(
+                'SELECT url, last_visited FROM history_items WHERE user_hash = ?', (key,)
+            ))
+        return visits, bool(row[0])
+
+    def read_items(self, username, start=0, year=None, limit=READ_BATCH_ITEMS):
+        """
+        Read up to `limit` of a user's stored items from position `start` on
+
+        With `year`, only that year's rows are read, through the index on the
+        lastVisited month. Each call is a short query of its own, so callers
+        on an event loop can run it with asyncio.to_thread.
+
+        Returns:
+            Tuple of (list of WorkItems, position to read the next batch from,
+            or None when there are no more)
+        """
+        key = user_key(username)
+        query = 'SELECT position, data FROM history_items WHERE user_hash = ? AND position >= ?'
+        params = [key, start]
+        if year:
+            query = ('SELECT position, data FROM history_items INDEXED BY history_items_month '
+                     'WHERE user_hash = ? AND position >= ? AND substr(last_visited, 1, 7) BETWEEN ? AND ?')
+            params += [f'{int(year):04d}-01', f'{int(year):04d}-12']
+        with self._connect() as conn:
+            rows = conn.execute(query + ' ORDER BY position LIMIT ?', params + [limit]).fetchall()
+        items = [WorkItem.from_dict(json.loads(data)) for _, data in rows]
+        return items, (rows[-1][0] + 1 if len(rows) == limit else None)
+
+    def iter_items(self, username, start=0, year=None):
+        """Yield a user's stored items from position `start` on, read in batches (see read_items)"""
+        while start is not None:
+            items, start = self.read_items(username, start, year)
+            yield from items
+
+    def delete(self, username):
+        """Forget everything stored for a user"""
+        key = user_key(username)
+        with self._connect() as conn:
+            conn.execute('DELETE FROM history_items WHERE user_hash = ?', (key,))
+            conn.execute('DELETE FROM history_users WHERE user_hash = ?', (key,))
+            conn.execute('DELETE FROM scrape_checkpoints WHERE user_hash = ?', (key,))
+            conn.execute('DELETE FROM history_pages WHERE user_hash = ?', (key,))
+
+    def save_checkpoint(self, username, year, page, page_items):
+        """
+        Record that `page` of an in-progress scrape was fetched and parsed
+
+        The page's range of lastVisited dates is also kept in history_pages,
+        which find_start_page uses to skip pages on later scrapes.
+        """
+        key = user_key(username)
+        now = time.time()
+        visits = [item['lastVisited'] for item in page_items if item['lastVisited']]
+        with self._connect() as conn:
+            conn.execute(
+                'INSERT OR REPLACE INTO scrape_checkpoints (user_hash, year, page, items, updated_at) '
+                'VALUES (?, ?, ?, ?, ?)',
+                (key, str(year or 'all'), page, json.dumps(page_items, default=json_default), now)
+            )
+            if visits:
+                conn.execute(
+                    'INSERT OR REPLACE INTO history_pages (user_hash, page, newest, oldest, updated_at) '
+                    'VALUES (?, ?, ?, ?, ?)',
+                    (key, page, max(visits), min(visits), now)
+                )
+
+    def find_start_page(self, username, year):
+        """
+        Highest page known to hold only works visited after `year`, or None
+
+        The history is ordered by lastVisited and new visits only push works
+        to later pages, so every page up to this one still holds nothing from
+        `year` unless works were deleted from the history since. The scraper
+        fetches this page first to check that before skipping ahead.
+        """
+        with self._connect() as conn:
+            (page,) = conn.execute(
+                'SELECT MAX(page) FROM history_pages WHERE user_hash = ? AND oldest >= ?',
+                (user_key(username), f'{int(year) + 1:04d}-01-01')
+            ).fetchone()
+        return page
+
+    def checkpoint_start(self, username, year, max_age=CHECKPOINT_TTL):
+        """
+        Next page to fetch after an earlier, unfinished scrape, or None
+
+        Only page numbers are read, never items, so the resume point can be
+        found before the user has logged in.
+        """
+        with self._connect() as conn:
+            rows = conn.execute(
+                'SELECT page, updated_at FROM scrape_checkpoints '
+                'WHERE user_hash = ? AND year = ? ORDER BY page',
+                (user_key(username), str(year or 'all'))
+            ).fetchall()
+        if not rows or time.time() - max(row[1] for row in rows) > max_age:
+            return None
+
+        next_page = 1
+        for page, _ in rows:
+            if page != next_page:
+                break  # only resume from a contiguous run of pages
+            next_page += 1
+        return next_page if next_page > 1 else None
+
+    def load_checkpoint_page(self, username, year, page):
+        """
+        Items of one checkpointed page ([] if it is gone)
+
+        Checkpoints are keyed by the username alone, so only read them once
+        AO3 has accepted this user's login for the scrape.
+        """
+        with self._connect() as conn:
+            row = conn.execute(
+                'SELECT items FROM scrape_checkpoints WHERE user_hash = ? AND year = ? AND page = ?',
+                (user_key(username), str(year or 'all'), page)
+            ).fetchone()
+        return [WorkItem.from_dict(item) for item in json.loads(row[0])] if row else []
+
+    def commit_checkpoint(self, username, year, last_page, complete, first_page=1):
+        """
+        Merge the checkpointed pages 1..`last_page` on top of the stored history
+
+        A work fetched again replaces its stored entry. The merge runs inside
+        the database one page at a time, so the fetched items never have to be
+        held in memory together. The checkpoint is dropped afterwards.
+
+        A scrape that skipped ahead passes the page it started at as
+        `first_page`: stored works visited no earlier than the newest work on
+        that page stand for the skipped pages and stay on top.
+
+        Returns:
+            Number of positions taken by the fetched items and the works kept
+            on top of them (stored items that were not fetched again now start
+            there), or None when a page is missing from the checkpoint and
+            nothing was changed
+
+        Only call this at the end of a scrape whose login AO3 accepted: the
+        checkpointed pages become part of the stored history.
+        """
+        key = user_key(username)
+        year_key = str(year or 'all')
+        with self._connect() as conn:
+            pages = [page for (page,) in conn.execute(
+                'SELECT page FROM scrape_checkpoints WHERE user_hash = ? AND year = ? AND page BETWEEN ? AND ? '
+                'ORDER BY page',
+                (key, year_key, first_page, last_page)
+            )]
+            if pages != list(range(first_page, last_page + 1)):
+                return None
+
+            # Move the stored items out of the way of the fetched positions
+            conn.execute(
+                'UPDATE history_items SET position = position + ? WHERE user_hash = ?',
+                (CHECKPOINT_POSITION_SHIFT, key)
+            )
+
+            fetched = 0
+            for page in pages:
+                (page_items,) = conn.execute(
+                    'SELECT items FROM scrape_checkpoints WHERE user_hash = ? AND year = ? AND page = ?',
+                    (key, year_key, page)
+                ).fetchone()
+                page_items = json.loads(page_items)
+                # A work fetched again replaces its stored entry
+                conn.executemany(
+                    'DELETE FROM history_items WHERE user_hash = ? AND url = ? AND position >= ?',
+                    [(key, item['url'], CHECKPOINT_POSITION_SHIFT) for item in page_items]
+                )
+                conn.executemany(
+                    'INSERT OR IGNORE INTO history_items (user_hash, url, position, last_visited, data) '
+                    'VALUES (?, ?, ?, ?, ?)',
+                    [
+                        (key, item['url'], fetched + offset, item.get('lastVisited'), json.dumps(item))
+                        for offset, item in enumerate(page_items)
+                    ]
+                )
+                fetched += len(page_items)
+
+            if first_page > 1:
+                fetched = self._keep_newer_on_top(conn, key, year_key, first_page, fetched)
+            conn.execute(
+                'UPDATE history_items SET position = position - ? WHERE user_hash = ? AND position >= ?',
+                (CHECKPOINT_POSITION_SHIFT - fetched, key, CHECKPOINT_POSITION_SHIFT)
+            )
+            conn.execute(
+                'INSERT OR REPLACE INTO history_users (user_hash, complete, updated_at) VALUES (?, ?, ?)',
+                (key, int(complete), time.time())
+            )
+            conn.execute(
+                'DELETE FROM scrape_checkpoints WHERE user_hash = ? AND year = ?', (key, year_key)
+            )
+        return fetched
+
+    @staticmethod
+    def _keep_newer_on_top(conn, key, year_key, first_page, fetched):
+        """
+        Move the stored works that belong before the fetched pages to the top
+
+        Runs inside commit_checkpoint, while the fetched items take positions
+        0..`fetched` and the stored ones sit above CHECKPOINT_POSITION_SHIFT.
+
+        Returns:
+            Positions now taken by the works on top and the fetched items
+        """
+        (page_items,) = conn.execute(
+            'SELECT items FROM scrape_checkpoints WHERE user_hash = ? AND year = ? AND page = ?',
+            (key, year_key, first_page)
+        ).fetchone()
+        visits = [item['lastVisited'] for item in json.loads(page_items) if item.get('lastVisited')]
+        if not visits:
+            return fetched
+
+        newer = [url for (url,) in conn.execute(
+            'SELECT url FROM history_items WHERE user_hash = ? AND position >= ? AND last_visited >= ? '
+            'ORDER BY position',
+            (key, CHECKPOINT_POSITION_SHIFT, max(visits))
+        )]
+        if not newer:
+            return fetched
+        conn.execute(
+            'UPDATE history_items SET position = position + ? WHERE user_hash = ? AND position < ?',
+            (len(newer), key, CHECKPOINT_POSITION_SHIFT)
+        )
+        conn.executemany(
+            'UPDATE history_items SET position = ? WHERE user_hash = ? AND url = ?',
+            [(position, key, url) for position, url in enumerate(newer)]
+        )
+        # Close the gaps they leave among the remaining stored works
+        remaining = [url for (url,) in conn.execute(
+            'SELECT url FROM history_items WHERE user_hash = ? AND position >= ? ORDER BY position',
+            (key, CHECKPOINT_POSITION_SHIFT)
+        )]
+        conn.executemany(
+            'UPDATE history_items SET position = ? WHERE user_hash = ? AND url = ?',
+            [(CHECKPOINT_POSITION_SHIFT + position, key, url) for position, url in enumerate(remaining)]
+        )
+        return fetched + len(newer)
+
+    def clear_checkpoint(self, username, year):
+        """Drop the checkpoint once a scrape has finished"""
+        with self._connect() as conn:
+            conn.execute(
+                'DELETE FROM scrape_checkpoints WHERE user_hash = ? AND year = ?',
+                (user_key(username), str(year or 'all'))
+            )
+
+
+def get_default_store():
+    """
+    Return the configured history store, or None when caching is disabled
+
+    The database path comes from AO3_CACHE_DB; set it to "off" to disable.
+    """
+    path = os.environ.get('AO3_CACHE_DB', DEFAULT_DB_PATH)
+    if path.lower() in ('', 'off', 'none', '0'):
+        return None
+    try:
+        return HistoryStore(path)
+    except (sqlite3.Error, OSError) as e:
+        print(f'History cache disabled, could not open {path}: {e}')
+        return None
@@ -0,0 +1,137 @@
+import hashlib
+import json
+import os
+import threading
+from collections import OrderedDict
+
+
+def content_digest(*parts):
+    """Stable SHA-256 hex digest of JSON-serialisable inputs"""
+    encoded = json.dumps(parts, sort_keys=True, separators=(',', ':'), ensure_ascii=False)
+    return hashlib.sha256(encoded.encode('utf-8')).hexdigest()
+
+
+class ImageCache:
+    """
+    LRU cache of rendered PNG bytes, bounded by total size
+
+    When `spill_dir` is configured every entry is also written there and read
+    back on a memory miss, so the disk acts as a second, larger tier bounded
+    by `max_disk_bytes` that outlives memory evictions and can be shared by
+    several worker processes.
+    """
+
+    def __init__(self, max_bytes=64 * 1024 * 1024, spill_dir=None, max_disk_bytes=512 * 1024 * 1024):
+        self.max_bytes = max_bytes
+        self.spill_dir = spill_dir
+        self.max_disk_bytes = max_disk_bytes
+        self.size = 0
+        self.hits = 0
+        self.misses = 0
+        self._entries = OrderedDict()
+        self._lock = threading.Lock()
+        if spill_dir:
+            os.makedirs(spill_dir, exist_ok=True)
+
+    def get(self, digest):
+        """Return the cached bytes for `digest`, or None"""
+        with self._lock:
+            data = self._entries.get(digest)
+            if data is not None:
+                self._entries.move_to_end(digest)
+                self.hits += 1
+                return data
+
+        data = self._read_spilled(digest)
+        with self._lock:
+            if data is None:
+                self.misses += 1
+                return None
+            self.hits += 1
+            if len(data) <= self.max_bytes:
+                self._insert(digest, data)
+        return data
+
+    def put(self, digest, data):
+        """Store `data` under `digest`, evicting least recently used entries"""
+        self._spill(digest, data)
+        if len(data) > self.max_bytes:
+            return
+
+        with self._lock:
+            self._insert(digest, data)
+
+    def _insert(self, digest, data):
+        """Add an entry as most recently used; caller holds the lock"""
+        previous = self._entries.pop(digest, None)
+        if previous is not None:
+            self.size -= len(previous)
+        self._entries[digest] = data
+        self.size += len(data)
+        while self.size > self.max_bytes:
+            _, old_data = self._entries.popitem(last=False)
+            self.size -= len(old_data)
+
+    def stats(self):
+        with self._lock:
+            return {
+                'entries': len(self._entries),
+                'bytes': self.size,
+                'maxBytes': self.max_bytes,
+                'hits': self.hits,
+                'misses': self.misses,
+            }
+
+    def _spill_path(self, digest):
+        return os.path.join(self.spill_dir, f'{digest}.png')
+
+    def _read_spilled(self, digest):
+        if not self.spill_dir:
+            return None
+        try:
+            with open(self._spill_path(digest), 'rb') as f:
+                return f.read()
+        except OSError:
+            return None
+
+    def _spill(self, digest, data):
+        if not self.spill_dir:
+            return
+        path = self._spill_path(digest)
+        try:
+            if not os.path.exists(path):
+                tmp_path = f'{path}.{threading.get_ident()}.tmp'
+                with open(tmp_path, 'wb') as f:
+                    f.write(data)
+                os.replace(tmp_path, path)
+            self._prune_disk()
+        except OSError as e:
+            print(f'Could not spill image {digest} to disk: {e}')
+
+    def _prune_disk(self):
+        """Delete the oldest spilled files once the disk tier is over budget"""
+        files = []
+        total = 0
+        for entry in os.scandir(self.spill_dir):
+            if entry.name.endswith('.png'):
+                stat = entry.stat()
+                files.append((stat.st_mtime, entry.path, stat.st_size))
+                total += stat.st_size
+        if total <= self.max_disk_bytes:
+            return
+        for _, path, size in sorted(files):
+            try:
+                os.remove(path)
+            except OSError:
+                continue
+            total -= size
+            if total <= self.max_disk_bytes:
+                break
+
+
+def create_image_cache():
+    """Build the image cache from AO3_IMAGE_CACHE_MB and AO3_IMAGE_CACHE_DIR"""
+    return ImageCache(
+        max_bytes=int(float(os.environ.get('AO3_IMAGE_CACHE_MB', 64)) * 1024 * 1024),
+        spill_dir=os.environ.get('AO3_IMAGE_CACHE_DIR') or None,
+    )
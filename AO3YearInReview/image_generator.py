@@ -1,46 +1,99 @@
 from PIL import Image, ImageDraw, ImageFont
 import os
 import io
-import base64
+import threading
+import time
+from concurrent.futures import ProcessPoolExecutor
+from concurrent.futures.process import BrokenProcessPool
+from functools import lru_cache, partial
+
+from image_cache import content_digest, create_image_cache
+from metrics import CARD_CACHE_HITS, CARD_ENCODE_SECONDS, CARD_RENDER_SECONDS
+
+# Bump whenever card layouts change so cached renders are not reused
+RENDER_VERSION = 1
+
+# Rendered PNGs keyed by a digest of the data each card draws
+image_cache = create_image_cache()
+
+# Processes that render cards in parallel (0 renders in the calling thread)
+RENDER_PROCESSES = int(os.environ.get('AO3_RENDER_PROCESSES', min(4, os.cpu_count() or 1)))
+
+_render_pool = None
+_render_pool_lock = threading.Lock()
+
+@lru_cache(maxsize=32)
+def _gradient_template(width, height, color1, color2):
+    """
+    Build the gradient once per (size, colors)
+
+    The mask is a single column of `height` values stretched across the
+    width, instead of one Python int per pixel.
+    """
+    column = Image.new('L', (1, height))
+    column.putdata([int(255 * (y / height)) for y in range(height)])
+    mask = column.resize((width, height), Image.NEAREST)
 
-def create_gradient(width, height, color1, color2):
-    """Create a subtle vertical gradient from color1 to color2"""
     base = Image.new('RGB', (width, height), color1)
     top = Image.new('RGB', (width, height), color2)
-    mask = Image.new('L', (width, height))
-    mask_data = []
-    for y in range(height):
-        mask_data.extend([int(255 * (y / height))] * width)
-    mask.putdata(mask_data)
     base.paste(top, (0, 0), mask)
     return base
 
-def get_font(size):
-    """Try to get a nice font, fall back to default if unavailable"""
-    font_paths = [
-        '/usr/share/fonts/truetype/dejavu/DejaVuSans-Bold.ttf',
-        '/usr/share/fonts/truetype/dejavu/DejaVuSans.ttf',
-        '/System/Library/Fonts/Helvetica.ttc',
-        '/Windows/Fonts/arial.ttf'
-    ]
-
-    for path in font_paths:
+def create_gradient(width, height, color1, color2):
+    """Create a subtle vertical gradient from color1 to color2"""
+    return _gradient_template(width, height, tuple(color1), tuple(color2)).copy()
+
+DEFAULT_FONT_PATHS = [
+    '/usr/share/fonts/truetype/dejavu/DejaVuSans-Bold.ttf',
+    '/usr/share/fonts/truetype/dejavu/DejaVuSans.ttf',
+    '/System/Library/Fonts/Helvetica.ttc',
+    '/Windows/Fonts/arial.ttf'
+]
+
+def font_paths():
+    """Candidate font files: AO3_FONT_PATHS (os.pathsep separated) first, then the defaults"""
+    configured = [p for p in os.environ.get('AO3_FONT_PATHS', '').split(os.pathsep) if p]
+    return configured + DEFAULT_FONT_PATHS
+
+@lru_cache(maxsize=1)
+def _resolve_font_path():
+    """First usable font file, looked up once per process (None for PIL's default)"""
+    for path in font_paths():
         if os.path.exists(path):
             try:
-                return ImageFont.truetype(path, size)
-            except:
+                ImageFont.truetype(path, 12)
+                return path
+            except OSError:
                 pass
+    return None
+
+@lru_cache(maxsize=64)
+def _load_font(path, size):
+    if path is None:
+        return ImageFont.load_default()
+    return ImageFont.truetype(path, size)
+
+def get_font(size):
+    """Try to get a nice font, fall back to default if unavailable (loaded once per size)"""
+    return _load_font(_resolve_font_path(), size)
+
+@lru_cache(maxsize=4096)
+def text_width(text, font):
+    """
+    Width of `text` in `font`, measured once per (text, font)
 
-    return ImageFont.load_default()
+    Fonts come from get_font, which returns the same object for a size, so
+    the font itself is a stable cache key.
+    """
+    bbox = font.getbbox(text)
+    return bbox[2] - bbox[0]
 
 def draw_text_centered(draw, y, text, font, fill_color, width):
     """Draw centered text"""
-    bbox = draw.textbbox((0, 0), text, font=font)
-    text_width = bbox[2] - bbox[0]
-    x = (width - text_width) // 2
+    x = (width - text_width(text, font)) // 2
     draw.text((x, y), text, font=font, fill=fill_color)
 
-def wrap_text(text, font, max_width, draw):
+def wrap_text(text, font, max_width):
     """Wrap text to fit within max_width"""
     words = text.split()
     lines = []
@@ -48,8 +101,7 @@ def wrap_text(text, font, max_width, draw):
 
     for word in words:
         test_line = ' '.join(current_line + [word])
-        bbox = draw.textbbox((0, 0), test_line, font=font)
-        if bbox[2] - bbox[0] <= max_width:
+        if text_width(test_line, font) <= max_width:
             current_line.append(word)
         else:
             if current_line:
@@ -61,317 +113,320 @@ def wrap_text(text, font, max_width, draw):
 
     return lines
 
-def create_top_ships_image(ships):
-    """Create an image showing top 5 ships and return as base64"""
-    width, height = 1080, 1920
+# Seconds the calling thread's last encode_png took, read back by _timed_render
+_encode_timing = threading.local()
 
-    # Create subtle gradient background (AO3 maroon shades)
-    img = create_gradient(width, height, (115, 0, 10), (74, 0, 6))
+def encode_png(img):
+    """Encode a card as PNG bytes"""
+    start = time.perf_counter()
+    buffer = io.BytesIO()
+    img.save(buffer, format='PNG')
+    _encode_timing.seconds = time.perf_counter() - start
+    return buffer.getvalue()
+
+CARD_WIDTH, CARD_HEIGHT = 1080, 1920
+
+# Ranked "top N" cards, in display order. Each spec names the statistics list
+# it draws, the field holding an entry's label, and the static text/colors.
+# A new card (characters, ratings, ...) only needs an entry here.
+TOP_CARD_SPECS = {
+    'ships': {
+        'statistic': 'topShips',
+        'key': 'ship',
+        'title': 'Top Ships',
+        'subtitle': 'Your Most Read Relationships',
+        'colors': ((115, 0, 10), (74, 0, 6)),
+        'limit': 5,
+    },
+    'tags': {
+        'statistic': 'topTags',
+        'key': 'tag',
+        'title': 'Top Tags',
+        'subtitle': 'Your Favorite Themes',
+        'colors': ((90, 0, 8), (115, 0, 10)),
+        'limit': 5,
+    },
+    'fandoms': {
+        'statistic': 'topFandoms',
+        'key': 'fandom',
+        'title': 'Top Fandoms',
+        'subtitle': 'Your Favorite Universes',
+        'colors': ((128, 0, 12), (90, 0, 8)),
+        'limit': 5,
+    },
+}
+
+# Top card row geometry: row i starts at TOP_ROW_START + i * TOP_ROW_STEP
+TOP_ROW_START = 400
+TOP_ROW_STEP = 250
+
+def draw_card_header(draw, title, subtitle, width=CARD_WIDTH):
+    """Draw the maroon header band with a card's title and subtitle"""
+    draw.rectangle([0, 0, width, 280], fill=(153, 0, 17))
+    draw_text_centered(draw, 90, title, get_font(90), (255, 255, 255), width)
+    draw_text_centered(draw, 190, subtitle, get_font(42), (255, 220, 220), width)
+
+@lru_cache(maxsize=32)
+def _top_card_layer(card, rows):
+    """
+    Everything on a top card that does not depend on the user's data
+
+    Background, header, row boxes and numbered rank badges are drawn once
+    per (card, number of rows) in each process; renders copy the result and
+    only draw names and counts on top.
+    """
+    spec = TOP_CARD_SPECS[card]
+    width = CARD_WIDTH
+    img = create_gradient(width, CARD_HEIGHT, *spec['colors'])
     draw = ImageDraw.Draw(img)
+    draw_card_header(draw, spec['title'], spec['subtitle'])
 
-    # Header section with title
-    header_height = 280
-    draw.rectangle([0, 0, width, header_height], fill=(153, 0, 17))
-
-    title_font = get_font(90)
-    draw_text_centered(draw, 90, "Top Ships", title_font, (255, 255, 255), width)
-
-    # Subtitle
-    subtitle_font = get_font(42)
-    draw_text_centered(draw, 190, "Your Most Read Relationships", subtitle_font, (255, 220, 220), width)
-
-    # Draw ships
-    y_offset = 400
-    item_font = get_font(52)
-    count_font = get_font(44)
-
-    for i, ship in enumerate(ships[:5]):
-        ship_name = ship['ship']
-        count = ship['count']
+    rank_font = get_font(48)
+    badge_size = 90
+    badge_x = 100
+    for i in range(rows):
+        y_offset = TOP_ROW_START + i * TOP_ROW_STEP
 
         # Card background
-        card_top = y_offset - 30
-        card_bottom = y_offset + 160
-        draw.rectangle([60, card_top, width - 60, card_bottom],
+        draw.rectangle([60, y_offset - 30, width - 60, y_offset + 160],
                       fill=(255, 245, 245), outline=(153, 0, 17), width=4)
 
         # Rank badge
-        badge_size = 90
-        badge_x = 100
         badge_y = y_offset + 10
         draw.ellipse([badge_x, badge_y, badge_x + badge_size, badge_y + badge_size],
                     fill=(153, 0, 17))
 
-        rank_font = get_font(48)
         rank_text = f"{i+1}"
-        bbox = draw.textbbox((0, 0), rank_text, font=rank_font)
-        rank_width = bbox[2] - bbox[0]
+        rank_width = text_width(rank_text, rank_font)
         draw.text((badge_x + (badge_size - rank_width) // 2, badge_y + 18),
                  rank_text, font=rank_font, fill=(255, 255, 255))
 
-        # Count (calculate position first)
-        count_text = f"{count} fics"
-        bbox = draw.textbbox((0, 0), count_text, font=count_font)
-        count_width = bbox[2] - bbox[0]
-        count_x = width - count_width - 100
-
-        # Ship name (wrapped with proper width to avoid count)
-        max_text_width = count_x - 250
-        ship_lines = wrap_text(ship_name, item_font, max_text_width, draw)
-        ship_y = y_offset + 20 if len(ship_lines) == 1 else y_offset
+    return img
 
-        for line in ship_lines[:2]:
-            draw.text((230, ship_y), line, font=item_font, fill=(50, 0, 5))
-            ship_y += 60
+def render_top_card(card, entries):
+    """
+    Render a ranked card described by TOP_CARD_SPECS[card] and return the PNG bytes
 
-        # Draw count
-        draw.text((count_x, y_offset + 55),
-                 count_text, font=count_font, fill=(120, 0, 10))
-
-        y_offset += 250
-
-    # Save to BytesIO and return base64
-    buffer = io.BytesIO()
-    img.save(buffer, format='PNG')
-    buffer.seek(0)
-    img_base64 = base64.b64encode(buffer.getvalue()).decode('utf-8')
-    return f'data:image/png;base64,{img_base64}'
+    Args:
+        card: Key into TOP_CARD_SPECS
+        entries: List of {<spec key>: name, 'count': n} dicts, highest first
 
-def create_top_tags_image(tags):
-    """Create an image showing top 5 tags and return as base64"""
-    width, height = 1080, 1920
+    Returns:
+        PNG bytes
+    """
+    spec = TOP_CARD_SPECS[card]
+    entries = entries[:spec['limit']]
+    width = CARD_WIDTH
 
-    # Create subtle gradient background (dark maroon to AO3 maroon)
-    img = create_gradient(width, height, (90, 0, 8), (115, 0, 10))
+    img = _top_card_layer(card, len(entries)).copy()
     draw = ImageDraw.Draw(img)
 
-    # Header section with title
-    header_height = 280
-    draw.rectangle([0, 0, width, header_height], fill=(153, 0, 17))
-
-    title_font = get_font(90)
-    draw_text_centered(draw, 90, "Top Tags", title_font, (255, 255, 255), width)
-
-    # Subtitle
-    subtitle_font = get_font(42)
-    draw_text_centered(draw, 190, "Your Favorite Themes", subtitle_font, (255, 220, 220), width)
-
-    # Draw tags
-    y_offset = 400
     item_font = get_font(52)
     count_font = get_font(44)
 
-    for i, tag in enumerate(tags[:5]):
-        tag_name = tag['tag']
-        count = tag['count']
-
-        # Card background
-        card_top = y_offset - 30
-        card_bottom = y_offset + 160
-        draw.rectangle([60, card_top, width - 60, card_bottom],
-                      fill=(255, 245, 245), outline=(153, 0, 17), width=4)
-
-        # Rank badge
-        badge_size = 90
-        badge_x = 100
-        badge_y = y_offset + 10
-        draw.ellipse([badge_x, badge_y, badge_x + badge_size, badge_y + badge_size],
-                    fill=(153, 0, 17))
-
-        rank_font = get_font(48)
-        rank_text = f"{i+1}"
-        bbox = draw.textbbox((0, 0), rank_text, font=rank_font)
-        rank_width = bbox[2] - bbox[0]
-        draw.text((badge_x + (badge_size - rank_width) // 2, badge_y + 18),
-                 rank_text, font=rank_font, fill=(255, 255, 255))
+    for i, entry in enumerate(entries):
+        y_offset = TOP_ROW_START + i * TOP_ROW_STEP
 
         # Count (calculate position first)
-        count_text = f"{count} fics"
-        bbox = draw.textbbox((0, 0), count_text, font=count_font)
-        count_width = bbox[2] - bbox[0]
+        count_text = f"{entry['count']} fics"
+        count_width = text_width(count_text, count_font)
         count_x = width - count_width - 100
 
-        # Tag name (wrapped with proper width to avoid count)
+        # Name (wrapped with proper width to avoid count)
         max_text_width = count_x - 250
-        tag_lines = wrap_text(tag_name, item_font, max_text_width, draw)
-        tag_y = y_offset + 20 if len(tag_lines) == 1 else y_offset
+        name_lines = wrap_text(entry[spec['key']], item_font, max_text_width)
+        name_y = y_offset + 20 if len(name_lines) == 1 else y_offset
 
-        for line in tag_lines[:2]:
-            draw.text((230, tag_y), line, font=item_font, fill=(50, 0, 5))
-            tag_y += 60
+        for line in name_lines[:2]:
+            draw.text((230, name_y), line, font=item_font, fill=(50, 0, 5))
+            name_y += 60
 
         # Draw count
         draw.text((count_x, y_offset + 55),
                  count_text, font=count_font, fill=(120, 0, 10))
 
-        y_offset += 250
+    return encode_png(img)
 
-    # Save to BytesIO and return base64
-    buffer = io.BytesIO()
-    img.save(buffer, format='PNG')
-    buffer.seek(0)
-    img_base64 = base64.b64encode(buffer.getvalue()).decode('utf-8')
-    return f'data:image/png;base64,{img_base64}'
-
-def create_top_fandoms_image(fandoms):
-    """Create an image showing top 5 fandoms and return as base64"""
-    width, height = 1080, 1920
-
-    # Create subtle gradient background (burgundy to deep maroon)
-    img = create_gradient(width, height, (128, 0, 12), (90, 0, 8))
-    draw = ImageDraw.Draw(img)
+def create_top_ships_image(ships):
+    """Create an image showing top 5 ships and return the PNG bytes"""
+    return render_top_card('ships', ships)
 
-    # Header section with title
-    header_height = 280
-    draw.rectangle([0, 0, width, header_height], fill=(153, 0, 17))
+def create_top_tags_image(tags):
+    """Create an image showing top 5 tags and return the PNG bytes"""
+    return render_top_card('tags', tags)
 
-    title_font = get_font(90)
-    draw_text_centered(draw, 90, "Top Fandoms", title_font, (255, 255, 255), width)
+def create_top_fandoms_image(fandoms):
+    """Create an image showing top 5 fandoms and return the PNG bytes"""
+    return render_top_card('fandoms', fandoms)
 
-    # Subtitle
-    subtitle_font = get_font(42)
-    draw_text_centered(draw, 190, "Your Favorite Universes", subtitle_font, (255, 220, 220), width)
+# Overall card boxes as (y offset, box height below it, label)
+OVERALL_BOXES = [
+    (450, 220, "Total Fics Read"),
+    (800, 220, "Total Words Read"),
+    (1150, 340, "Longest Fic"),
+]
 
-    # Draw fandoms
-    y_offset = 400
-    item_font = get_font(52)
-    count_font = get_font(44)
+@lru_cache(maxsize=1)
+def _overall_stats_layer():
+    """Background, header, boxes and labels of the overall stats card"""
+    width = CARD_WIDTH
 
-    for i, fandom in enumerate(fandoms[:5]):
-        fandom_name = fandom['fandom']
-        count = fandom['count']
+    # Create subtle gradient background (AO3 maroon to dark burgundy)
+    img = create_gradient(width, CARD_HEIGHT, (115, 0, 10), (128, 0, 12))
+    draw = ImageDraw.Draw(img)
+    draw_card_header(draw, "Reading Stats", "Your AO3 Journey")
 
-        # Card background
-        card_top = y_offset - 30
-        card_bottom = y_offset + 160
-        draw.rectangle([60, card_top, width - 60, card_bottom],
+    label_font = get_font(48)
+    for y_offset, box_height, label in OVERALL_BOXES:
+        draw.rectangle([80, y_offset - 30, width - 80, y_offset + box_height],
                       fill=(255, 245, 245), outline=(153, 0, 17), width=4)
+        draw_text_centered(draw, y_offset + 20, label, label_font, (120, 0, 10), width)
 
-        # Rank badge
-        badge_size = 90
-        badge_x = 100
-        badge_y = y_offset + 10
-        draw.ellipse([badge_x, badge_y, badge_x + badge_size, badge_y + badge_size],
-                    fill=(153, 0, 17))
-
-        rank_font = get_font(48)
-        rank_text = f"{i+1}"
-        bbox = draw.textbbox((0, 0), rank_text, font=rank_font)
-        rank_width = bbox[2] - bbox[0]
-        draw.text((badge_x + (badge_size - rank_width) // 2, badge_y + 18),
-                 rank_text, font=rank_font, fill=(255, 255, 255))
-
-        # Count (calculate position first)
-        count_text = f"{count} fics"
-        bbox = draw.textbbox((0, 0), count_text, font=count_font)
-        count_width = bbox[2] - bbox[0]
-        count_x = width - count_width - 100
-
-        # Fandom name (wrapped with proper width to avoid count)
-        max_text_width = count_x - 250
-        fandom_lines = wrap_text(fandom_name, item_font, max_text_width, draw)
-        fandom_y = y_offset + 20 if len(fandom_lines) == 1 else y_offset
-
-        for line in fandom_lines[:2]:
-            draw.text((230, fandom_y), line, font=item_font, fill=(50, 0, 5))
-            fandom_y += 60
-
-        # Draw count
-        draw.text((count_x, y_offset + 55),
-                 count_text, font=count_font, fill=(120, 0, 10))
-
-        y_offset += 250
-
-    # Save to BytesIO and return base64
-    buffer = io.BytesIO()
-    img.save(buffer, format='PNG')
-    buffer.seek(0)
-    img_base64 = base64.b64encode(buffer.getvalue()).decode('utf-8')
-    return f'data:image/png;base64,{img_base64}'
+    longest_y = OVERALL_BOXES[-1][0]
+    draw_text_centered(draw, longest_y + 200, "words", get_font(40), (120, 0, 10), width)
+    return img
 
 def create_overall_stats_image(stats):
-    """Create an image showing overall reading stats and return as base64"""
-    width, height = 1080, 1920
-
-    # Create subtle gradient background (AO3 maroon to dark burgundy)
-    img = create_gradient(width, height, (115, 0, 10), (128, 0, 12))
+    """Create an image showing overall reading stats and return the PNG bytes"""
+    width = CARD_WIDTH
+    img = _overall_stats_layer().copy()
     draw = ImageDraw.Draw(img)
 
-    # Header section with title
-    header_height = 280
-    draw.rectangle([0, 0, width, header_height], fill=(153, 0, 17))
-
-    title_font = get_font(90)
-    draw_text_centered(draw, 90, "Reading Stats", title_font, (255, 255, 255), width)
-
-    # Subtitle
-    subtitle_font = get_font(42)
-    draw_text_centered(draw, 190, "Your AO3 Journey", subtitle_font, (255, 220, 220), width)
-
-    # Stats section
-    y_offset = 450
-    label_font = get_font(48)
     value_font = get_font(90)
-
-    # Total fics card
-    draw.rectangle([80, y_offset - 30, width - 80, y_offset + 220],
-                  fill=(255, 245, 245), outline=(153, 0, 17), width=4)
-    draw_text_centered(draw, y_offset + 20, "Total Fics Read", label_font, (120, 0, 10), width)
-    draw_text_centered(draw, y_offset + 100, f"{stats['totalFics']:,}", value_font, (50, 0, 5), width)
-
-    y_offset += 350
-
-    # Total words card
-    draw.rectangle([80, y_offset - 30, width - 80, y_offset + 220],
-                  fill=(255, 245, 245), outline=(153, 0, 17), width=4)
-    draw_text_centered(draw, y_offset + 20, "Total Words Read", label_font, (120, 0, 10), width)
-    draw_text_centered(draw, y_offset + 100, f"{stats['totalWords']:,}", value_font, (50, 0, 5), width)
-
-    y_offset += 350
-
-    # Longest fic card
-    draw.rectangle([80, y_offset - 30, width - 80, y_offset + 340],
-                  fill=(255, 245, 245), outline=(153, 0, 17), width=4)
-    draw_text_centered(draw, y_offset + 20, "Longest Fic", label_font, (120, 0, 10), width)
-
-    longest_text = f"{stats['longestFic']['wordCount']:,}"
-    draw_text_centered(draw, y_offset + 100, longest_text, value_font, (50, 0, 5), width)
-
-    words_font = get_font(40)
-    draw_text_centered(draw, y_offset + 200, "words", words_font, (120, 0, 10), width)
+    values = [stats['totalFics'], stats['totalWords'], stats['longestFic']['wordCount']]
+    for (y_offset, _, _), value in zip(OVERALL_BOXES, values):
+        draw_text_centered(draw, y_offset + 100, f"{value:,}", value_font, (50, 0, 5), width)
 
     # Longest fic title
     if stats['longestFic']['title']:
         title_font_small = get_font(36)
         title_text = stats['longestFic']['title']
-        title_lines = wrap_text(title_text, title_font_small, width - 180, draw)
+        title_lines = wrap_text(title_text, title_font_small, width - 180)
 
-        title_y = y_offset + 260
+        title_y = OVERALL_BOXES[-1][0] + 260
         for line in title_lines[:2]:
             draw_text_centered(draw, title_y, line, title_font_small, (90, 0, 8), width)
             title_y += 45
 
-    # Save to BytesIO and return base64
-    buffer = io.BytesIO()
-    img.save(buffer, format='PNG')
-    buffer.seek(0)
-    img_base64 = base64.b64encode(buffer.getvalue()).decode('utf-8')
-    return f'data:image/png;base64,{img_base64}'
-
-def generate_all_stat_images(statistics):
-    """Generate all stat images and return them as base64 data URLs"""
-    image_data = {}
-
-    # Generate each image as base64
-    if statistics['topShips']:
-        image_data['ships'] = create_top_ships_image(statistics['topShips'])
-
-    if statistics['topTags']:
-        image_data['tags'] = create_top_tags_image(statistics['topTags'])
-
-    if statistics['topFandoms']:
-        image_data['fandoms'] = create_top_fandoms_image(statistics['topFandoms'])
-
-    image_data['overall'] = create_overall_stats_image(statistics)
-
-    return image_data
+    return encode_png(img)
+
+def card_inputs(statistics):
+    """
+    Return {card: (renderer, data)} with exactly the data each card draws
+
+    Only these values feed the cache key, so a change elsewhere in the
+    statistics does not invalidate a card that looks the same.
+    """
+    cards = {}
+    for card, spec in TOP_CARD_SPECS.items():
+        entries = statistics[spec['statistic']]
+        if entries:
+            cards[card] = (partial(render_top_card, card), entries[:spec['limit']])
+    cards['overall'] = (create_overall_stats_image, {
+        'totalFics': statistics['totalFics'],
+        'totalWords': statistics['totalWords'],
+        'longestFic': {
+            'title': statistics['longestFic']['title'],
+            'wordCount': statistics['longestFic']['wordCount'],
+        },
+    })
+    return cards
+
+def _timed_render(renderer, data):
+    """Render one card in a pool process, returning (PNG bytes, seconds, of which PNG encoding)"""
+    _encode_timing.seconds = 0.0
+    start = time.perf_counter()
+    png = renderer(data)
+    return png, time.perf_counter() - start, _encode_timing.seconds
+
+def _warm_worker():
+    """Load fonts and draw the full static layers in a pool process ahead of real renders"""
+    for size in (36, 40, 42, 44, 48, 52, 90):
+        get_font(size)
+    for card, spec in TOP_CARD_SPECS.items():
+        _top_card_layer(card, spec['limit'])
+    _overall_stats_layer()
+    return os.getpid()
+
+def get_render_pool():
+    """Return the shared render process pool, creating it on first use"""
+    global _render_pool
+    if RENDER_PROCESSES <= 0:
+        return None
+    with _render_pool_lock:
+        if _render_pool is None:
+            _render_pool = ProcessPoolExecutor(max_workers=RENDER_PROCESSES)
+        return _render_pool
+
+def warm_render_pool():
+    """
+    Start every render process ahead of the first request
+
+    Call this at startup, before other threads exist, so the workers are
+    forked from a quiet process.
+    """
+    pool = get_render_pool()
+    if pool is None:
+        return []
+    pids = [f.result() for f in [pool.submit(_warm_worker) for _ in range(RENDER_PROCESSES)]]
+    print(f'Render pool ready with {len(set(pids))} process(es)')
+    return pids
+
+def _reset_render_pool(broken_pool):
+    global _render_pool
+    with _render_pool_lock:
+        if _render_pool is broken_pool:
+            _render_pool = None
+    broken_pool.shutdown(wait=False)
+
+def render_stat_images(statistics):
+    """
+    Render every card not already cached, in parallel on the render pool
+
+    Returns:
+        Tuple of ({card: image URL}, {card: render seconds}); cards served
+        from the cache report 0
+    """
+    cards = card_inputs(statistics)
+    digests = {card: content_digest(RENDER_VERSION, card, data) for card, (_, data) in cards.items()}
+    timings = {}
+
+    misses = {}
+    for card, digest in digests.items():
+        if image_cache.get(digest) is None:
+            misses[card] = cards[card]
+        else:
+            timings[card] = 0.0
+            CARD_CACHE_HITS.labels(card).inc()
+
+    pool = get_render_pool()
+    results = {}
+    if pool is not None and len(misses) > 1:
+        try:
+            futures = {card: pool.submit(_timed_render, renderer, data)
+                       for card, (renderer, data) in misses.items()}
+            results = {card: future.result() for card, future in futures.items()}
+        except BrokenProcessPool:
+            print('Render pool broke, rendering in-process')
+            _reset_render_pool(pool)
+            results = {}
+
+    for card, (renderer, data) in misses.items():
+        if card not in results:
+            results[card] = _timed_render(renderer, data)
+
+    for card, (png, seconds, encode_seconds) in results.items():
+        image_cache.put(digests[card], png)
+        timings[card] = seconds
+        CARD_RENDER_SECONDS.labels(card).observe(seconds - encode_seconds)
+        CARD_ENCODE_SECONDS.labels(card).observe(encode_seconds)
+
+    return {card: card_url(digest) for card, digest in digests.items()}, timings
+
+def card_url(digest):
+    """Relative URL the frontend loads a cached card from"""
+    return f'api/images/{digest}.png'
+
+def get_card_png(digest):
+    """Return the PNG bytes of a rendered card, or None if it is no longer cached"""
+    return image_cache.get(digest)
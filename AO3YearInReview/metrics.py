@@ -0,0 +1,108 @@
+try:
+    from prometheus_client import CONTENT_TYPE_LATEST, CollectorRegistry, Counter, Gauge, Histogram, generate_latest
+except ImportError:
+    print('prometheus_client not installed, /api/metrics is disabled')
+    CollectorRegistry = Counter = Gauge = Histogram = None
+
+
+# Every metric lives in this registry, which /api/metrics exposes
+registry = CollectorRegistry(auto_describe=True) if CollectorRegistry else None
+
+
+class _NoopMetric:
+    """Stands in for every metric when prometheus_client is missing"""
+
+    def labels(self, *args, **kwargs):
+        return self
+
+    def observe(self, value):
+        pass
+
+    def inc(self, amount=1):
+        pass
+
+    def set(self, value):
+        pass
+
+
+def _metric(kind, name, documentation, labels=(), **kwargs):
+    if registry is None:
+        return _NoopMetric()
+    return kind(name, documentation, labels, registry=registry, **kwargs)
+
+
+def _histogram(name, documentation, buckets, labels=()):
+    return _metric(Histogram, name, documentation, labels, buckets=buckets)
+
+
+# Scraping, in the order a scrape goes through it
+LOGIN_SECONDS = _histogram(
+    'ao3_login_seconds', 'Logging in through the AO3 login form, including request slot waits',
+    (0.5, 1, 2, 5, 10, 20, 30, 60, 120, 300)
+)
+SLOT_WAIT_SECONDS = _histogram(
+    'ao3_slot_wait_seconds', 'Wait for an upstream request slot from the host scheduler',
+    (0.01, 0.1, 0.5, 1, 2, 3, 5, 10, 30, 60, 120, 300)
+)
+REQUEST_SECONDS = _histogram(
+    'ao3_request_seconds', 'One upstream HTTP round trip, excluding the slot wait',
+    (0.05, 0.1, 0.25, 0.5, 1, 2.5, 5, 10, 30, 60)
+)
+RESPONSES = _metric(Counter, 'ao3_responses', 'Upstream responses by status code', ('status',))
+PAGE_FETCH_SECONDS = _histogram(
+    'ao3_page_fetch_seconds', 'Fetching one history page, including slot waits and retries',
+    (0.5, 1, 2, 3, 5, 10, 20, 30, 60, 120, 300)
+)
+RETRIES = _metric(Counter, 'ao3_retries', 'Upstream retries by the status that caused them (or "error")', ('status',))
+DELAY_SECONDS = _histogram(
+    'ao3_delay_seconds', 'Retry and cooldown sleeps (delay())',
+    (1, 2, 5, 10, 20, 30, 60, 90, 120, 150, 300)
+)
+PAGE_PARSE_SECONDS = _histogram(
+    'ao3_page_parse_seconds', 'Parsing one history page',
+    (0.001, 0.0025, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1)
+)
+PAGE_ITEMS = _histogram(
+    'ao3_page_items', 'Work items found on one history page',
+    (0, 1, 5, 10, 15, 19, 20, 25)
+)
+
+# Statistics, cards and delivery
+STATISTICS_SECONDS = _histogram(
+    'ao3_statistics_seconds', 'Statistics work: "page" adds one page of items, "final" builds the result',
+    (0.0001, 0.0005, 0.001, 0.005, 0.01, 0.05, 0.1, 0.5, 1), ('stage',)
+)
+CARD_RENDER_SECONDS = _histogram(
+    'ao3_card_render_seconds', 'Drawing one stat card, excluding PNG encoding',
+    (0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1, 2.5), ('card',)
+)
+CARD_ENCODE_SECONDS = _histogram(
+    'ao3_card_encode_seconds', 'PNG encoding of one stat card',
+    (0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1, 2.5), ('card',)
+)
+CARD_CACHE_HITS = _metric(Counter, 'ao3_card_cache_hits', 'Stat cards served from the image cache', ('card',))
+SSE_PAYLOAD_BYTES = _histogram(
+    'ao3_sse_payload_bytes', 'Size of one server-sent event, by event name',
+    (100, 1000, 10000, 50000, 100000, 500000, 1000000, 5000000), ('event',)
+)
+
+# Sampled when /api/metrics is scraped
+JOBS = _metric(Gauge, 'ao3_jobs', 'Scrape jobs by state', ('state',))
+PACING_INTERVAL_SECONDS = _metric(
+    Gauge, 'ao3_pacing_interval_seconds', 'Current request interval of each upstream host', ('host',)
+)
+UPSTREAM_QUEUE_DEPTH = _metric(
+    Gauge, 'ao3_upstream_queue_depth', 'Scrapes waiting for an upstream request slot', ('host',)
+)
+
+
+def render_metrics():
+    """
+    Every metric in the Prometheus text format
+
+    Returns:
+        (body bytes, content type), or None when prometheus_client is missing
+    """
+    if registry is None:
+        return None
+    return generate_latest(registry), CONTENT_TYPE_LATEST
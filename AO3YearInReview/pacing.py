@@ -0,0 +1,482 @@
+import asyncio
+import itertools
+import os
+import random
+import threading
+import time
+from datetime import datetime, timezone
+from email.utils import parsedate_to_datetime
+
+try:
+    import redis
+except ImportError:
+    redis = None
+
+
+# Statuses that mean the upstream wants us to slow down
+THROTTLE_STATUSES = (429, 503)
+
+# Interval change after a throttled / successful response
+BACKOFF_FACTOR = 2.0
+RECOVERY_FACTOR = 0.9
+
+# Random extra wait, as a fraction of the interval, so requests don't tick like a clock
+JITTER = 0.1
+
+# Scrapes with at most this many pages left get NEAR_COMPLETION_WEIGHT times
+# the share of request slots of other scrapes
+NEAR_COMPLETION_PAGES = 3
+NEAR_COMPLETION_WEIGHT = 2.0
+
+# Shared pacer state in Redis expires after a day without requests
+REDIS_KEY_TTL = 24 * 60 * 60
+
+# Longest a wait goes without checking its cancel event, in seconds
+CANCEL_POLL_INTERVAL = 1.0
+
+# Seconds a Redis pacer call may take before it fails
+REDIS_SOCKET_TIMEOUT = 5.0
+
+
+async def call_pacer(pacer, method, *args):
+    """
+    Call one of `pacer`'s methods from a coroutine
+
+    A pacer whose state is remote makes a blocking round trip on every call,
+    so it is called from a worker thread instead of on the event loop.
+    """
+    if pacer.remote:
+        return await asyncio.to_thread(method, *args)
+    return method(*args)
+
+
+async def sleep_unless_cancelled(seconds, cancel_event=None):
+    """
+    asyncio.sleep for `seconds`, checking `cancel_event` (a threading.Event)
+    at least every CANCEL_POLL_INTERVAL seconds
+
+    Time is read from the running loop's clock, so on a virtual-time loop
+    (virtual_clock.py) the wait takes no real time.
+
+    Returns:
+        False if the event was set before the time was up, else True
+    """
+    loop = asyncio.get_running_loop()
+    deadline = loop.time() + seconds
+    while True:
+        if cancel_event is not None and cancel_event.is_set():
+            return False
+        remaining = deadline - loop.time()
+        if remaining <= 0:
+            return True
+        await asyncio.sleep(min(remaining, CANCEL_POLL_INTERVAL))
+
+
+def parse_retry_after(value):
+    """
+    Seconds to wait from a Retry-After header value
+
+    The header is either a number of seconds or an HTTP date. Returns None
+    when it is missing or unreadable.
+    """
+    if not value:
+        return None
+    value = value.strip()
+    try:
+        return max(0.0, float(value))
+    except ValueError:
+        pass
+    try:
+        retry_at = parsedate_to_datetime(value)
+    except (TypeError, ValueError):
+        return None
+    if retry_at.tzinfo is None:
+        retry_at = retry_at.replace(tzinfo=timezone.utc)
+    return max(0.0, (retry_at - datetime.now(timezone.utc)).total_seconds())
+
+
+class HostPacer:
+    """
+    Token bucket that spaces out requests to one upstream host
+
+    A token is added every `interval` seconds, up to `burst` tokens, and
+    each request takes one; when the bucket is empty, reserve() tells the
+    caller how long to wait for its turn. Reservations are handed out in
+    order, so concurrent scrapes share the host's rate instead of each
+    pacing itself.
+
+    The interval adapts to the host: a 429 or 503 multiplies it by
+    `backoff_factor` (up to `max_interval`) and holds every request until
+    Retry-After has passed, and each successful response multiplies it by
+    `recovery_factor` back towards `min_interval`, the polite minimum.
+
+    `clock` returns the current time in seconds; scrapes on a virtual-time
+    loop pass the loop's clock so a simulated scrape is paced in simulated
+    time.
+    """
+
+    # State is in this process, so calls never block for long
+    remote = False
+
+    def __init__(self, min_interval=3.0, max_interval=120.0, burst=1,
+                 backoff_factor=BACKOFF_FACTOR, recovery_factor=RECOVERY_FACTOR, clock=time.monotonic):
+        self.min_interval = min_interval
+        self.max_interval = max(min_interval, max_interval)
+        self.burst = burst
+        self.backoff_factor = backoff_factor
+        self.recovery_factor = recovery_factor
+        self.clock = clock
+        self.interval = min_interval
+        self.tokens = float(burst)
+        self.blocked_until = 0.0
+        self.requests = 0
+        self.throttled = 0
+        self._updated = clock()
+        self._lock = threading.Lock()
+
+    def _refill(self, now):
+        """Add the tokens earned since the last update; caller holds the lock"""
+        if self.interval > 0:
+            self.tokens = min(self.burst, self.tokens + (now - self._updated) / self.interval)
+        else:
+            self.tokens = float(self.burst)
+        self._updated = now
+
+    def reserve(self):
+        """Take the next request slot and return the seconds to wait for it"""
+        with self._lock:
+            now = self.clock()
+            self._refill(now)
+            self.tokens -= 1
+            self.requests += 1
+            wait = max(-self.tokens * self.interval, self.blocked_until - now, 0.0)
+            if wait > 0:
+                wait += random.uniform(0, JITTER * self.interval)
+            return wait
+
+    def on_success(self):
+        """The host answered normally: narrow the interval towards the minimum"""
+        with self._lock:
+            self._refill(self.clock())
+            self.interval = max(self.min_interval, self.interval * self.recovery_factor)
+
+    def on_throttle(self, retry_after=None):
+        """
+        The host answered 429/503: widen the interval and pause every request
+
+        Args:
+            retry_after: Seconds from the response's Retry-After header, if any;
+                without it the pause is one (widened) interval
+
+        Returns:
+            The widened interval
+        """
+        with self._lock:
+            now = self.clock()
+            self._refill(now)
+            self.throttled += 1
+            self.interval = min(self.max_interval, max(self.interval * self.backoff_factor, 1.0))
+            pause = retry_after if retry_after is not None else self.interval
+            self.blocked_until = max(self.blocked_until, now + pause)
+            # No saved-up burst once the pause is over
+            self.tokens = min(self.tokens, 0.0)
+            return self.interval
+
+    def stats(self):
+        with self._lock:
+            return {
+                'interval': round(self.interval, 3),
+                'blockedFor': round(max(0.0, self.blocked_until - self.clock()), 3),
+                'requests': self.requests,
+                'throttled': self.throttled,
+            }
+
+
+# One script for every pacer operation, so each is a single atomic step in
+# Redis. Redis truncates Lua numbers in replies, so values come back as strings.
+REDIS_PACER_SCRIPT = """
+local op = ARGV[1]
+local min_interval = tonumber(ARGV[2])
+local max_interval = tonumber(ARGV[3])
+local burst = tonumber(ARGV[4])
+local t = redis.call('TIME')
+local now = tonumber(t[1]) + tonumber(t[2]) / 1000000
+local s = redis.call('HMGET', KEYS[1], 'interval', 'tokens', 'updated', 'blocked_until', 'requests', 'throttled')
+local interval = tonumber(s[1]) or min_interval
+local tokens = tonumber(s[2]) or burst
+local updated = tonumber(s[3]) or now
+local blocked_until = tonumber(s[4]) or 0
+local requests = tonumber(s[5]) or 0
+local throttled = tonumber(s[6]) or 0
+if interval > 0 then
+    tokens = math.min(burst, tokens + (now - updated) / interval)
+else
+    tokens = burst
+end
+local result = '0'
+if op == 'reserve' then
+    tokens = tokens - 1
+    requests = requests + 1
+    result = {tostring(math.max(-tokens * interval, blocked_until - now, 0)), tostring(interval)}
+elseif op == 'success' then
+    interval = math.max(min_interval, interval * tonumber(ARGV[5]))
+elseif op == 'throttle' then
+    throttled = throttled + 1
+    interval = math.min(max_interval, math.max(interval * tonumber(ARGV[5]), 1))
+    local pause = tonumber(ARGV[6]) or interval
+    blocked_until = math.max(blocked_until, now + pause)
+    tokens = math.min(tokens, 0)
+    result = tostring(interval)
+elseif op == 'stats' then
+    return {tostring(interval), tostring(math.max(0, blocked_until - now)), tostring(requests), tostring(throttled)}
+end
+redis.call('HSET', KEYS[1], 'interval', tostring(interval), 'tokens', tostring(tokens), 'updated', tostring(now),
+           'blocked_until', tostring(blocked_until), 'requests', requests, 'throttled', throttled)
+redis.call('EXPIRE', KEYS[1], ARGV[7])
+return result
+"""
+
+
+class RedisHostPacer:
+    """
+    HostPacer whose bucket lives in Redis, shared by every process using it
+
+    Behaves like HostPacer, but the interval, tokens and Retry-After pause
+    are kept under one Redis key per host and timed by the Redis server's
+    clock, so several app processes or machines stay within one budget.
+    Every call is a blocking round trip; coroutines go through call_pacer.
+    """
+
+    remote = True
+
+    def __init__(self, client, host, min_interval=3.0, max_interval=120.0, burst=1):
+        self.min_interval = min_interval
+        self.max_interval = max(min_interval, max_interval)
+        self.burst = burst
+        self.key = f'ao3:pacer:{host}'
+        self._script = client.register_script(REDIS_PACER_SCRIPT)
+
+    def _call(self, op, factor=1.0, retry_after=None):
+        return self._script(keys=[self.key], args=[
+            op, self.min_interval, self.max_interval, self.burst, factor,
+            '' if retry_after is None else retry_after, REDIS_KEY_TTL,
+        ])
+
+    @property
+    def interval(self):
+        return self.stats()['interval']
+
+    def reserve(self):
+        # Jitter scales with the current, possibly backed-off, interval as in HostPacer
+        wait, interval = self._call('reserve')
+        wait = max(0.0, float(wait))
+        if wait > 0:
+            wait += random.uniform(0, JITTER * float(interval))
+        return wait
+
+    def on_success(self):
+        self._call('success', RECOVERY_FACTOR)
+
+    def on_throttle(self, retry_after=None):
+        return float(self._call('throttle', BACKOFF_FACTOR, retry_after))
+
+    def stats(self):
+        interval, blocked_for, requests, throttled = self._call('stats')
+        return {
+            'interval': round(float(interval), 3),
+            'blockedFor': round(float(blocked_for), 3),
+            'requests': int(requests),
+            'throttled': int(throttled),
+        }
+
+
+class UpstreamFlow:
+    """One scrape's share of an UpstreamScheduler; see UpstreamScheduler.open_flow"""
+
+    def __init__(self, scheduler):
+        self.scheduler = scheduler
+        self.pacer = scheduler.pacer
+        # Pages still to fetch, when known; few pages left raises the flow's share
+        self.remaining_pages = None
+        self.finish_tag = 0.0
+        self.granted = 0
+
+    @property
+    def weight(self):
+        if self.remaining_pages is not None and self.remaining_pages <= NEAR_COMPLETION_PAGES:
+            return NEAR_COMPLETION_WEIGHT
+        return 1.0
+
+    async def acquire_async(self, cancel_event=None):
+        """Wait for this scrape's next request slot; False if cancelled first"""
+        return await self.scheduler.acquire_async(self, cancel_event)
+
+
+class UpstreamScheduler:
+    """
+    Hands out one host's request slots fairly across the scrapes using it
+
+    Each scrape opens a flow and asks it for a slot before every request.
+    Slots are paced by the host's pacer and given out one at a time in
+    start-time fair queuing order: every flow gets an equal share however
+    many requests it has waiting, a new flow starts level with the others
+    rather than with saved-up credit, and flows within NEAR_COMPLETION_PAGES
+    of their last page get NEAR_COMPLETION_WEIGHT times the share so nearly
+    finished scrapes complete sooner. No flow is starved, and the total rate
+    never exceeds what the pacer allows.
+
+    Coroutines on any event loop can wait side by side: each waiter leaves a
+    wake-up callback, and whenever the turn is free only the flow that is
+    next is woken.
+    """
+
+    def __init__(self, pacer):
+        self.pacer = pacer
+        self.granted = 0
+        self._waiting = {}
+        self._virtual_time = 0.0
+        self._busy = False
+        self._sequence = itertools.count()
+        self._lock = threading.Lock()
+
+    def open_flow(self):
+        """A new flow for one scrape; it only holds state while it waits for a slot"""
+        flow = UpstreamFlow(self)
+        with self._lock:
+            flow.finish_tag = self._virtual_time
+        return flow
+
+    def _next_flow(self):
+        """The waiting flow with the earliest start tag; caller holds the lock"""
+        return min(self._waiting, key=lambda flow: self._waiting[flow][:2])
+
+    def _enqueue(self, flow, wake):
+        """Add a flow waiting for a slot; caller holds the lock"""
+        start_tag = max(self._virtual_time, flow.finish_tag)
+        self._waiting[flow] = (start_tag, next(self._sequence), wake)
+
+    def _take_turn(self, flow):
+        """Give `flow` the turn if it is next and the turn is free; caller holds the lock"""
+        if self._busy or self._next_flow() is not flow:
+            return False
+        start_tag = self._waiting.pop(flow)[0]
+        self._busy = True
+        self._virtual_time = start_tag
+        flow.finish_tag = start_tag + 1.0 / flow.weight
+        flow.granted += 1
+        self.granted += 1
+        return True
+
+    def _wake_next(self):
+        """Wake the flow that is next when the turn is free; caller holds the lock"""
+        while not self._busy and self._waiting:
+            flow = self._next_flow()
+            try:
+                self._waiting[flow][2]()
+                return
+            except RuntimeError:
+                # Its event loop has closed, so it will never take the turn
+                del self._waiting[flow]
+
+    def _leave(self, flow):
+        with self._lock:
+            self._waiting.pop(flow, None)
+            self._wake_next()
+
+    def _end_turn(self):
+        with self._lock:
+            self._busy = False
+            self._wake_next()
+
+    async def acquire_async(self, flow, cancel_event=None):
+        loop = asyncio.get_running_loop()
+        woken = asyncio.Event()
+        with self._lock:
+            self._enqueue(flow, lambda: loop.call_soon_threadsafe(woken.set))
+        try:
+            while True:
+                woken.clear()
+                with self._lock:
+                    if self._take_turn(flow):
+                        break
+                if cancel_event is not None and cancel_event.is_set():
+                    self._leave(flow)
+                    return False
+                try:
+                    await asyncio.wait_for(woken.wait(), CANCEL_POLL_INTERVAL)
+                except asyncio.TimeoutError:
+                    pass
+        except BaseException:
+            self._leave(flow)
+            raise
+
+        # The turn is held until the slot arrives, so the order set above is
+        # the order requests go out
+        try:
+            wait = await call_pacer(self.pacer, self.pacer.reserve)
+            return await sleep_unless_cancelled(wait, cancel_event)
+        finally:
+            self._end_turn()
+
+    def stats(self):
+        with self._lock:
+            waiting = len(self._waiting)
+            granted = self.granted
+        stats = self.pacer.stats()
+        stats.update({'queueDepth': waiting, 'granted': granted})
+        return stats
+
+
+_schedulers = {}
+_schedulers_lock = threading.Lock()
+_redis_client = None
+
+
+def _get_redis_client():
+    """Client for AO3_REDIS_URL, or None when it is unset or redis is missing"""
+    global _redis_client
+    url = os.environ.get('AO3_REDIS_URL')
+    if not url:
+        return None
+    if redis is None:
+        print('AO3_REDIS_URL is set but the redis package is not installed, pacing per process')
+        return None
+    if _redis_client is None:
+        _redis_client = redis.Redis.from_url(
+            url, socket_timeout=REDIS_SOCKET_TIMEOUT, socket_connect_timeout=REDIS_SOCKET_TIMEOUT,
+        )
+    return _redis_client
+
+
+def create_host_pacer(host):
+    """
+    Build a pacer from AO3_MIN_REQUEST_INTERVAL / AO3_MAX_REQUEST_INTERVAL / AO3_REQUEST_BURST
+
+    With AO3_REDIS_URL set the bucket is kept in Redis and shared by every
+    process pointed at it.
+    """
+    settings = {
+        'min_interval': float(os.environ.get('AO3_MIN_REQUEST_INTERVAL', 3)),
+        'max_interval': float(os.environ.get('AO3_MAX_REQUEST_INTERVAL', 120)),
+        'burst': int(os.environ.get('AO3_REQUEST_BURST', 1)),
+    }
+    client = _get_redis_client()
+    if client is not None:
+        return RedisHostPacer(client, host, **settings)
+    return HostPacer(**settings)
+
+
+def get_upstream_scheduler(host):
+    """The process-wide request scheduler for `host`, shared by every scrape"""
+    with _schedulers_lock:
+        scheduler = _schedulers.get(host)
+        if scheduler is None:
+            scheduler = _schedulers[host] = UpstreamScheduler(create_host_pacer(host))
+        return scheduler
+
+
+def pacer_stats():
+    """Pacing and queue stats of every host, keyed by host"""
+    with _schedulers_lock:
+        schedulers = dict(_schedulers)
+    return {host: scheduler.stats() for host, scheduler in schedulers.items()}
@@ -0,0 +1,165 @@
+import heapq
+from collections import Counter
+from itertools import chain, combinations
+from operator import attrgetter
+
+from work_item import WorkItem
+
+
+# How many entries the final statistics keep per top list
+TOP_N = 10
+
+# Entries per top list in the partial statistics sent with progress events
+PARTIAL_TOP_N = 5
+
+# Top list name -> (item field counted, key of each entry in the list)
+TOP_LISTS = {
+    'topTags': ('tags', 'tag'),
+    'topShips': ('relationships', 'ship'),
+    'topFandoms': ('fandoms', 'fandom'),
+    'topCharacters': ('characters', 'character'),
+}
+
+# Top lists included in the partial statistics
+PARTIAL_TOP_LISTS = ('topTags', 'topShips', 'topFandoms')
+
+# Small fixed vocabularies reported in full, most common first
+BREAKDOWNS = {
+    'warnings': ('warnings', 'warning'),
+    'categories': ('categories', 'category'),
+}
+
+# Only a work's first tags count towards tag pairs (when counted, see
+# StatsAggregator), at most 10 pairs per work; AO3 tags are listed in the
+# author's order of importance and a work can have dozens of them
+CO_OCCURRENCE_TAGS = 5
+
+
+def visited_in_year(item, year):
+    """True when the item's lastVisited date (ISO, YYYY-MM-DD...) falls in `year`"""
+    last_visited = item.get('lastVisited')
+    return bool(last_visited) and last_visited[:4] == f'{int(year):04d}'
+
+
+def top_entries(counter, n, key):
+    """
+    The `n` most frequent values as [{key: value, 'count': count}]
+
+    Ties keep first-seen order, matching a stable sort by count.
+    """
+    return [
+        {key: value, 'count': count}
+        for value, count in heapq.nlargest(n, counter.items(), key=lambda x: x[1])
+    ]
+
+
+def _tag_pairs(item):
+    return combinations(sorted(set(item.tags[:CO_OCCURRENCE_TAGS])), 2)
+
+
+class StatsAggregator:
+    """
+    Reading statistics that are updated a batch of work items at a time
+
+    Items are added as each history page is parsed, so partial top lists
+    are available during a scrape and the final statistics are ready as soon
+    as the last page is in. When `year` is set, items visited in other years
+    are ignored, matching the scraper's year filter.
+
+    Each batch is walked once for the per-item values (words, longest fic,
+    month, rating); every tag-like dimension is then counted with a single
+    Counter.update over the whole batch, which runs in C.
+
+    Tag pairs are the most expensive statistic, even capped at
+    CO_OCCURRENCE_TAGS tags per work, so they are only counted, and
+    `topTagPairs` only reported, with `tag_pairs=True`.
+    """
+
+    def __init__(self, year=None, tag_pairs=False):
+        self.year = year
+        self.count_tag_pairs = tag_pairs
+        self.total_fics = 0
+        self.total_words = 0
+        self.longest_fic = {'title': '', 'wordCount': 0, 'author': '', 'url': ''}
+        self.counters = {name: Counter() for name in chain(TOP_LISTS, BREAKDOWNS)}
+        self.tag_pairs = Counter()
+        self.month_fics = Counter()
+        self.month_words = Counter()
+        self.rating_fics = Counter()
+        self.rating_words = Counter()
+
+    def add(self, item):
+        """Count one work item"""
+        self.add_many((item,))
+
+    def add_many(self, items):
+        """Count a batch of work items, such as one history page"""
+        # Plain dicts (e.g. decoded JSON) are converted so fields are attributes
+        items = [item if isinstance(item, WorkItem) else WorkItem.from_dict(item) for item in items]
+        if self.year:
+            items = [item for item in items if visited_in_year(item, self.year)]
+        if not items:
+            return
+
+        self.total_fics += len(items)
+        for item in items:
+            word_count = item.wordCount
+            self.total_words += word_count
+
+            if word_count > self.longest_fic['wordCount']:
+                self.longest_fic = {
+                    'title': item.title,
+                    'wordCount': word_count,
+                    'author': item.author,
+                    'url': item.url
+                }
+
+            if item.lastVisited:
+                month = item.lastVisited[:7]  # ISO date: YYYY-MM
+                self.month_fics[month] += 1
+                self.month_words[month] += word_count
+
+            self.rating_fics[item.rating] += 1
+            self.rating_words[item.rating] += word_count
+
+        for name, (field, _) in chain(TOP_LISTS.items(), BREAKDOWNS.items()):
+            self.counters[name].update(chain.from_iterable(map(attrgetter(field), items)))
+        if self.count_tag_pairs:
+            self.tag_pairs.update(chain.from_iterable(_tag_pairs(item) for item in items))
+
+    def statistics(self, top_n=TOP_N):
+        """Statistics in the shape the frontend and the card renderer expect"""
+        stats = {
+            'totalFics': self.total_fics,
+            'totalWords': self.total_words,
+        }
+        for name, (_, key) in TOP_LISTS.items():
+            stats[name] = top_entries(self.counters[name], top_n, key)
+        stats['longestFic'] = dict(self.longest_fic)
+
+        for name, (_, key) in BREAKDOWNS.items():
+            stats[name] = [{key: value, 'count': count} for value, count in self.counters[name].most_common()]
+        if self.count_tag_pairs:
+            stats['topTagPairs'] = [
+                {'tags': list(pair), 'count': count}
+                for pair, count in heapq.nlargest(top_n, self.tag_pairs.items(), key=lambda x: x[1])
+            ]
+        stats['readingByMonth'] = [
+            {'month': month, 'fics': self.month_fics[month], 'words': self.month_words[month]}
+            for month in sorted(self.month_fics)
+        ]
+        stats['wordsByRating'] = [
+            {'rating': rating, 'fics': self.rating_fics[rating], 'words': words}
+            for rating, words in self.rating_words.most_common()
+        ]
+        return stats
+
+    def partial(self):
+        """Compact snapshot of the statistics so far, for progress events"""
+        stats = {
+            'totalFics': self.total_fics,
+            'totalWords': self.total_words,
+        }
+        for name in PARTIAL_TOP_LISTS:
+            stats[name] = top_entries(self.counters[name], PARTIAL_TOP_N, TOP_LISTS[name][1])
+        return stats
@@ -0,0 +1,296 @@
+import asyncio
+import os
+import secrets
+import threading
+import time
+
+from ao3_scraper import ScrapeCancelled
+
+
+# Job states
+QUEUED = 'queued'
+RUNNING = 'running'
+COMPLETE = 'complete'
+ERROR = 'error'
+CANCELLED = 'cancelled'
+
+FINISHED_STATES = (COMPLETE, ERROR, CANCELLED)
+
+# Events whose payloads are kept for listeners that fall behind or reconnect
+REPLAY_EVENTS = 50
+
+
+class JobQueueFull(Exception):
+    """Raised when a job is submitted while the queue is at capacity"""
+
+
+class Job:
+    """
+    A single scrape running on the worker pool
+
+    Progress is kept as an append-only list of (event, payload) pairs so any
+    number of listeners can stream it, each from its own position. Only the
+    last `replay_events` payloads are kept: older events stay in the list,
+    for their positions, with None in place of the payload. With None, every
+    payload is kept.
+    """
+
+    def __init__(self, description, key=None, replay_events=REPLAY_EVENTS):
+        self.id = secrets.token_urlsafe(16)
+        self.description = description
+        self.key = key
+        self.replay_events = replay_events
+        self.subscribers = 1
+        self.status = QUEUED
+        self.created_at = time.time()
+        self.finished_at = None
+        self.last_seen = self.created_at
+        self.result = None
+        self.error = None
+        self.progress = None
+        # (username, year) of the stored history that holds a scrape's items
+        self.history = None
+        self.cancel_event = threading.Event()
+        self._events = []
+        self._condition = threading.Condition()
+
+    def publish(self, event, payload):
+        """Append an event and wake every listener"""
+        with self._condition:
+            self._append(event, payload)
+            self._condition.notify_all()
+
+    def _append(self, event, payload):
+        if event == 'progress':
+            self.progress = payload
+        self._events.append((event, payload))
+        if self.replay_events is None:
+            return
+        # Forget the payload that just left the replay window
+        dropped = len(self._events) - self.replay_events - 1
+        if dropped >= 0:
+            self._events[dropped] = (self._events[dropped][0], None)
+
+    def events_since(self, index, timeout=None):
+        """
+        Return the events after position `index`, waiting up to `timeout`
+        seconds for a new one when there are none yet
+
+        Events that have left the replay window come back with a None payload.
+        """
+        self.touch()
+        with self._condition:
+            if index >= len(self._events) and not self.finished:
+                self._condition.wait(timeout)
+            return self._events[index:]
+
+    def wait(self, timeout=None):
+        """Block until the job has finished; return True if it did"""
+        deadline = None if timeout is None else time.time() + timeout
+        with self._condition:
+            while not self.finished:
+                self.touch()
+                remaining = 30 if deadline is None else min(30, deadline - time.time())
+                if remaining <= 0:
+                    return False
+                self._condition.wait(remaining)
+        return True
+
+    def touch(self):
+        """Record that a client is still interested in this job"""
+        self.last_seen = time.time()
+
+    @property
+    def finished(self):
+        return self.status in FINISHED_STATES
+
+    def _start(self):
+        """Move a queued job to running; False if it was cancelled meanwhile"""
+        with self._condition:
+            if self.status != QUEUED or self.cancel_event.is_set():
+                return False
+            self.status = RUNNING
+            return True
+
+    def _cancel(self):
+        """Flag the job for cancellation, finishing it at once if still queued"""
+        with self._condition:
+            self.cancel_event.set()
+            if self.status == QUEUED:
+                self.error = 'Job cancelled'
+                self._finish(CANCELLED, 'error', {'error': self.error})
+
+    def _finish(self, status, event, payload):
+        with self._condition:
+            self.status = status
+            self.finished_at = time.time()
+            self._append(event, payload)
+            self._condition.notify_all()
+
+    def to_dict(self):
+        """Status summary (no items) for the job status endpoint"""
+        return {
+            'jobId': self.id,
+            'status': self.status,
+            'createdAt': self.created_at,
+            'finishedAt': self.finished_at,
+            'progress': self.progress,
+            'error': self.error,
+        }
+
+
+class JobManager:
+    """
+    Runs jobs as coroutines on a shared event loop
+
+    Jobs run on one event loop thread, at most `max_async` at once, so jobs
+    that mostly wait on the network cost a coroutine each rather than a
+    thread. At most `max_queued` jobs wait for a turn;
+    anything beyond that is rejected with JobQueueFull. A reaper
+    thread cancels jobs nobody has checked on for `abandon_timeout` seconds
+    and forgets finished jobs after `job_ttl` seconds.
+
+    Jobs submitted with the same `key` while one is still running are
+    coalesced: later submitters get the running job back and share its events
+    and result instead of starting a second one.
+
+    Each job keeps the payloads of its last `replay_events` events (every
+    payload with None).
+    """
+
+    def __init__(self, max_queued=50, job_ttl=10 * 60, abandon_timeout=2 * 60, max_async=200,
+                 replay_events=REPLAY_EVENTS):
+        self.max_async = max_async
+        self.max_queued = max_queued
+        self.job_ttl = job_ttl
+        self.abandon_timeout = abandon_timeout
+        self.replay_events = replay_events
+        self._loop = asyncio.new_event_loop()
+        self._async_slots = asyncio.Semaphore(max_async)
+        self._loop_thread = threading.Thread(target=self._loop.run_forever, daemon=True, name='scrape-loop')
+        self._loop_thread.start()
+        self._jobs = {}
+        self._active_keys = {}
+        self._lock = threading.Lock()
+        self._reaper = threading.Thread(target=self._reap_forever, daemon=True)
+        self._reaper.start()
+
+    def submit(self, target, *args, key=None, description=None):
+        """
+        Queue the coroutine `target(job, *args)` and return its Job
+
+        The target reports progress with job.publish('progress', ...) and
+        returns the payload for the final 'complete' event. When `key` matches a job that is still queued or running, that
+        job is returned instead.
+        """
+        with self._lock:
+            if key is not None:
+                running = self._jobs.get(self._active_keys.get(key))
+                if running and not running.finished and not running.cancel_event.is_set():
+                    running.subscribers += 1
+                    print(f'Job {running.id} already running ({running.description}), attaching subscriber {running.subscribers}')
+                    return running
+
+            waiting = sum(1 for job in self._jobs.values() if job.status == QUEUED)
+            if waiting >= self.max_queued:
+                raise JobQueueFull('Too many scrapes are queued right now. Please try again in a few minutes.')
+            job = Job(description, key, self.replay_events)
+            self._jobs[job.id] = job
+            if key is not None:
+                self._active_keys[key] = job.id
+        job.publish('status', {'message': 'queued', 'jobId': job.id})
+        asyncio.run_coroutine_threadsafe(self._run(job, target, args), self._loop)
+        return job
+
+    def get(self, job_id):
+        with self._lock:
+            return self._jobs.get(job_id)
+
+    def cancel(self, job_id):
+        """
+        Withdraw one subscriber from a job; returns the job, or None if unknown
+
+        The job is only stopped once every subscriber has cancelled.
+        """
+        job = self.get(job_id)
+        if job and not job.finished:
+            with self._lock:
+                job.subscribers -= 1
+                stop = job.subscribers <= 0
+            if stop:
+                job._cancel()
+        return job
+
+    def stats(self):
+        """Counts of jobs by state, for health reporting"""
+        counts = {QUEUED: 0, RUNNING: 0, COMPLETE: 0, ERROR: 0, CANCELLED: 0}
+        with self._lock:
+            for job in self._jobs.values():
+                counts[job.status] += 1
+        counts['asyncSlots'] = self.max_async
+        return counts
+
+    def _begin(self, job):
+        """Start a job that got its turn; False if it was cancelled meanwhile"""
+        if not job._start():
+            return False
+        job.publish('status', {'message': 'running'})
+        print(f'Job {job.id} started ({job.description})')
+        return True
+
+    def _settle(self, job, result=None, error=None):
+        """Finish a job with its target's result or the exception it raised"""
+        if error is None:
+            job.result = result
+            job._finish(COMPLETE, 'complete', result)
+        elif isinstance(error, ScrapeCancelled):
+            job.error = 'Job cancelled'
+            job._finish(CANCELLED, 'error', {'error': job.error})
+        else:
+            job.error = str(error) or 'Failed to scrape history'
+            job._finish(ERROR, 'error', {'error': job.error})
+        print(f'Job {job.id} finished: {job.status}')
+
+    async def _run(self, job, target, args):
+        async with self._async_slots:
+            if not self._begin(job):
+                return
+            try:
+                result = await target(job, *args)
+            except Exception as e:
+                self._settle(job, error=e)
+            else:
+                self._settle(job, result)
+
+    def reap(self):
+        """Cancel abandoned jobs and drop expired finished ones"""
+        now = time.time()
+        with self._lock:
+            jobs = list(self._jobs.values())
+        for job in jobs:
+            if job.finished:
+                if now - job.finished_at > self.job_ttl:
+                    with self._lock:
+                        self._jobs.pop(job.id, None)
+                        if self._active_keys.get(job.key) == job.id:
+                            del self._active_keys[job.key]
+            elif now - job.last_seen > self.abandon_timeout:
+                print(f'Job {job.id} abandoned, cancelling')
+                job._cancel()
+
+    def _reap_forever(self):
+        while True:
+            time.sleep(30)
+            try:
+                self.reap()
+            except Exception as e:
+                print(f'Job reaper error: {e}')
+
+
+def create_job_manager(replay_events=REPLAY_EVENTS):
+    """Build the app's JobManager from AO3_ASYNC_SCRAPES / AO3_MAX_QUEUED_JOBS"""
+    return JobManager(
+        max_async=int(os.environ.get('AO3_ASYNC_SCRAPES', 200)),
+        max_queued=int(os.environ.get('AO3_MAX_QUEUED_JOBS', 50)),
+        replay_events=replay_events,
+    )
@@ -0,0 +1,139 @@
+import hashlib
+import hmac
+import json
+import os
+import secrets
+import sqlite3
+import time
+from contextlib import contextmanager
+
+from history_store import DEFAULT_DB_PATH, user_key
+
+try:
+    from cryptography.exceptions import InvalidTag
+    from cryptography.hazmat.primitives.ciphers.aead import AESGCM
+except ImportError:
+    print('cryptography not installed, AO3 logins will not be reused between scrapes')
+    AESGCM = None
+
+
+# How long a stored login is reused before logging in again, in seconds
+DEFAULT_SESSION_TTL = 12 * 60 * 60
+
+SCHEMA = '''
+CREATE TABLE IF NOT EXISTS login_sessions (
+    user_hash TEXT PRIMARY KEY,
+    nonce BLOB NOT NULL,
+    cookies BLOB NOT NULL,
+    expires_at REAL NOT NULL
+);
+'''
+
+
+class SessionStore:
+    """
+    Encrypted SQLite store of AO3 login cookies, keyed by a hash of the username
+
+    Cookies are sealed with AES-GCM under a key derived from the server
+    secret, the username and the user's password, so a stored login can only
+    be opened by someone who scrapes with the same password, and the
+    database alone reveals nothing. Entries expire after `ttl` seconds.
+    """
+
+    def __init__(self, path=DEFAULT_DB_PATH, secret=None, ttl=DEFAULT_SESSION_TTL):
+        self.path = path
+        self.ttl = ttl
+        self._secret = secret or secrets.token_bytes(32)
+        directory = os.path.dirname(path)
+        if directory:
+            os.makedirs(directory, exist_ok=True)
+        with self._connect() as conn:
+            conn.executescript(SCHEMA)
+
+    @contextmanager
+    def _connect(self):
+        """Open a connection for one transaction (committed on success)"""
+        conn = sqlite3.connect(self.path, timeout=30)
+        try:
+            conn.execute('PRAGMA journal_mode=WAL')
+            with conn:
+                yield conn
+        finally:
+            conn.close()
+
+    def _cipher(self, key, password):
+        """AES-GCM cipher for one user's cookies"""
+        material = key.encode('utf-8') + b'\0' + password.encode('utf-8')
+        return AESGCM(hmac.new(self._secret, material, hashlib.sha256).digest())
+
+    def load(self, username, password):
+        """
+        Return the user's stored cookies, or None
+
+        None when nothing is stored, the entry has expired, or it was sealed
+        with a different password.
+        """
+        key = user_key(username)
+        with self._connect() as conn:
+            row = conn.execute(
+                'SELECT nonce, cookies, expires_at FROM login_sessions WHERE user_hash = ?', (key,)
+            ).fetchone()
+            if row and row[2] <= time.time():
+                conn.execute('DELETE FROM login_sessions WHERE user_hash = ?', (key,))
+                row = None
+        if not row:
+            return None
+
+        try:
+            data = self._cipher(key, password).decrypt(row[0], row[1], key.encode('ascii'))
+        except InvalidTag:
+            return None
+        return json.loads(data)
+
+    def save(self, username, password, cookies):
+        """Store the cookies of a fresh login for `ttl` seconds, dropping expired logins"""
+        key = user_key(username)
+        nonce = secrets.token_bytes(12)
+        sealed = self._cipher(key, password).encrypt(
+            nonce, json.dumps(cookies).encode('utf-8'), key.encode('ascii')
+        )
+        now = time.time()
+        with self._connect() as conn:
+            conn.execute('DELETE FROM login_sessions WHERE expires_at <= ?', (now,))
+            conn.execute(
+                'INSERT OR REPLACE INTO login_sessions (user_hash, nonce, cookies, expires_at) VALUES (?, ?, ?, ?)',
+                (key, nonce, sealed, now + self.ttl)
+            )
+
+    def delete(self, username):
+        """Forget a user's stored login, e.g. once AO3 no longer accepts it"""
+        with self._connect() as conn:
+            conn.execute('DELETE FROM login_sessions WHERE user_hash = ?', (user_key(username),))
+
+
+def get_default_session_store():
+    """
+    Return the configured login store, or None when logins are not reused
+
+    Logins are kept in the history cache database (AO3_CACHE_DB) for
+    AO3_SESSION_TTL seconds (default 12 hours; 0 disables reuse). The
+    encryption secret comes from AO3_SESSION_KEY; without it a random
+    secret is used, so stored logins only last as long as the process.
+    """
+    path = os.environ.get('AO3_CACHE_DB', DEFAULT_DB_PATH)
+    ttl = float(os.environ.get('AO3_SESSION_TTL', DEFAULT_SESSION_TTL))
+    if AESGCM is None or ttl <= 0 or path.lower() in ('', 'off', 'none', '0'):
+        return None
+
+    secret = os.environ.get('AO3_SESSION_KEY')
+    if not secret:
+        print('AO3_SESSION_KEY not set, stored AO3 logins will not survive a restart')
+    try:
+        return SessionStore(
+            path,
+            secret=hashlib.sha256(secret.encode('utf-8')).digest() if secret else None,
+            ttl=ttl
+        )
+    except (sqlite3.Error, OSError) as e:
+        print(f'Login reuse disabled, could not open {path}: {e}')
+        return None
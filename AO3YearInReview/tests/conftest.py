@@ -0,0 +1,49 @@
+"""
+The app, running against the fake AO3 (benchmarks/fake_ao3.py)
+
+Usage:
+    python -m pytest tests
+"""
+import os
+import sys
+import tempfile
+import threading
+from argparse import Namespace
+from http.server import ThreadingHTTPServer
+
+import pytest
+
+HERE = os.path.dirname(os.path.abspath(__file__))
+sys.path.insert(0, os.path.join(HERE, '..', 'benchmarks'))
+sys.path.insert(0, os.path.join(HERE, '..'))
+
+from fake_ao3 import FakeAO3, Handler  # noqa: E402
+
+# Every fake user's history: PAGES pages of PER_PAGE works
+PAGES = 2
+PER_PAGE = 2
+
+
+# Started at import, before any test imports the app modules, which read
+# their settings from the environment when they are first imported
+server = ThreadingHTTPServer(('127.0.0.1', 0), Handler)
+server.daemon_threads = True
+server.ao3 = FakeAO3(Namespace(
+    pages=PAGES, per_page=PER_PAGE, seed=1, latency_ms=0, slow_rate=0, slow_ms=0,
+    rate_429=0, rate_503=0, rate_525=0, retry_after=1,
+))
+threading.Thread(target=server.serve_forever, daemon=True).start()
+
+os.environ.update({
+    'AO3_BASE_URL': f'http://127.0.0.1:{server.server_address[1]}',
+    'AO3_CACHE_DB': os.path.join(tempfile.mkdtemp(), 'history.sqlite3'),
+    'AO3_MIN_REQUEST_INTERVAL': '0.01',
+    'AO3_RENDER_PROCESSES': '0',
+    'AO3_SESSION_TTL': '0',
+})
+
+
+@pytest.fixture(scope='session')
+def app():
+    import app as app_module
+    return app_module
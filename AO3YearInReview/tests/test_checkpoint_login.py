@@ -0,0 +1,35 @@
+"""
+A resumed scrape must not hand out checkpointed items before AO3 accepts the login
+
+Runs the app against the fake AO3 (benchmarks/fake_ao3.py) with a cache
+database holding a checkpoint of someone's unfinished scrape.
+"""
+SECRET_ITEM = {
+    'title': 'A work only the account holder should see',
+    'author': 'someone',
+    'url': 'https://archiveofourown.org/works/999999999',
+    'lastVisited': '2024-01-05',
+}
+
+
+def scrape_events(app, username, password):
+    # More than one event's worth, which the app would publish right away
+    checkpoint = [dict(SECRET_ITEM, url=f'{SECRET_ITEM["url"]}{i}') for i in range(app.ITEMS_PER_EVENT + 1)]
+    app.history_store.save_checkpoint(username, None, 1, checkpoint)
+    response = app.app.test_client().get(
+        '/api/scrape-stream', query_string={'username': username, 'password': password}
+    )
+    return response.get_data(as_text=True)
+
+
+def test_wrong_password_gets_no_checkpoint_items(app):
+    body = scrape_events(app, 'victim', 'wrong')
+    assert 'event: error' in body
+    assert 'event: items' not in body
+    assert SECRET_ITEM['url'] not in body
+
+
+def test_logged_in_scrape_resumes_from_checkpoint(app):
+    body = scrape_events(app, 'reader', 'password')
+    assert 'event: complete' in body
+    assert SECRET_ITEM['url'] in body
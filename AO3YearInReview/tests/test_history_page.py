@@ -0,0 +1,70 @@
+"""
+parse_history_page on the saved fixture pages (benchmarks/fixtures)
+
+Each fixture must parse to the right shape within MAX_PEAK_KB of traced
+memory (tracemalloc sees Python allocations only, not lxml's C-level tree).
+The parse of every fixture is also timed with pytest-benchmark, so parser
+changes can be gated on speed:
+
+    python -m pytest tests/test_history_page.py --benchmark-autosave
+    python -m pytest tests/test_history_page.py --benchmark-compare --benchmark-compare-fail=mean:20%
+"""
+import tracemalloc
+
+import pytest
+
+from common import load_fixtures
+from history_parser import lxml, parse_history_page
+
+try:
+    import pytest_benchmark
+except ImportError:
+    pytest_benchmark = None
+
+# (items, has_next) each fixture must parse to
+EXPECTED = {
+    'readings_edge_cases.html': (4, False),
+    'readings_empty.html': (0, False),
+    'readings_page_1.html': (20, True),
+    'readings_page_2.html': (20, True),
+    'readings_page_3.html': (11, False),
+}
+
+# Peak traced memory of parsing one page; BeautifulSoup needs about 3 MiB
+MAX_PEAK_KB = 4096
+
+FIXTURES = dict(load_fixtures())
+
+BACKENDS = [
+    'bs4',
+    pytest.param('lxml', marks=pytest.mark.skipif(lxml is None, reason='lxml not installed')),
+]
+
+
+def test_every_fixture_is_checked():
+    assert sorted(FIXTURES) == sorted(EXPECTED)
+
+
+@pytest.mark.parametrize('backend', BACKENDS)
+@pytest.mark.parametrize('name', sorted(EXPECTED))
+def test_fixture_shape_and_memory(name, backend):
+    tracemalloc.start()
+    try:
+        items, has_next = parse_history_page(FIXTURES[name], backend)
+        _, peak = tracemalloc.get_traced_memory()
+    finally:
+        tracemalloc.stop()
+    assert (len(items), has_next) == EXPECTED[name]
+    assert peak / 1024 <= MAX_PEAK_KB
+
+
+@pytest.mark.skipif(pytest_benchmark is None, reason='pytest-benchmark not installed')
+@pytest.mark.parametrize('backend', BACKENDS)
+def test_parse_speed(benchmark, backend):
+    def parse_all():
+        return sum(len(parse_history_page(html, backend)[0]) for html in FIXTURES.values())
+
+    items = benchmark(parse_all)
+    assert items == sum(count for count, _ in EXPECTED.values())
+    if benchmark.stats:
+        benchmark.extra_info['items_per_sec'] = round(items / benchmark.stats.stats.mean)
@@ -0,0 +1,62 @@
+"""
+Merging checkpointed pages into the stored history, and skipping ahead by year
+"""
+import os
+
+import pytest
+
+from history_store import HistoryStore
+
+
+def work(name, last_visited):
+    return {'title': name, 'url': f'https://archiveofourown.org/works/{name}', 'lastVisited': last_visited}
+
+
+def stored(store, username):
+    """The stored history as [(title, lastVisited)], in position order"""
+    return [(item.title, item.lastVisited) for item in store.iter_items(username)]
+
+
+@pytest.fixture
+def store(tmp_path):
+    store = HistoryStore(os.path.join(tmp_path, 'history.sqlite3'))
+    # Two pages of history, newest visit first
+    store.save_checkpoint('reader', None, 1, [work('a', '2025-03-01'), work('b', '2025-02-01')])
+    store.save_checkpoint('reader', None, 2, [work('c', '2024-12-01'), work('d', '2024-06-01')])
+    assert store.commit_checkpoint('reader', None, 2, complete=True) == 4
+    return store
+
+
+def test_commit_puts_fetched_pages_on_top(store):
+    store.save_checkpoint('reader', None, 1, [work('new', '2025-04-01'), work('c', '2025-03-15')])
+    assert store.commit_checkpoint('reader', None, 1, complete=True) == 2
+    # The work fetched again replaces its stored entry; the rest follow in order
+    assert stored(store, 'reader') == [
+        ('new', '2025-04-01'), ('c', '2025-03-15'), ('a', '2025-03-01'), ('b', '2025-02-01'), ('d', '2024-06-01'),
+    ]
+    assert store.checkpoint_start('reader', None) is None
+
+
+def test_commit_with_a_missing_page_changes_nothing(store):
+    store.save_checkpoint('reader', None, 1, [work('new', '2025-04-01')])
+    store.save_checkpoint('reader', None, 3, [work('old', '2023-01-01')])
+    assert store.commit_checkpoint('reader', None, 3, complete=True) is None
+    assert [title for title, _ in stored(store, 'reader')] == ['a', 'b', 'c', 'd']
+    assert store.checkpoint_start('reader', None) == 2
+
+
+def test_skipped_pages_keep_newer_works_on_top(store):
+    # A scrape for 2024 that skipped page 1 and fetched from page 2 on
+    store.save_checkpoint('reader', 2024, 2, [work('c', '2024-12-01'), work('e', '2024-11-01')])
+    store.save_checkpoint('reader', 2024, 3, [work('d', '2024-06-01')])
+    assert store.commit_checkpoint('reader', 2024, 3, complete=True, first_page=2) == 5
+    assert [title for title, _ in stored(store, 'reader')] == ['a', 'b', 'c', 'e', 'd']
+
+
+def test_find_start_page_skips_pages_after_the_year(store):
+    store.save_checkpoint('reader', None, 1, [work('a', '2025-03-01'), work('b', '2025-02-01')])
+    store.save_checkpoint('reader', None, 2, [work('c', '2025-01-10'), work('d', '2025-01-01')])
+    store.save_checkpoint('reader', None, 3, [work('e', '2024-12-01'), work('f', '2024-11-01')])
+    assert store.find_start_page('reader', 2024) == 2
+    assert store.find_start_page('reader', 2025) is None
+    assert store.find_start_page('someone else', 2024) is None
@@ -0,0 +1,70 @@
+"""
+Jobs forget streamed items; full results are read back from the history cache
+"""
+import io
+import json
+
+import pytest
+
+from conftest import PAGES, PER_PAGE
+from scrape_jobs import REPLAY_EVENTS, Job
+
+
+def test_job_keeps_only_the_replay_window():
+    job = Job('test')
+    for page in range(REPLAY_EVENTS + 10):
+        job.publish('items', {'items': [page]})
+    events = job.events_since(0)
+    assert len(events) == REPLAY_EVENTS + 10
+    assert all(payload is None for _, payload in events[:10])
+    assert all(payload is not None for _, payload in events[10:])
+
+
+def test_late_listener_gets_one_resync(app):
+    job = Job('test')
+    for page in range(REPLAY_EVENTS + 10):
+        job.publish('items', {'items': []})
+    job._finish(app.COMPLETE, 'complete', {'totalItems': 0})
+    body = ''.join(app.stream_job_events(job).response)
+    assert body.count('event: resync') == 1
+    assert body.count('event: items') == REPLAY_EVENTS - 1
+    assert 'event: complete' in body
+
+
+def test_finished_job_items_come_from_the_store(app):
+    client = app.app.test_client()
+    job = client.post('/api/jobs', json={'username': 'storer', 'password': 'password'}).get_json()
+    events = client.get(f'/api/jobs/{job["jobId"]}/events').get_data(as_text=True)
+    assert 'event: complete' in events
+
+    items = json.loads(client.get(f'/api/jobs/{job["jobId"]}/items').get_data(as_text=True))
+    assert len(items) == PAGES * PER_PAGE
+    assert items == [item.to_dict() for item in app.history_store.iter_items('storer')]
+
+
+def test_scrape_returns_items_from_the_store(app):
+    response = app.app.test_client().post('/api/scrape', json={'username': 'legacy', 'password': 'password'})
+    assert response.status_code == 200
+    assert len(response.get_json()['items']) == PAGES * PER_PAGE
+    assert response.get_json()['statistics']['topTagPairs']
+
+
+def test_items_come_from_the_events_without_the_store(app, monkeypatch):
+    monkeypatch.setattr(app, 'history_store', None)
+    job = Job('test', replay_events=None)
+    for page in range(REPLAY_EVENTS + 10):
+        job.publish('items', {'items': [{'page': page}]})
+    job._finish(app.COMPLETE, 'complete', {'totalItems': REPLAY_EVENTS + 10})
+    assert list(app.job_history_items(job)) == [{'page': page} for page in range(REPLAY_EVENTS + 10)]
+
+
+def test_export_streams_from_the_store(app):
+    pyarrow_parquet = pytest.importorskip('pyarrow.parquet')
+    client = app.app.test_client()
+    job = client.post('/api/jobs', json={'username': 'exporter', 'password': 'password'}).get_json()
+    client.get(f'/api/jobs/{job["jobId"]}/events').get_data()
+
+    response = client.get('/api/export', query_string={'job': job['jobId'], 'format': 'parquet'})
+    assert response.status_code == 200
+    table = pyarrow_parquet.read_table(io.BytesIO(response.get_data()))
+    assert table.column('url').to_pylist() == [item['url'] for item in app.history_store.iter_items('exporter')]
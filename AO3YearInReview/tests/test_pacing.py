@@ -0,0 +1,101 @@
+"""
+Host pacer backoff and recovery, and fair sharing of its slots between scrapes
+"""
+import asyncio
+
+import pytest
+
+from pacing import JITTER, HostPacer, UpstreamScheduler
+
+
+class Clock:
+    def __init__(self):
+        self.now = 0.0
+
+    def __call__(self):
+        return self.now
+
+
+def test_throttle_widens_and_success_narrows_the_interval():
+    clock = Clock()
+    pacer = HostPacer(min_interval=1.0, max_interval=8.0, clock=clock)
+    assert pacer.reserve() == 0
+
+    assert pacer.on_throttle() == 2.0
+    # Paused for one widened interval, plus jitter
+    assert 2.0 <= pacer.reserve() <= 2.0 * (1 + JITTER)
+    for _ in range(5):
+        pacer.on_throttle()
+    assert pacer.interval == 8.0
+
+    for _ in range(30):
+        pacer.on_success()
+    assert pacer.interval == 1.0
+    assert pacer.stats()['throttled'] == 6
+
+
+def test_retry_after_pauses_every_request():
+    clock = Clock()
+    pacer = HostPacer(min_interval=1.0, burst=3, clock=clock)
+    pacer.on_throttle(retry_after=30)
+    assert 30 <= pacer.reserve() <= 30 + JITTER * pacer.interval
+
+    clock.now = 31.0
+    assert pacer.reserve() == 0
+    assert pacer.stats()['blockedFor'] == 0
+
+
+async def take_slots(flow, name, count, granted, remaining_pages=None):
+    flow.remaining_pages = remaining_pages
+    for _ in range(count):
+        assert await flow.acquire_async()
+        granted.append(name)
+
+
+def run_flows(*flows):
+    """Run (name, slots, remaining_pages) flows side by side; the order slots were granted in"""
+    pacer = HostPacer(min_interval=0.01)
+    # Spend the burst, so every flow is waiting by the time the first slot is free
+    pacer.reserve()
+    scheduler = UpstreamScheduler(pacer)
+    granted = []
+
+    async def main():
+        await asyncio.gather(*(
+            take_slots(scheduler.open_flow(), name, count, granted, remaining_pages)
+            for name, count, remaining_pages in flows
+        ))
+
+    asyncio.run(main())
+    return granted
+
+
+def test_flows_take_turns():
+    granted = run_flows(('a', 10, None), ('b', 10, None), ('c', 10, None))
+    # Every round of three slots goes to each flow once
+    for start in range(0, 30, 3):
+        assert sorted(granted[start:start + 3]) == ['a', 'b', 'c']
+
+
+def test_nearly_finished_flow_gets_a_double_share():
+    granted = run_flows(('done soon', 10, 2), ('busy', 10, None))
+    assert granted[:15].count('done soon') == 10
+
+
+@pytest.mark.parametrize('head_start', [1, 5])
+def test_late_flow_starts_level(head_start):
+    scheduler = UpstreamScheduler(HostPacer(min_interval=0.01))
+    granted = []
+
+    async def main():
+        early = scheduler.open_flow()
+        await take_slots(early, 'early', head_start, granted)
+        # No credit is saved up for the flow that joins now, nor held against the early one
+        await asyncio.gather(
+            take_slots(early, 'early', 4, granted),
+            take_slots(scheduler.open_flow(), 'late', 4, granted),
+        )
+
+    asyncio.run(main())
+    first = granted.index('late')
+    assert granted[first:first + 6] == ['late', 'early'] * 3
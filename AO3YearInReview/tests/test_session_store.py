@@ -0,0 +1,71 @@
+"""
+Stored AO3 logins: sealed per user and password, kept only once AO3 accepts them
+"""
+import asyncio
+import os
+import sqlite3
+
+import httpx
+import pytest
+
+pytest.importorskip('cryptography')
+
+from ao3_scraper import aiter_ao3_history  # noqa: E402
+from session_store import SessionStore  # noqa: E402
+
+COOKIES = {'_otwarchive_session': 'secret-session-value', 'user_credentials': '1'}
+
+
+class ForgetfulTransport(httpx.AsyncHTTPTransport):
+    """Accepts the login form, then loses the session on history pages"""
+
+    async def handle_async_request(self, request):
+        if '/readings' in request.url.path:
+            del request.headers['cookie']
+        return await super().handle_async_request(request)
+
+
+async def scrape(username, password, session_store, transport=None):
+    async for _ in aiter_ao3_history(username, password, retries=1, session_store=session_store,
+                                     transport=transport):
+        pass
+
+
+def test_unconfirmed_login_is_not_stored(tmp_path):
+    session_store = SessionStore(os.path.join(tmp_path, 'sessions.sqlite3'))
+    with pytest.raises(Exception, match='Login failed'):
+        asyncio.run(scrape('intruder', 'password', session_store, ForgetfulTransport()))
+    assert session_store.load('intruder', 'password') is None
+
+
+def test_accepted_login_is_stored(tmp_path):
+    session_store = SessionStore(os.path.join(tmp_path, 'sessions.sqlite3'))
+    asyncio.run(scrape('keeper', 'password', session_store))
+    assert session_store.load('keeper', 'password')
+
+
+def test_cookies_round_trip(tmp_path):
+    path = os.path.join(tmp_path, 'sessions.sqlite3')
+    SessionStore(path, secret=b'k' * 32).save('Reader', 'password', COOKIES)
+    assert SessionStore(path, secret=b'k' * 32).load('reader', 'password') == COOKIES
+
+    # Sealed, and keyed by a hash rather than the username
+    with sqlite3.connect(path) as conn:
+        rows = conn.execute('SELECT user_hash, cookies FROM login_sessions').fetchall()
+    assert len(rows) == 1
+    assert b'secret-session-value' not in rows[0][1]
+    assert 'reader' not in rows[0][0].lower()
+
+
+def test_only_the_same_password_and_secret_open_a_login(tmp_path):
+    path = os.path.join(tmp_path, 'sessions.sqlite3')
+    SessionStore(path, secret=b'k' * 32).save('reader', 'password', COOKIES)
+    assert SessionStore(path, secret=b'k' * 32).load('reader', 'other password') is None
+    assert SessionStore(path, secret=b'x' * 32).load('reader', 'password') is None
+    assert SessionStore(path, secret=b'k' * 32).load('someone else', 'password') is None
+
+
+def test_expired_login_is_dropped(tmp_path):
+    session_store = SessionStore(os.path.join(tmp_path, 'sessions.sqlite3'), ttl=-1)
+    session_store.save('reader', 'password', COOKIES)
+    assert session_store.load('reader', 'password') is None
@@ -0,0 +1,68 @@
+import asyncio
+import selectors
+
+
+class _SkippingSelector:
+    """
+    Selector that moves a VirtualClockLoop's clock forward instead of blocking
+
+    When the loop would wait for its next timer and no I/O is ready, the
+    clock jumps to that timer. Waits with no timer at all (only work in other
+    threads pending) still block for real.
+    """
+
+    def __init__(self, loop):
+        self._loop = loop
+        self._selector = selectors.DefaultSelector()
+
+    def select(self, timeout=None):
+        if timeout is None:
+            return self._selector.select(None)
+        events = self._selector.select(0)
+        if not events and timeout > 0:
+            self._loop.advance(timeout)
+        return events
+
+    def __getattr__(self, name):
+        # register, unregister, get_map, close, ...
+        return getattr(self._selector, name)
+
+
+class VirtualClockLoop(asyncio.SelectorEventLoop):
+    """
+    Event loop on a virtual clock that skips every wait
+
+    loop.time() starts at 0 and only moves when every task is waiting on a
+    timer, straight to the earliest one, so asyncio.sleep(), wait_for()
+    timeouts and sleep_unless_cancelled() return at once in real time while
+    their order and the simulated durations are kept. Used to replay scrape
+    timelines (benchmarks/simulate_pacing.py) in milliseconds; code run on
+    it must not wait on real network I/O.
+    """
+
+    def __init__(self):
+        self._now = 0.0
+        super().__init__(selector=_SkippingSelector(self))
+
+    def time(self):
+        return self._now
+
+    def advance(self, seconds):
+        """Move the clock forward by `seconds`"""
+        self._now += seconds
+
+
+def run_virtual(coro):
+    """
+    Run a coroutine to completion on a fresh VirtualClockLoop
+
+    Returns:
+        (the coroutine's result, simulated seconds it took)
+    """
+    loop = VirtualClockLoop()
+    try:
+        result = loop.run_until_complete(coro)
+        return result, loop.time()
+    finally:
+        loop.run_until_complete(loop.shutdown_asyncgens())
+        loop.close()
@@ -0,0 +1,96 @@
+import sys
+
+
+# Field order of the JSON shape sent to the frontend and stored in the cache
+FIELDS = (
+    'title', 'author', 'url', 'wordCount', 'tags', 'characters', 'relationships',
+    'warnings', 'categories', 'rating', 'fandoms', 'lastVisited',
+)
+
+# List fields whose values repeat across works and across users
+TAG_LIST_FIELDS = ('tags', 'characters', 'relationships', 'warnings', 'categories', 'fandoms')
+
+
+def intern_tags(values):
+    """Tuple of interned strings, so each distinct tag is kept in memory once"""
+    return tuple(sys.intern(value) for value in values)
+
+
+class WorkItem:
+    """
+    One work from a reading history, stored compactly
+
+    Fields live in __slots__ instead of a per-item dict, tag lists are
+    tuples, and tags, author and rating are interned, so a popular tag held
+    by thousands of items across many histories is a single string. Items
+    can be read like the old dicts (item['tags'], item.get('lastVisited'))
+    and to_dict() gives back the JSON shape.
+    """
+
+    __slots__ = FIELDS
+
+    def __init__(self, title, author, url, wordCount, tags, characters, relationships,
+                 warnings, categories, rating, fandoms, lastVisited):
+        self.title = title
+        self.author = sys.intern(author)
+        self.url = url
+        self.wordCount = wordCount
+        self.tags = intern_tags(tags)
+        self.characters = intern_tags(characters)
+        self.relationships = intern_tags(relationships)
+        self.warnings = intern_tags(warnings)
+        self.categories = intern_tags(categories)
+        self.rating = sys.intern(rating)
+        self.fandoms = intern_tags(fandoms)
+        self.lastVisited = lastVisited
+
+    @classmethod
+    def from_dict(cls, data):
+        """Build an item from its JSON shape (missing fields get empty values)"""
+        return cls(
+            data.get('title', ''),
+            data.get('author', 'Unknown'),
+            data.get('url', ''),
+            data.get('wordCount', 0),
+            data.get('tags', ()),
+            data.get('characters', ()),
+            data.get('relationships', ()),
+            data.get('warnings', ()),
+            data.get('categories', ()),
+            data.get('rating', 'Not Rated'),
+            data.get('fandoms', ()),
+            data.get('lastVisited')
+        )
+
+    def to_dict(self):
+        """The item in the JSON shape the frontend and the history cache use"""
+        data = {}
+        for field in FIELDS:
+            value = getattr(self, field)
+            data[field] = list(value) if field in TAG_LIST_FIELDS else value
+        return data
+
+    def __getitem__(self, field):
+        if field not in FIELDS:
+            raise KeyError(field)
+        return getattr(self, field)
+
+    def get(self, field, default=None):
+        return getattr(self, field) if field in FIELDS else default
+
+    def __eq__(self, other):
+        if not isinstance(other, WorkItem):
+            return NotImplemented
+        return all(getattr(self, field) == getattr(other, field) for field in FIELDS)
+
+    __hash__ = None
+
+    def __repr__(self):
+        return f'WorkItem(url={self.url!r}, title={self.title!r})'
+
+
+def json_default(value):
+    """`default` hook for json.dumps that writes WorkItems in their JSON shape"""
+    if isinstance(value, WorkItem):
+        return value.to_dict()
+    raise TypeError(f'Object of type {type(value).__name__} is not JSON serializable')